@@ -1,6 +1,9 @@
 #/usr/bin/env python3
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 VERSION="0.3"
 
@@ -31,6 +34,9 @@ only simple style that will work fine in ePUB files.
         "Topic :: Text Processing",
       ],
       packages=['splitoutline', ],
+      extras_require={
+        "report": ["numpy"],
+      },
       scripts=["scripts/splitoutline", ],
     )
 
@@ -15,18 +15,37 @@
 #  limitations under the License.
 
 import csv, codecs, io
+import collections
+import concurrent.futures
+import difflib
 import configparser
+import functools
+import hashlib
+import json
 import os
 import os.path
 import sys
 import re
+import time
 import locale
 import gettext
+import importlib
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from datetime import date
 from argparse import ArgumentParser
 
-from csvhelpers import *
+from .csvhelpers import read_table, read_tail, rewrite_tail, write_rows
+from .metrics import load_metrics, default_metrics
+from .output import ArchiveOutput, FileOutput, MemoryOutput, archive_mode, new_file
+from .sketch import BloomFilter, TopK
+from . import gitchanges
+from .exporter import RunMetrics
 
 version = "%{prog}s Version 0.3"
 
@@ -39,6 +58,15 @@ epilog = (
 )
 config_file="splitoutline.ini"
 
+# Commands given as the first argument, and the module which runs each.
+commands = {
+    "check": "check",
+    "report": "report",
+    "index": "index",
+    "search": "search",
+    "batch": "batch",
+}
+
 parser = ArgumentParser(usage=usage, 
                       description=description)
 parser.add_argument('--version', action='version', version=version,
@@ -51,11 +79,87 @@ parser.add_argument("-c", "--config", metavar="FILE", default=None,
                        "[default: %s]" % (os.path.relpath(config_file),))
 parser.add_argument("-d", "--dry-run", default=False, action="store_true",
                   help="Do not update any reStructuredText files.")
+parser.add_argument("-e", "--export", metavar="FILE", default=None,
+                  help="Only write the filtered book to FILE ('-' for stdout),"
+                       " leaving scenes, chapters and stats alone.")
+parser.add_argument("--depfile", metavar="FILE", default=None,
+                  help="Only write make dependency rules for the outline"
+                       " to FILE ('-' for stdout).")
+parser.add_argument("--archive", metavar="FILE", default=None,
+                  help="Write the generated files to the zip or tar archive"
+                       " FILE instead of in to the tree.")
+parser.add_argument("--chapter", metavar="N|TITLE", action="append", default=[],
+                  help="Only regenerate this chapter, by number, title or"
+                       " file name. May be given more than once.")
+parser.add_argument("--scene", metavar="REF", action="append", default=[],
+                  help="Only regenerate this scene's header and the chapter"
+                       " it is in. May be given more than once.")
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument("--structure-only", default=False, action="store_true",
+                  help="Only write the chapter stubs and scene headers,"
+                       " leaving chapters, stats and term pages alone.")
+mode.add_argument("--stats-only", default=False, action="store_true",
+                  help="Only count the scenes and write the stats, leaving"
+                       " scenes, chapters, stubs and term pages alone.")
+parser.add_argument("--git-changed", default=False, action="store_true",
+                  help="Only regenerate what depends on the files git"
+                       " reports changed since the last build.")
+parser.add_argument("--openmetrics", metavar="FILE", default=None,
+                  help="Write figures about the run to FILE in the"
+                       " OpenMetrics text format.")
+parser.add_argument("--openmetrics-port", metavar="PORT", type=int, default=None,
+                  help="Serve figures about the run from"
+                       " http://127.0.0.1:PORT/metrics while it lasts.")
 parser.add_argument("projects", nargs='*', metavar="PROJECT",
                   help="Select alternate projects from the config.")
- SplitOutline(object):
+@functools.lru_cache(maxsize=None)
+def term_name(text):
+    term = text.lower()
+    term = "_book".join(term.split(" (book"))
+    term = "".join(term.split(")"))
+    term = "".join(term.split("'"))
+    return "-".join(term.split())
+
+def windowed(iterable, behind, ahead):
+    """
+    Yield a window over `iterable` for each of its items, with the item at
+    index `behind`. Places before the start and after the end are None.
+    """
+    window = collections.deque([None] * behind, maxlen=behind + ahead + 1)
+    pending = 0
+    for item in iterable:
+        window.append(item)
+        pending += 1
+        if pending > ahead:
+            pending -= 1
+            yield window
+    while pending > 0:
+        window.append(None)
+        if len(window) < window.maxlen:
+            continue
+        pending -= 1
+        yield window
+
+def make_escape(path):
+    path = os.path.normpath(path)
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+class SplitOutline(object):
     _verbose = 0
     _dryrun = False
+    _exporting = False
+    metrics = ()
+    chapter_naming = "number"
+    book_toc_path = None
+    vocabulary = "exact"
+    vocabulary_memory = 256.0
+    filter_cache_lines = 20000
+    header_read = 4096
+    term_index_version = 2
+    outline_parser_version = 5
+    lexicon_version = 1
+    fingerprint_version = 1
+    fingerprint_buckets = 256
     outline_re = re.compile(r"^(?P<space>\s*)(?P<list>[*+-]|[0-9]+[.]?|[#][.])\s*")
     chapter_re = re.compile(r"^\s*(?:[*+-]|[0-9]+[.]?|[#][.])\s*(?P<title>[^<>]*?)\s*$")
     scene_re = re.compile(r"^\s*(?:[*+-]|[0-9]+[.]|[#][.])\s+.*?`(?P<text>[^`<]+?)\s*<(?P<ref>.*?)>.*\s*$")
@@ -63,11 +167,51 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
     role_re = re.compile(r"(?:[:](?P<domain>[a-z0-9-]+))?[:](?P<role>[a-zA-Z0-9-]+)[:]`(?P<text>[^<`]+)(?:\s+[<](?P<ref>[^>`]+)>)?\s*`")
     term_re = re.compile(r"[:]term[:]`\s*(?P<text>[^<`]+?)\s*`")
     link_re = re.compile(r"`\s*(?P<text>[^ `]+?)\s*`_")
-    footnote_re = re.compile(r"[[](?P<text>[^] []+)[]]_")
+    footnote_re = re.compile(r"\[(?P<text>[^]\[ ]+)\]_")
     section_re = re.compile(r"^([\]\[{}@?/\\%$&-=`;:'\"~^_*+#\)!\(<>|])\1+$")
     word_re = re.compile(r'(\w\S*\w|\w)')
-
-    epigraphs = {}
+    label_re = re.compile(r"^\s+:Label:\s+(?P<label>\S+)\s*$")
+    include_re = re.compile(r"^\.\. outline:include\s+(?P<path>\S.*?)\s*$")
+
+    def __init__(self, output=None):
+        # Everything a build changes is held by the instance, so separate
+        # instances may run at the same time in different threads.
+        if output is None:
+            output = FileOutput()
+        self.output = output
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the state of the last build, keeping the output and options.
+        """
+        self.stats = {}
+        self.termmap = {}
+        self.termsForChaps = {}
+        self.termpages = {}
+        self.termindex = None
+        self.termindex_seen = set()
+        self.lexicon = None
+        self.casecounts = {}
+        self.lowercase = None
+        self.capitals = None
+        self.vocabulary_base = None
+        self.vocabulary_added = []
+        self.rebuild_vocabulary = False
+        self.fingerprints = None
+        self.fingerprints_known = False
+        self.filtered = None
+        self.selected_scenes = None
+        self.git_changes = None
+        self.git_recording = False
+        self.git_paths = set()
+        self.unmatched = set()
+        self.epigraphs = {}
+        self.scenelists = {}
+        self.hitlist = {}
+        self.run_metrics = RunMetrics()
+        self.scene_count = 0
+        self.stats_lock = None
 
     def verbose(self, s, nonl=False):
         if self._verbose > 0:
@@ -76,6 +220,14 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             else:
                 print(s)
 
+    def phase(self, name):
+        # Called by main() as each step starts, and with None at the end.
+        # The memory benchmark measures between the calls.
+        self.run_metrics.written = self.output.written
+        self.run_metrics.phase(name)
+        if name is not None:
+            self.debug(1, "Starting %s" % (name,))
+
     def debug(self, i, s, nonl=False):
         if self._verbose > i:
             if nonl:
@@ -84,18 +236,160 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                 print(s)
 
     def parse_outline_file(self):
+        path = os.path.normpath(self.outline_path)
+        models = self.read_outlines(path)
+        data = []
+        self.outlineData = {}
+        self.outline_files = []
+        self.outline_warnings = []
+        self.stitch_outline(path, models, data, [])
+        for warning in self.outline_warnings:
+            print(warning)
+        if len(data) == 0:
+            print("WARNING: no chapters found.")
+            sys.exit(1)
+        self.outline = data
+        self.chapnames = self.chapter_names()
+        return data
 
-        outline_data = []
+    def read_outlines(self, path):
+        """
+        Read the outline at `path` and every outline it includes, returning
+        a dict of path to model. Each level of includes is read in parallel.
+        """
+        models = {}
+        pending = [path]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            while len(pending) > 0:
+                for outline, model in zip(pending, pool.map(self.read_outline, pending)):
+                    models[outline] = model
+                found = []
+                for outline in pending:
+                    for pos, ref in models[outline]["includes"]:
+                        include = os.path.normpath(self.find_path(ref, outline))
+                        if include not in models and include not in found:
+                            found.append(include)
+                pending = found
+        return models
+
+    def stitch_outline(self, path, models, data, active):
+        """
+        Add the chapters of the outline at `path` and the outlines it
+        includes to `data`, numbering untitled chapters across files.
+        """
+        if path in active:
+            print("Error: outline %s includes itself." % (path,))
+            sys.exit(1)
+        model = models[path]
+        self.outline_files.append(path)
+        self.run_metrics.add("outline_lines", model["lines"])
+        self.outline_warnings.extend(model["warnings"])
+        # Relative references in an included outline are relative to it.
+        top = os.path.dirname(os.path.normpath(self.outline_path))
+        def rebase(ref):
+            if len(active) == 0 or os.path.isabs(ref) or os.path.dirname(path) == top:
+                return ref
+            ref = os.path.relpath(self.find_path(ref, path), self.root)
+            return "/" + ref.replace(os.path.sep, "/")
+        keys = {}
+        for epigraph_name in model["epigraphs"]:
+            keys[epigraph_name] = rebase(epigraph_name)
+            self.epigraphs[keys[epigraph_name]] = True
+        includes = list(model["includes"])
+        untitled = set(model["untitled"])
+        local = model["outline"]
+        for i in range(len(local) + 1):
+            while len(includes) > 0 and includes[0][0] == i:
+                include = os.path.normpath(self.find_path(includes[0][1], path))
+                self.stitch_outline(include, models, data, active + [path])
+                del includes[0]
+            if i == len(local):
+                break
+            chapter = local[i][0]
+            if i in untitled:
+                keys[chapter] = "Chapter %u" % (len(data) + 1)
+            scenes = []
+            for scene in local[i][1:]:
+                keys[scene] = rebase(scene)
+                scenes.append(keys[scene])
+            data.append([keys.get(chapter, chapter)] + scenes)
+        for key, lines in model["data"].items():
+            self.outlineData[keys.get(key, key)] = lines
+
+    def read_outline(self, path):
+        # The parsed model is cached in the stat dir. A matching size and
+        # mtime is trusted unless the mtime is too recent to tell apart
+        # from a later edit; otherwise the text is hashed and compared.
+        try:
+            st = os.stat(path)
+        except OSError:
+            print("Error: Unable to open outline file %s." % (path,))
+            sys.exit(2)
+        cachepath = self.outline_cache_path(path)
+        cached = None
         try:
-            with codecs.open(self.outline_path, "rtU", "utf-8") as outlineFile:
-                outline_data = outlineFile.readlines()
+            with codecs.open(cachepath, "r", "utf-8") as cacheFile:
+                cached = json.load(cacheFile)
+            if (cached.get("version") != self.outline_parser_version
+                    or cached.get("path") != path):
+                cached = None
+        except (IOError, ValueError):
+            cached = None
+        if (cached is not None and cached["size"] == st.st_size
+                and cached["mtime"] == st.st_mtime_ns
+                and time.time() - st.st_mtime > 2):
+            return cached["model"]
+        try:
+            with codecs.open(path, "r", "utf-8") as outlineFile:
+                text = outlineFile.read()
         except IOError:
-            print("Error: Unable to open outline file.")
+            print("Error: Unable to open outline file %s." % (path,))
             sys.exit(2)
-
+        data = text.encode("utf-8")
+        self.run_metrics.add("read", len(data))
+        digest = hashlib.sha1(data).hexdigest()
+        if cached is not None and cached["digest"] == digest:
+            model = cached["model"]
+            if (cached["size"] == st.st_size
+                    and cached["mtime"] == st.st_mtime_ns):
+                return model
+        else:
+            model = self.parse_outline(text.splitlines(True))
+        if not self._dryrun and not self._exporting and self.output.caches:
+            cached = {
+                "version": self.outline_parser_version,
+                "path": path,
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "digest": digest,
+                "model": model,
+            }
+            with self.output.open(cachepath) as out:
+                json.dump(cached, out, separators=(",", ":"))
+        return model
+
+    def outline_cache_path(self, path):
+        name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, self.statdir, "outlines",
+                            name[:16] + ".json")
+
+    def parse_outline(self, outline_data):
+        """
+        Parse the lines of an outline in to a model of the chapters (title
+        then scene references), the outline lines belonging to each
+        chapter, scene and epigraph, the epigraph references, the outlines
+        included (with the number of chapters before each), any warnings,
+        the first line of each chapter dropped for having no scenes and the
+        positions of the chapters whose title was made up from their number.
+        """
         chNum = 0;
         data = []
-        self.outlineData = {}
+        outlineData = {}
+        epigraphs = []
+        includes = []
+        warnings = []
+        dropped = []
+        lines = len(outline_data)
         start = 0
         end = None
         for i in range(len(outline_data)):
@@ -108,9 +402,26 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                 outline_data = outline_data[start:]
             else:
                 outline_data = outline_data[start:end]
+        # Chapters whose title was made up from their number.
+        untitled = []
+        def drop_last():
+            # No scenes. Forget it.
+            dropped.append(outlineData[data[-1][0]][0].strip())
+            if len(untitled) > 0 and untitled[-1] == len(data) - 1:
+                del untitled[-1]
+            del data[-1]
         lastData = None
         lastHead = []
         for line in outline_data:
+            includeMatch = self.include_re.match(line)
+            if includeMatch is not None:
+                if len(data) > 0 and len(data[-1]) == 1:
+                    drop_last()
+                    chNum -= 1
+                includes.append([len(data), includeMatch.group("path")])
+                lastData = None
+                lastHead = []
+                continue
             outMatch = self.outline_re.match(line)
             epiMatch = self.epigraph_re.match(line)
             if outMatch is None and epiMatch is None:
@@ -142,33 +453,35 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if chapMatch is None and sceneMatch is None and epiMatch is None:
                 if len(lastHead) == 1:
                     if len(data) > 0 and len(data[-1]) == 1:
-                        del data[-1] # No scenes. Forget it.
+                        drop_last()
                     else:
                         chNum += 1
                     chapter = "Chapter %u" % chNum
                     data.append([chapter])
+                    untitled.append(len(data) - 1)
                     lastData = [line]
-                    self.outlineData[chapter] = lastData
+                    outlineData[chapter] = lastData
 
                 if lastData is not None:
                     lastData.append(line)
                 continue
             if chapMatch is not None and sceneMatch is not None:
-                print("WARNING: line matches chapter and scene:", line)
+                warnings.append("WARNING: line matches chapter and scene: " + line)
                 continue
             if chapMatch is not None and len(lastHead) == 1:
                 chapter = chapMatch.group("title")
                 if chapter is None:
                     continue
                 if len(data) > 0 and len(data[-1]) == 1:
-                    del data[-1] # No scenes. Forget it.
+                    drop_last()
                 else:
                     chNum += 1
                 if chapter == "":
                     chapter = "Chapter %u" % chNum
+                    untitled.append(len(data))
                 data.append([chapter])
                 lastData = [line]
-                self.outlineData[chapter] = lastData
+                outlineData[chapter] = lastData
             elif chapMatch is not None:
                 chapter = chapMatch.group("title")
                 if chapter.strip() != "" and lastData is not None:
@@ -177,37 +490,62 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if sceneMatch is not None:
                 if len(lastHead) == 1: # No existing chapter!
                     if len(data) > 0 and len(data[-1]) == 1:
-                        del data[-1] # No scenes. Forget it.
+                        drop_last()
                     else:
                         chNum += 1
                     chapter = sceneMatch.group("text")
                     data.append([chapter])
                     lastData = [line]
-                    self.outlineData[chapter] = lastData
+                    outlineData[chapter] = lastData
 
                 last_scene = sceneMatch.group("ref")
                 lastData = [line]
-                self.outlineData[last_scene] = lastData
+                outlineData[last_scene] = lastData
                 data[-1].append(last_scene)
             if epiMatch is not None:
                 epigraph_name = epiMatch.group("ref")
-                self.epigraphs[epigraph_name] = True
+                epigraphs.append(epigraph_name)
                 lastData = [line]
-                self.outlineData[epigraph_name] = lastData
-        if len(data) == 0:
-            print("WARNING: no chapters found.")
-            sys.exit(1)
-        self.outline = data
-        return data
+                outlineData[epigraph_name] = lastData
+        return {"outline": data, "data": outlineData, "epigraphs": epigraphs,
+                "includes": includes, "warnings": warnings, "dropped": dropped,
+                "untitled": untitled, "lines": lines}
 
-    def create_chapter_stubs(self):
-        chNum = 0
+    def chapter_names(self):
         chfmt = "%%0%uu" % (len(str(len(self.outline))),)
+        names = []
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            if self.chapter_naming != "label":
+                names.append(chfmt % (chNum,))
+                continue
+            name = ch[0]
+            for line in self.outlineData.get(ch[0], []):
+                labelMatch = self.label_re.match(line)
+                if labelMatch is not None:
+                    name = labelMatch.group("label")
+                    break
+            name = re.sub(r"[\W_]+", "-", name.lower()).strip("-")
+            if name == "":
+                name = chfmt % (chNum,)
+            unique = name
+            dup = 1
+            while unique in names:
+                dup += 1
+                unique = "%s-%u" % (name, dup)
+            names.append(unique)
+        return names
+
+    def create_chapter_stubs(self, selected=None):
+        chNum = 0
         for ch in self.outline:
             chNum += 1
+            if selected is not None and chNum not in selected:
+                continue
             chappath = os.path.join(self.chapterstub_path,
                                     self.chapterstub_prefix
-                                    + chfmt % (chNum,)
+                                    + self.chapnames[chNum-1]
                                     + self.suffix)
             title = ch[0]
             d = '*' * len(title)
@@ -215,7 +553,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if self._dryrun:
                 chapfile = sys.stdout
             else:
-                chapfile = codecs.open(chappath, "wt", "utf-8")
+                chapfile = self.output.open(chappath)
 
             ref = chappath
             if ref.endswith(self.suffix):
@@ -390,6 +728,17 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
         else:
             sys.stdout.write("Failed to find %s\n" % statpath)
 
+        # The digest lets an unchanged block be spotted from the top of the
+        # scene, without reading and scanning all of it.
+        digest = hashlib.sha1("\n".join(outlineJunk).encode("utf-8")).hexdigest()[:16]
+        outlineJunk[2:2] = ["   .. outline-digest: %s" % (digest,), ""]
+
+        if (os.path.isfile(scenePath + self.suffix)
+                and self.header_is_current(scenePath + self.suffix, digest)):
+            if self._dryrun:
+                sys.stdout.write("# End rewriting. No change to '" + scenePath + "'. Would not modify.\n")
+            return
+
         if not os.path.isfile(scenePath + self.suffix):
             if len(self.outlineData.get(scene, [])) == 0:
                 sys.stdout.write("No scene data for %s\n" % scene)
@@ -398,8 +747,6 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if not os.path.isdir(dirname):
                 if self._dryrun:
                     print("Would make directories: ", dirname)
-                elif not os.path.isdir(dirname):
-                    os.makedirs(dirname)
 
             sceneMatch = self.scene_re.match(self.outlineData.get(scene)[0])
             if sceneMatch is None:
@@ -413,7 +760,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                 print("    ", scenePath)
             else:
                 self.verbose("Creating missing scene %s\n" % scenePath)
-                with codecs.open(scenePath + self.suffix, "wt", "utf-8") as out:
+                with self.output.open(scenePath + self.suffix) as out:
 
                     ref = sceneMatch.group("ref")
                     ref = re.sub(r"[-._/]+", "-", ref)
@@ -430,7 +777,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                         out.write(".. todo::\n   Write :ref:`" + ref + "`\n\n")
 
         else:
-            sceneFile = codecs.open(scenePath + self.suffix, "rtU", "utf-8")
+            sceneFile = codecs.open(scenePath + self.suffix, "r", "utf-8")
             lines = sceneFile.readlines()
             sceneFile.close()
             
@@ -506,7 +853,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if self._dryrun:
                 out = sys.stdout
             else:
-                out = codecs.open(scenePath + ".new", "wt", "utf-8")
+                out = self.output.open(scenePath + self.suffix)
 
             sceneMatch = self.scene_re.match(self.outlineData.get(scene)[0])
             if sceneMatch is None:
@@ -529,6 +876,16 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                     wrote = False
                     eatTitle = True
 
+                    if cutStart is None and lines[i].strip() == "":
+                        # Keep the blank line after the title ahead of
+                        # the block, and put one after it too.
+                        out.write(lines[i])
+                        if len(outlineJunk) > 0:
+                            out.write("\n".join(outlineJunk))
+                            out.write("\n")
+                            out.write("\n..\n")
+                        out.write(lines[i])
+                        continue
                     if len(outlineJunk) > 0:
                         out.write("\n".join(outlineJunk))
                         out.write("\n")
@@ -543,20 +900,24 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
 
             if not self._dryrun:
                 out.close()
-            os.rename(scenePath + ".new", scenePath + self.suffix)
         if self._dryrun:
             sys.stdout.write("# end rewriting " + scene + " \n")
 
+    def header_is_current(self, path, digest):
+        with codecs.open(path, "r", "utf-8") as sceneFile:
+            head = sceneFile.read(self.header_read)
+        return (".. container:: from-outline\n\n   .. outline-digest: %s\n"
+                % (digest,)) in head
+
     def create_book(self):
         chNum = 0
-        chfmt = "%%0%uu" % (len(str(len(self.outline))),)
         bookpath = self.book_toc_path
 
         if self._dryrun:
             bookfile = sys.stdout
             bookfile.write(".. "+ bookpath + "\n\n")
         else:
-            bookfile = codecs.open(bookpath, "wt", "utf-8")
+            bookfile = self.output.open(bookpath)
 
         d = '*' * len(self.book_title)
         bookfile.write(d + "\n")
@@ -568,93 +929,284 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             chNum += 1
             chappath = os.path.join(self.chapter_path,
                                     self.chapter_prefix
-                                    + chfmt % (chNum,)
-                                    + self.suffix)
-            chappath = os.path.relpath(chappath, bookpath)
-            bookfile.write("   %s\n" % chappath)
+                                    + self.chapnames[chNum-1])
+            chappath = os.path.relpath(chappath, os.path.dirname(bookpath))
+            bookfile.write("   %s\n" % chappath.replace(os.path.sep, "/"))
         if not self._dryrun:
             bookfile.close()
             bookfile = None
         return
 
-    def create_chapters(self):
+    def create_chapters(self, selected=None):
         chNum = 0
-        chfmt = "%%0%uu" % (len(str(len(self.outline))),)
         self.termsForChaps = {}
         for ch in self.outline:
             chNum += 1
+            if selected is not None and chNum not in selected:
+                continue
             chappath = os.path.join(self.chapter_path,
                                     self.chapter_prefix
-                                    + chfmt % (chNum,)
+                                    + self.chapnames[chNum-1]
                                     + self.suffix)
-            title = ch[0]
-            d = '*' * len(title)
             self.termsForChaps[chNum] = {}
 
             if self._dryrun:
                 chapfile = sys.stdout
                 chapfile.write(".. "+ chappath + "\n\n")
             else:
-                chapfile = codecs.open(chappath, "wt", "utf-8")
+                chapfile = self.output.open(chappath)
 
-            chapfile.write(d + "\n")
-            chapfile.write(title + "\n")
-            chapfile.write(d + "\n")
-            chapfile.write("\n")
+            self.write_chapter(chapfile, ch, self.termsForChaps[chNum])
+            if not self._dryrun:
+                chapfile.close()
+                chapfile = None
+        return
 
-            need_separator = False
+    def count_chapters(self, selected=None):
+        # The stats of create_chapters without writing anything.
+        chNum = 0
+        self.termsForChaps = {}
+        for ch in self.outline:
+            chNum += 1
+            if selected is not None and chNum not in selected:
+                continue
+            self.termsForChaps[chNum] = {}
             for scene in ch[1:]:
                 scenePath = self.find_path(scene, self.outline_path)
+                for line in self.filter_lines(scenePath, self.termsForChaps[chNum]):
+                    pass
+
+    def rewrite_headers(self, selected=None):
+        # The scene headers create_chapters would have rewritten.
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            if selected is not None and chNum not in selected:
+                continue
+            for scene in ch[1:]:
+                if self.selected_scenes is None or scene in self.selected_scenes:
+                    self.rewrite_scene(scene, ch[0])
+
+    def write_chapter(self, chapfile, ch, terms, rewrite=True):
+        title = ch[0]
+        d = '*' * len(title)
+        chapfile.write(d + "\n")
+        chapfile.write(title + "\n")
+        chapfile.write(d + "\n")
+        chapfile.write("\n")
+
+        need_separator = False
+        for scene in ch[1:]:
+            scenePath = self.find_path(scene, self.outline_path)
+            if rewrite and (self.selected_scenes is None
+                            or scene in self.selected_scenes):
                 self.rewrite_scene(scene, ch[0])
-                filtered = self.filter_lines(scenePath, self.termsForChaps[chNum])
-                if len(filtered) > 0:
+            first = True
+            for line in self.filter_lines(scenePath, terms):
+                if first:
+                    first = False
                     if need_separator:
                         chapfile.write("----\n\n")
                     need_separator = True
                     if scene in self.epigraphs:
                         need_separator = False
-                    chapfile.write("\n".join(filtered))
-                    chapfile.write("\n")
-            if not self._dryrun:
-                chapfile.close()
-                chapfile = None
-        return
+                chapfile.write(line + "\n")
+
+    def export_book(self, out):
+        # The scene headers are left alone and nothing is counted.
+        for ch in self.outline:
+            self.write_chapter(out, ch, {}, rewrite=False)
 
-    def gather_terms(self, marker, line, terms={}):
+    def gather_terms(self, marker, line, terms):
+        if ":term:" not in line:
+            return
         for term in self.term_re.finditer(line):
-            term = term.group(1)
-            term = term.lower()
-            term = "_book".join(term.split(" (book"))
-            term = "".join(term.split(")"))
-            term = "".join(term.split("'"))
-            term = "-".join(term.split())
+            term = term_name(term.group(1))
             terms[term] = terms.get(term, 0) + 1
+
+    def add_terms(self, marker, sceneterms, terms):
+        for term in sceneterms:
+            terms[term] = terms.get(term, 0) + sceneterms[term]
             if term not in self.termmap:
                 self.termmap[term] = set()
             self.termmap[term].add(marker)
 
-    def filter_lines(self, inPath, terms={}):
+    def indexed_terms(self, known):
+        # The terms of the scene text and of its from-outline block.
+        terms = dict(known.get("terms", {}))
+        for term, count in known.get("outline", {}).items():
+            terms[term] = terms.get(term, 0) + count
+        return terms
+
+    def known_terms(self, marker, digest, blockterms, terms):
+        if self.termindex is not None:
+            self.termindex_seen.add(marker)
+            known = self.termindex.get(marker)
+            if known is not None and known.get("digest") == digest:
+                # The text is unchanged since the index was saved; only
+                # the from-outline block may have been rewritten.
+                known["outline"] = blockterms
+                self.add_terms(marker, self.indexed_terms(known), terms)
+                return None
+        return {}
+
+    def store_terms(self, marker, digest, sceneterms, blockterms, terms):
+        if self.termindex is not None:
+            bodyterms = {}
+            for term, count in sceneterms.items():
+                if count > blockterms.get(term, 0):
+                    bodyterms[term] = count - blockterms.get(term, 0)
+            self.termindex[marker] = {"digest": digest, "terms": bodyterms,
+                                      "outline": blockterms}
+        self.add_terms(marker, sceneterms, terms)
+
+    def scene_digest(self, scenePath):
+        """
+        Return the digest of the scene without its from-outline block, which
+        only changes with the outline, and the terms found in the block.
+        """
+        body = hashlib.sha1()
+        blockterms = {}
+        inBlock = False
+        with codecs.open(scenePath, "r", "utf-8") as inFile:
+            self.run_metrics.add("read", os.fstat(inFile.fileno()).st_size)
+            for line in inFile:
+                if inBlock:
+                    if line.strip() == "" or line[0].isspace():
+                        self.gather_terms(None, line, blockterms)
+                        continue
+                    inBlock = False
+                elif line.startswith(".. container:: from-outline"):
+                    inBlock = True
+                    continue
+                body.update(line.encode("utf-8"))
+        return body.hexdigest(), blockterms
+
+    def term_index_path(self):
+        return os.path.join(self.root, self.statdir, "terms.json")
+
+    def load_term_index(self):
+        self.termindex = {}
+        self.termpages = {}
         try:
-            inFile = codecs.open(inPath + self.suffix, "rtU", "utf-8")
-        except IOError:
-            # can only happen in _dryrun
-            sys.stdout.write("MISSING FILE: " + inPath + "\n\n")
+            with codecs.open(self.term_index_path(), "r", "utf-8") as indexFile:
+                data = json.load(indexFile)
+        except (IOError, ValueError):
+            return
+        if data.get("version") != self.term_index_version:
+            return
+        self.termindex = data.get("scenes", {})
+        self.termpages = data.get("pages", {})
+
+    def save_term_index(self):
+        if self._dryrun or self.termindex is None or not self.output.caches:
             return
+        seen = self.termindex_seen
+        data = {
+            "version": self.term_index_version,
+            "scenes": dict([(m, self.termindex[m]) for m in self.termindex if m in seen]),
+            "pages": self.termpages,
+        }
+        with self.output.open(self.term_index_path()) as out:
+            json.dump(data, out, sort_keys=True)
+
+    def filter_lines(self, inPath, terms=None):
+        if terms is None:
+            terms = {}
+        scenePath = inPath + self.suffix
+        if not os.path.isfile(scenePath):
+            # can only happen in _dryrun or when exporting
+            sys.stderr.write("MISSING FILE: " + inPath + "\n\n")
+            return
+        if self._exporting:
+            # Nothing is counted or remembered, so the scene is only read
+            # to be filtered.
+            self.run_metrics.scene("filtered")
+            with codecs.open(scenePath, "r", "utf-8") as inFile:
+                self.run_metrics.add("read", os.fstat(inFile.fileno()).st_size)
+                for line in self.filter_scene(inPath, inFile, counting=False):
+                    yield line
+            return
+        marker = os.path.relpath(inPath, self.root)
+        body, blockterms = self.scene_digest(scenePath)
+        sceneterms = self.known_terms(marker, body, blockterms, terms)
+        cases = self.known_cases(marker, body)
+        prints = self.known_fingerprint(marker, body)
+        counting = True
+        # Scenes shared between projects only differ in their
+        # from-outline block, which is never part of the output.
+        key = (marker, body)
+        if self.filtered is not None and key in self.filtered:
+            counting = False
+            if self.filtered[key] is not None:
+                self.run_metrics.scene("reused")
+                if sceneterms is not None:
+                    with codecs.open(scenePath, "r", "utf-8") as inFile:
+                        for line in inFile:
+                            self.gather_terms(marker, line, sceneterms)
+                    self.store_terms(marker, body, sceneterms, blockterms, terms)
+                if self._dryrun:
+                    sys.stdout.write("# reusing filtered scene " + inPath + "\n")
+                for line in self.filtered[key]:
+                    yield line
+                return
 
         if self._dryrun:
             sys.stdout.write("# start filtering scene " + inPath + "\n")
+        keep = None
+        if self.filtered is not None and counting:
+            keep = []
+        self.run_metrics.scene("filtered")
+        with codecs.open(scenePath, "r", "utf-8") as inFile:
+            self.run_metrics.add("read", os.fstat(inFile.fileno()).st_size)
+            for line in self.filter_scene(inPath, inFile, sceneterms, counting,
+                                          cases, prints):
+                if keep is not None:
+                    keep.append(line)
+                    if len(keep) > self.filter_cache_lines:
+                        # Too big to hold on to; filter it again if needed.
+                        keep = None
+                yield line
+        if self.filtered is not None and counting:
+            self.filtered[key] = keep
+        if cases is not None and counting:
+            self.store_cases(marker, body, cases)
+        if prints is not None and counting:
+            self.store_fingerprint(marker, body, prints)
+        if sceneterms is not None:
+            self.store_terms(marker, body, sceneterms, blockterms, terms)
+        if self._dryrun:
+            sys.stdout.write("# end filtering scene " + inPath + "\n")
+
+    def filter_scene(self, inPath, inFile, sceneterms=None, counting=True,
+                     cases=None, prints=None):
+        marker = os.path.relpath(inPath, self.root)
         para = None
         lastcol = 0
         eatTilLast = False
         eatTilBlank = False
         addContinuance = False
-        lines = inFile.readlines()
-        inFile.close()
         skip = 0
+        # `out` only holds what the current line produced. `count` and
+        # `last` stand in for everything already handed on.
         out = []
-        marker = os.path.relpath(inPath, self.root)
-        for i in range(len(lines)):
-            origline = line = lines[i]
+        count = 0
+        last = None
+        leading = True
+        for window in windowed(inFile, 2, 3):
+            for o in out:
+                if leading and o.strip() == "":
+                    continue
+                leading = False
+                yield o
+            if len(out) > 0:
+                count += len(out)
+                last = out[-1]
+                out = []
+
+            line = window[2]
+            if sceneterms is not None:
+                self.gather_terms(marker, line, sceneterms)
             if skip > 0:
                 skip -= 1
                 continue
@@ -670,22 +1222,26 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
 
             sectionMatch = self.section_re.match(line)
             if sectionMatch is not None:
-                if (0 < i < len(lines)-3 and lines[i-1].strip() == "" 
-                        and line >= len(lines[i+1].strip())
-                        and lines[i+2].strip() == line
-                        and lines[i+3].strip() == ""):
-                    u# top line of double-lined section
+                before2, before1, after1, after2, after3 = (window[0],
+                        window[1], window[3], window[4], window[5])
+                if (before1 is not None and after3 is not None
+                        and before1.strip() == ""
+                        and len(line) >= len(after1.strip())
+                        and after2.strip() == line
+                        and after3.strip() == ""):
+                    # top line of double-lined section
                     skip = 3
                     continue
-                elif (i < len(lines)-1 and lines[i-2].strip() == "" 
-                        and line >= len(lines[i-1].strip())
-                        and lines[i+1].strip() == ""):
-                    # only bottom lined section
+                elif (before1 is not None and after1 is not None
+                        and (before2 is None or before2.strip() == "")
+                        and len(line) >= len(before1.strip())
+                        and after1.strip() == ""):
+                    # only bottom lined section (a title on the first line
+                    # has nothing but the start of the file before it)
                     para = None
                     skip = 1
                     continue
 
-            self.gather_terms(marker, line, terms)
             isBlank = False
             if len(line) == 0:
                 isBlank = True
@@ -703,8 +1259,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
 
             if para is None:
                 if isBlank:
-                    if len(out) > 1 and out[-1] != "":
-                        out.append("")
+                    self.para_break(out, count, last)
                 elif line.startswith(".. ") and "::" in line:
                     eatTilLast = True
                     continue
@@ -718,9 +1273,9 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             elif isBlank:
                 para = self.filter_paragraph(inPath, para)
                 self.indent_and_extend(para, lastcol, out)
-                if len(out) > 1 and out[-1] != "":
-                    out.append("")
-                self.build_stats(inPath, para)
+                self.para_break(out, count, last)
+                if counting:
+                    self.build_stats(inPath, para, cases, prints)
                 para = None
             elif addContinuance and col > lastcol:
                 col = lastcol
@@ -734,24 +1289,29 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                     addContinuance = True
                 para = self.filter_paragraph(inPath, para)
                 self.indent_and_extend(para, lastcol, out)
-                self.build_stats(inPath, para)
+                if counting:
+                    self.build_stats(inPath, para, cases, prints)
                 para = None
             lastcol = col
         if para is not None:
             para = self.filter_paragraph(inPath, para)
             self.indent_and_extend(para, lastcol, out)
-            if len(out) > 1 and out[-1] != "":
-                out.append("")
-            self.build_stats(inPath, para)
-        i = 0
-        while i < len(out) and out[i].strip() == "":
-            i += 1
-        if marker not in self.stats:
+            self.para_break(out, count, last)
+            if counting:
+                self.build_stats(inPath, para, cases, prints)
+        for o in out:
+            if leading and o.strip() == "":
+                continue
+            leading = False
+            yield o
+        if counting and marker not in self.stats:
             self.build_stats(inPath, [""])
-        out = out[i:]
-        if self._dryrun:
-            sys.stdout.write("# end filtering scene " + inPath + "\n")
-        return out
+
+    def para_break(self, out, count, last):
+        if len(out) > 0:
+            last = out[-1]
+        if count + len(out) > 0 and last != "":
+            out.append("")
 
     def filter_paragraph(self, inPath, para):
         marker = os.path.relpath(inPath, self.root)
@@ -764,9 +1324,9 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
     def filter_a_re(self, line, a_re):
         aMatch = a_re.search(line)
         matches = []
+        out = []
         if aMatch is None:
             return line
-        matches = [aMatch]
         while aMatch is not None:
             matches.append(aMatch)
             aMatch = a_re.search(line, aMatch.end())
@@ -784,7 +1344,6 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
         out = []
         if roleMatch is None:
             return line
-        roles = [roleMatch]
         while roleMatch is not None:
             roles.append(roleMatch)
             roleMatch = self.role_re.search(line, roleMatch.end())
@@ -817,10 +1376,8 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             out.append(spacer + line)
         return None
 
-    def build_stats(self, inPath, para):
+    def build_stats(self, inPath, para, cases=None, prints=None):
         marker = os.path.relpath(inPath, self.root)
-        if not hasattr(self, "cases"):
-            self.cases = {}
         stats = self.stats.get(marker)
         if stats is None:
             stats = {}
@@ -829,79 +1386,340 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             stats["__para__"] = stats.get("__para__", 0) + 1
         stats["__char__"] = (stats.get("__char__", 0) +
             sum([len(x) for x in para]))
-        #c = para.count('"')
-        #if c % 2 == 1:
-        #    para = para + '"'
-        # qlist = para.split('"')
-        # said = qlist[slice(1, None, 2)]
-        # notsaid = qlist[slice(0, None, 2)]
-        punctuation = self.word_re.sub(" ", " ".join(para)).split()
-        stats["__punc__"] = stats.get("__punc__", set()) | set(punctuation)
         word = 0
-        for p in self.word_re.split("\t".join(para)):
-            if len(p) == 0:
-                continue
-            lp = p.lower()
-            cp = self.cases.get(lp, p)
-            if lp not in self.cases:
-                self.cases[lp] = cp
-            if lp.islower() and cp != lp and cp != p:
-                # cased characters exist 
-                # and not already using lowercase version
-                # and different casing
-                self.convert_case(lp, cp)
-            stats[cp] = stats.get(cp,0) + 1
+        tokens = self.word_re.split("\t".join(para))
+        for i in range(1, len(tokens), 2):
+            p = tokens[i]
             if p[0].isalnum():
                 stats["__wc__"] = stats.get("__wc__", 0) + 1
                 word += 1
+                if prints is not None:
+                    bucket = zlib.crc32(p.lower().encode("utf-8")) % self.fingerprint_buckets
+                    prints["words"][bucket] += 1
+            if cases is not None:
+                lp = p.lower()
+                if not lp.islower():
+                    # Nothing cased, so it can never be a name.
+                    continue
+                cp = cases.get(lp)
+                if cp is None:
+                    cases[lp] = p
+                elif cp != p and cp != lp:
+                    # Seen with more than one casing.
+                    cases[lp] = lp
+        if prints is not None and word != 0:
+            text = "\n".join(para).encode("utf-8")
+            prints["paragraphs"].append(hashlib.blake2b(text, digest_size=6).hexdigest())
         if "__wpp__" in stats and word != 0:
             stats["__wpp__"] = (stats.get("__wpp__", 0) + word) / 2.0
         elif word != 0:
             stats["__wpp__"] = word
+        for metric in self.metrics:
+            metric.paragraph(stats, para, tokens)
 
-    def convert_case(self, lowered, last_seen):
-        for marker in list(self.stats.keys()):
-            stats = self.stats[marker]
-            if last_seen in stats:
-                stats[lowered] = stats[last_seen]
-                del(stats[last_seen])
-        self.cases[lowered] = lowered
+    def fingerprint_path(self):
+        return os.path.join(self.root, self.statdir, "fingerprints.json")
 
-    def write_stats(self):
-        if not hasattr(self, "cases"):
+    def load_fingerprints(self):
+        self.fingerprints = {}
+        self.fingerprints_known = False
+        try:
+            with codecs.open(self.fingerprint_path(), "r", "utf-8") as printFile:
+                data = json.load(printFile)
+        except (IOError, ValueError):
             return
-        names = []
-        special = []
-        words = []
-        punc = self.cases.get("__punc__","")
-        for lower in list(self.cases.keys()):
-            seen = self.cases[lower]
-            if lower == seen:
-                if lower.startswith("__") and lower.endswith("__"):
-                    special.append(seen)
-                elif lower not in punc:
-                    words.append(seen)
-                # `punc` already filled.
-            elif seen in self.abbreviations:
-                words.append(seen)
+        if data.get("version") != self.fingerprint_version:
+            return
+        self.fingerprints = data.get("scenes", {})
+        self.fingerprints_known = True
+
+    def save_fingerprints(self):
+        if self._dryrun or self.fingerprints is None or not self.output.caches:
+            return
+        seen = self.termindex_seen
+        data = {
+            "version": self.fingerprint_version,
+            "scenes": dict([(m, self.fingerprints[m]) for m in self.fingerprints if m in seen]),
+        }
+        with self.output.open(self.fingerprint_path()) as out:
+            json.dump(data, out, sort_keys=True, separators=(",", ":"))
+
+    def known_fingerprint(self, marker, digest):
+        # Each scene keeps the hashes of its paragraphs, in order, and how
+        # many of its words fall in to each of `fingerprint_buckets`. They
+        # are only worked out again once the body has changed.
+        if self.fingerprints is None or not self.fingerprinting:
+            return None
+        known = self.fingerprints.get(marker)
+        if known is not None and known.get("digest") == digest:
+            return None
+        return {"paragraphs": [], "words": [0] * self.fingerprint_buckets}
+
+    def store_fingerprint(self, marker, digest, prints):
+        known = self.fingerprints.get(marker)
+        self.fingerprints[marker] = {
+            "digest": digest,
+            "paragraphs": " ".join(prints["paragraphs"]),
+            "words": " ".join([str(n) for n in prints["words"]]),
+        }
+        if not self.fingerprints_known:
+            # Nothing to compare with on the first run.
+            return
+        if known is None:
+            known = {"paragraphs": "", "words": ""}
+        stats = self.stats[marker]
+        added, removed, modified = self.compare_paragraphs(
+            known["paragraphs"].split(), prints["paragraphs"])
+        stats["__padd__"] = added
+        stats["__pdel__"] = removed
+        stats["__pmod__"] = modified
+        old = [int(n) for n in known["words"].split()]
+        if len(old) != len(prints["words"]):
+            old = [0] * len(prints["words"])
+        added = removed = 0
+        for before, after in zip(old, prints["words"]):
+            if after > before:
+                added += after - before
             else:
-                names.append(seen)
-        allstats = {}
-        self.stats[self.project] = allstats
-        if not hasattr(self, "scenelists"):
-            self.scenelists = {}
+                removed += before - after
+        # As with paragraphs, a word put in place of another is modified,
+        # not added and removed.
+        modified = min(added, removed)
+        stats["__wadd__"] = added - modified
+        stats["__wdel__"] = removed - modified
+        stats["__wmod__"] = modified
+
+    def compare_paragraphs(self, old, new):
+        """
+        Count the paragraphs added, removed and modified between two lists
+        of paragraph hashes. A paragraph replaced by another in the same
+        place counts as modified.
+        """
+        # Only the part between the common start and end is compared.
+        start = 0
+        while start < len(old) and start < len(new) and old[start] == new[start]:
+            start += 1
+        end = 0
+        while (end < len(old) - start and end < len(new) - start
+               and old[-1 - end] == new[-1 - end]):
+            end += 1
+        old = old[start:len(old) - end]
+        new = new[start:len(new) - end]
+        added = removed = modified = 0
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "insert":
+                added += j2 - j1
+            elif tag == "delete":
+                removed += i2 - i1
+            elif tag == "replace":
+                modified += min(i2 - i1, j2 - j1)
+                added += max(0, (j2 - j1) - (i2 - i1))
+                removed += max(0, (i2 - i1) - (j2 - j1))
+        return added, removed, modified
+
+    def lexicon_path(self):
+        return os.path.join(self.root, self.statdir, "lexicon.json")
+
+    def load_lexicon(self):
+        self.lexicon = {}
+        self.casecounts = {}
+        self.lowercase = None
+        self.capitals = None
+        self.vocabulary_base = None
+        self.vocabulary_added = []
+        self.rebuild_vocabulary = False
+        if self.vocabulary == "sketch":
+            # Half the memory for the words seen in lower case, half for
+            # the capitalized forms used most.
+            budget = self.vocabulary_memory * 1024 / 2
+            self.lowercase = BloomFilter.sized(budget)
+            self.capitals = TopK.sized(budget)
+            # Words can not be taken out of the filter, so it is made again
+            # from every scene when it is missing or has grown by a quarter
+            # since it was. Only a run which reads every scene can do that.
+            self.rebuild_vocabulary = (len(self.options.chapter) == 0
+                                       and len(self.options.scene) == 0
+                                       and self.git_changes is None)
+        try:
+            with codecs.open(self.lexicon_path(), "r", "utf-8") as lexFile:
+                data = json.load(lexFile)
+        except (IOError, ValueError):
+            return
+        if data.get("version") != self.lexicon_version:
+            return
+        if data.get("vocabulary", "exact") != self.vocabulary:
+            return
+        if self.lowercase is not None:
+            try:
+                last = BloomFilter.from_json(data["lowercase"])
+                capitals = TopK.from_json(data["capitals"])
+                base = data.get("lowercase_base")
+            except (KeyError, TypeError, ValueError):
+                return
+            if (last.width, last.depth) != (self.lowercase.width, self.lowercase.depth):
+                return
+            if capitals.capacity != self.capitals.capacity:
+                return
+            words = last.cardinality()
+            if (not self.rebuild_vocabulary or (base is not None and
+                    words is not None and words <= base * 1.25)):
+                self.lowercase = last
+                self.capitals = capitals
+                self.vocabulary_base = base
+                self.rebuild_vocabulary = False
+        self.lexicon = data.get("scenes", {})
+        for known in self.lexicon.values():
+            self.count_cases(known.get("cases", {}), 1)
+
+    def save_lexicon(self):
+        if self._dryrun or self.lexicon is None:
+            return
+        seen = self.termindex_seen
+        for marker in list(self.lexicon.keys()):
+            if marker not in seen:
+                self.count_cases(self.lexicon[marker].get("cases", {}), -1)
+                del self.lexicon[marker]
+        abbreviations = set()
+        for project in self.projects:
+            config = self.switch_config(self.ini, project)
+            abbreviations.update(config.get("abbreviations", "").split())
+        if self.capitals is not None:
+            # A scene only keeps the names, which may have been seen in
+            # lower case or dropped from the top-K since it was read.
+            for known in self.lexicon.values():
+                cases = known.get("cases", {})
+                for lower in list(cases.keys()):
+                    if self.canonical_case(lower) != cases[lower]:
+                        del cases[lower]
+            forms = self.capitals.entries
+        else:
+            forms = self.casecounts
+        table = {}
+        for lower in forms:
+            canonical = self.canonical_case(lower)
+            table[lower] = {
+                "canonical": canonical,
+                "name": canonical != lower and canonical not in abbreviations,
+                "abbreviation": canonical in abbreviations,
+            }
+        data = {
+            "version": self.lexicon_version,
+            "vocabulary": self.vocabulary,
+            "scenes": self.lexicon,
+            "cases": table,
+        }
+        if self.lowercase is not None:
+            if self.rebuild_vocabulary:
+                self.vocabulary_base = self.lowercase.cardinality()
+            data["lowercase"] = self.lowercase.to_json()
+            data["lowercase_base"] = self.vocabulary_base
+            data["capitals"] = self.capitals.to_json()
+        if not self.output.caches:
+            return
+        with self.output.open(self.lexicon_path()) as out:
+            json.dump(data, out, sort_keys=True)
+
+    def known_cases(self, marker, digest):
+        # The casing learned from a scene is kept until its body changes,
+        # unless the vocabulary sketch is being made again.
+        if self.lexicon is None:
+            return None
+        self.termindex_seen.add(marker)
+        known = self.lexicon.get(marker)
+        if (known is not None and known.get("digest") == digest
+                and not self.rebuild_vocabulary):
+            return None
+        return {}
+
+    def store_cases(self, marker, digest, cases):
+        if self.lowercase is not None:
+            # Only the names are kept with the scene.
+            for lower in cases:
+                if cases[lower] == lower:
+                    self.lowercase.add(lower)
+                else:
+                    self.capitals.add(lower, cases[lower])
+                    if not self.rebuild_vocabulary:
+                        self.vocabulary_added.append((lower, cases[lower]))
+            names = {}
+            for lower in cases:
+                if cases[lower] != lower and self.canonical_case(lower) == cases[lower]:
+                    names[lower] = cases[lower]
+            cases = names
+        known = self.lexicon.get(marker)
+        if known is not None:
+            self.count_cases(known.get("cases", {}), -1)
+        self.lexicon[marker] = {"digest": digest, "cases": cases}
+        self.count_cases(cases, 1)
+
+    def count_cases(self, cases, step):
+        # `casecounts` maps each lower case form to the number of scenes
+        # using each casing of it. A scene which mixes casings counts as
+        # the lower case form. The sketch mode has the top-K instead.
+        if self.capitals is not None:
+            return
+        for lower in cases:
+            seen = self.casecounts.get(lower)
+            if seen is None:
+                seen = {}
+                self.casecounts[lower] = seen
+            casing = cases[lower]
+            seen[casing] = seen.get(casing, 0) + step
+            if seen[casing] <= 0:
+                del seen[casing]
+                if len(seen) == 0:
+                    del self.casecounts[lower]
+
+    def canonical_case(self, lower):
+        if self.capitals is not None:
+            # A name only when every use of it was counted, with the same
+            # casing, and none in lower case.
+            casing = self.capitals.exact(lower)
+            if casing is not None and lower not in self.lowercase:
+                return casing
+            if lower in self.capitals or lower in self.lowercase:
+                return lower
+            return None
+        seen = self.casecounts.get(lower)
+        if seen is None:
+            return None
+        if len(seen) == 1:
+            for casing in seen:
+                return casing
+        return lower
+
+    def case_name(self, lower):
+        canonical = self.canonical_case(lower)
+        if canonical is None or canonical == lower:
+            return None
+        if canonical in self.abbreviations:
+            return None
+        return canonical
+
+    def write_stats(self, selected=None):
         scenelist = []
         self.scenelists[self.project] = scenelist
+        for s in self.outline:
+            scenelist.extend(s[1:])
+        if self.lexicon is None:
+            return
+        allstats = {}
+        complete = True
         chapter = 0
-        chfmt = "%%0%uu" % (len(str(len(self.outline))),)
         for s in self.outline:
             chapter += 1
             scenes = s[1:]
-            scenelist.extend(scenes)
+            if selected is not None and chapter not in selected:
+                # The chapters which were not read count as they were
+                # when their stats were last written.
+                if len(scenes) > 0 and complete:
+                    complete = self.restore_chapter(allstats, chapter)
+                continue
             if len(scenes) > 0:
                 chapmark = os.path.join(self.chapter_path,
                                     self.chapter_prefix
-                                    + chfmt % (chapter,))
+                                    + self.chapnames[chapter-1])
                 if chapmark not in self.stats:
                     chstats = {}
                     self.stats[chapmark] = chstats
@@ -918,21 +1736,34 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                         allstats["__char__"] = allstats.get("__char__", 0) + scstats.get("__char__", 0)
                         allstats["__wpp__"] = (allstats.get("__wcc__", 0.0) + scstats.get("__wpp__", 0.0)) / 2.0
                         allstats["__wc__"] = allstats.get("__wc__", 0) + scstats.get("__wc__", 0)
+                        for metric in self.metrics:
+                            metric.combine(chstats, scstats)
+                            metric.combine(allstats, scstats)
+
+        if complete:
+            self.stats[self.project] = allstats
+            self.run_metrics.set_words(self.project, allstats.get("__wc__", 0))
 
-        if not hasattr(self, "hitlist"):
-            self.hitlist = {}
+        # Names come from the lexicon, so scenes which were not read this
+        # run still count.
         for filname in scenelist:
             if filname[0] == "/":
                 filname = filname[1:]
-            for n in names:
+            known = self.lexicon.get(filname)
+            if known is None:
+                continue
+            cases = known.get("cases", {})
+            for lower in cases:
+                if cases[lower] == lower:
+                    continue
+                n = self.case_name(lower)
                 if n is None:
                     continue
-                if n in self.stats.get(filname, []):
-                    h = self.hitlist.get(n)
-                    if h is None:
-                        h = []
-                        self.hitlist[n] = h
-                    h.append(filname)
+                h = self.hitlist.get(term_name(n))
+                if h is None:
+                    h = []
+                    self.hitlist[term_name(n)] = h
+                h.append(filname)
         for filname in list(self.stats.keys()):
             if filname.startswith("__"):
                 if filname.endswith("__"):
@@ -949,80 +1780,112 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if st is None:
                 sys.stdout.write("%s has no stats\n" % filname)
                 continue
+            headers = ["Date", "Words", "Characters", "Paragraphs", "Words Per Paragraph", "Pages (250)", "Pages (350)", "Word Changes"]
+            columns = []
+            for metric in self.metrics:
+                metric.finish(st)
+                for column in metric.columns_for(st):
+                    headers.append(column[1])
+                    columns.append(column)
+            st["__date__"] = str(date.today().isoformat())
+            st["__pg250__"] = st.get("__wc__",0) / 250.0
+            st["__pg350__"] = st.get("__wc__",0) / 350.0
+            st["__wchange__"] = st.get("__wc__", 0)
+
+            # Normally only the last two rows are read and today's row is
+            # appended (or replaced) in place. A renamed history, or one
+            # without a column for every value, is read and written in full.
+            # Columns are matched by header, so the ones a history has no
+            # value for this time are left empty.
             tabpath = os.path.join(self.root, os.path.dirname(filenm), self.statdir, os.path.basename(filenm) + ".dat")
-            tabdata = []
+            tabdata = None
+            cut = None
+            header = None
+            today = None
             if not os.path.exists(tabpath):
+                tabdata = []
                 trytabnm = os.path.basename(filenm)
                 trytab = os.path.join(self.root, os.path.dirname(filenm), self.statdir, trytabnm + ".dat")
                 while not os.path.exists(trytab) and "-0" in trytabnm:
                     trytabnm = trytabnm.replace("-0","-", 1)
                     trytab = os.path.join(self.root, os.path.dirname(filenm), self.statdir, trytabnm + ".dat")
                 if os.path.exists(trytab):
-                    with open(trytab, 'rb') as csvfile:
-                        reader = UnicodeReader(csvfile)
-                        for row in reader:
-                            tabdata.append(row)
+                    tabdata = read_table(trytab)
                     if len(tabdata) > 0:
-                        os.unlink(trytab)
-
+                        self.output.remove(trytab)
+            elif self.output.in_place:
+                header, tail = read_tail(tabpath, 2)
+                if not set(header).issuperset(headers):
+                    tabdata = read_table(tabpath)
             else:
-                with open(tabpath, 'rb') as csvfile:
-                    reader = UnicodeReader(csvfile)
-                    for row in reader:
-                        tabdata.append(row)
-
-            headers = ["Date", "Words", "Characters", "Paragraphs", "Words Per Paragraph", "Pages (250)", "Pages (350)", "Word Changes"]
-            if len(tabdata) == 0:
-                tabdata.append(headers)
-            elif len(tabdata[0]) < len(headers):
-                tabdata[0] = headers
-            st["__date__"] = str(date.today().isoformat())
-            st["__pg250__"] = st.get("__wc__",0) / 250.0
-            st["__pg350__"] = st.get("__wc__",0) / 350.0
-            st["__wchange__"] = st.get("__wc__", 0)
-            if len(tabdata) > 1:
-                if tabdata[-1][0] == st.get("__date__"):
-                    del tabdata[-1]
+                tabdata = read_table(tabpath)
+
+            if tabdata is not None:
+                if len(tabdata) == 0:
+                    tabdata.append(headers)
+                header = tabdata[0]
+                tabdata[0] = header + [h for h in headers if h not in header]
+                if len(tabdata) > 1:
+                    if tabdata[-1][0] == st.get("__date__"):
+                        today = tabdata[-1]
+                        del tabdata[-1]
+                rows = tabdata[1:]
+            else:
+                rows = [row for offset, row in tail]
+                if len(rows) > 0 and rows[-1][0] == st.get("__date__"):
+                    cut = tail[-1][0]
+                    today = rows[-1]
+                    del rows[-1]
+            revised = False
+            for metric in self.metrics:
+                if metric.revised(st):
+                    revised = True
+                if today is not None:
+                    metric.same_day(st, dict(zip(header, today)))
             lastwc = None
-            if len(tabdata) > 1:
-                if tabdata[-1][1] == "":
+            if len(rows) > 0:
+                if rows[-1][1] == "":
                     lastwc = 0
                 else:
-                    lastwc = int(tabdata[-1][1])
+                    lastwc = int(rows[-1][1])
                 st["__wchange__"] = st.get("__wc__", 0) - lastwc
 
             txtpath = os.path.join(self.root, os.path.dirname(filenm), self.statdir, os.path.basename(filenm) + self.suffix)
-            if lastwc is not None and lastwc == st.get("__wc__", 0):
-                if os.path.exists(tabpath) and os.path.exists(txtpath):
+            if lastwc is not None and lastwc == st.get("__wc__", 0) and not revised:
+                if self.output.exists(tabpath) and self.output.exists(txtpath):
                     continue
-                else:
+                elif not (os.path.exists(tabpath) and os.path.exists(txtpath)):
                     sys.stdout.write("Word count no change, but stat file missing for %s\n" % filenm)
-            newrow = []
+            values = []
             for n in ("__date__", "__wc__", "__char__", "__para__", "__wpp__", "__pg250__", "__pg350__", "__wchange__"):
-                newrow.append(st.get(n, ""))
+                values.append(st.get(n, ""))
+            for column in columns:
+                values.append(st.get(column[0], ""))
+            values = dict(zip(headers, values))
+            if tabdata is not None:
+                header = tabdata[0]
+            newrow = [values.get(h, "") for h in header]
             # We could be upgrading the name, so don't force a row
             # when the data hasn't changed.
-            if lastwc is None or lastwc != st.get("__wc__", 0):
-                tabdata.append(newrow)
-            outpath = tabpath + ".new"
+            if lastwc is None or lastwc != st.get("__wc__", 0) or revised:
+                newrows = [newrow]
+            else:
+                newrows = []
             if self._dryrun:
                 print("\n# ", tabpath, "\n")
+            elif tabdata is None:
+                if len(newrows) > 0 or cut is not None:
+                    rewrite_tail(tabpath, cut, newrows)
             else:
-                if not os.path.isdir(os.path.dirname(outpath)):
-                    os.makedirs(os.path.dirname(outpath))
-                with open(outpath, 'wb') as csvfile:
-                    writer = UnicodeWriter(csvfile)
-                    writer.writerows(tabdata)
-                os.rename(outpath, tabpath)
+                with self.output.open(tabpath) as out:
+                    write_rows(out, tabdata + newrows)
 
             outpath = txtpath
-            if not os.path.isdir(os.path.dirname(outpath)):
-                os.makedirs(os.path.dirname(outpath))
             if self._dryrun:
                 out = sys.stdout
                 out.write("\n# %s\n\n" % outpath)
             else:
-                out = codecs.open(outpath, "wt", "utf-8")
+                out = self.output.open(outpath)
             for n in ("__date__", "__wc__", "__wchange__", "__pg250__", "__pg350__", "__char__", "__para__", "__wpp__"):
                 if n == "__para__":
                     out.write(":Paragraphs: ")
@@ -1046,26 +1909,54 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                     out.write("%.3f\n"% st.get(n))
                 else:
                     out.write("%s\n"% st.get(n))
+            for column in columns:
+                out.write(":%s: " % column[2])
+                if isinstance(st.get(column[0]), float):
+                    out.write("%.3f\n"% st.get(column[0]))
+                else:
+                    out.write("%s\n"% st.get(column[0]))
 
             if not self._dryrun:
                 out.close()
 
+    def restore_chapter(self, allstats, chapter):
+        name = self.chapter_prefix + self.chapnames[chapter-1]
+        tabpath = os.path.join(self.chapter_path, self.statdir, name + ".dat")
+        if not os.path.exists(tabpath):
+            self.verbose("No stats for %s, so the project totals are left alone." % (name,))
+            return False
+        header, tail = read_tail(tabpath, 1)
+        if len(tail) == 0:
+            self.verbose("No stats for %s, so the project totals are left alone." % (name,))
+            return False
+        row = dict(zip(header, tail[-1][1]))
+        chstats = {}
+        for key, column in (("__wc__", "Words"), ("__char__", "Characters"),
+                            ("__para__", "Paragraphs"),
+                            ("__wpp__", "Words Per Paragraph")):
+            if row.get(column):
+                chstats[key] = float(row[column])
+                if key != "__wpp__":
+                    chstats[key] = int(chstats[key])
+        for metric in self.metrics:
+            metric.restore(chstats, row)
+        allstats["__para__"] = allstats.get("__para__", 0) + chstats.get("__para__", 0)
+        allstats["__char__"] = allstats.get("__char__", 0) + chstats.get("__char__", 0)
+        allstats["__wpp__"] = chstats.get("__wpp__", 0.0)
+        allstats["__wc__"] = allstats.get("__wc__", 0) + chstats.get("__wc__", 0)
+        for metric in self.metrics:
+            metric.combine(allstats, chstats)
+        return True
+
     def write_term_stats(self):
-        if not hasattr(self, "scenelists"):
-            self.scenelists = {}
+        if self.termindex is None:
+            self.termpages = {}
         for term in list(self.termmap.keys()):
             files = set(self.hitlist.get(term, [])) | set(self.termmap[term])
             termpath = os.path.join(self.root, self.statdir, term + self.suffix)
-            if not os.path.isdir(os.path.dirname(termpath)):
-                os.makedirs(os.path.dirname(termpath))
-            if self._dryrun:
-                out = sys.stdout
-                out.write("\n# %s\n\n" % termpath)
-            else:
-                out = codecs.open(termpath, "wt", "utf-8")
+            postings = []
             for proj in self.projects:
                 scenelist = self.scenelists.get(proj,[])
-                inproj = False
                 for absfil in scenelist:
                     relfil = absfil
                     if absfil[0] == '/':
@@ -1073,55 +1964,512 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                     else:
                         sys.stdout.write("scenelist contained relative path: %s\n" % (absfil,))
                     if relfil in files:
-                        if not inproj:
-                            out.write("\n* :doc:`/%s`\n\n" % (proj,))
-                            inproj = True
-                        out.write("   * :doc:`%s`\n"% (absfil,))
+                        postings.append([proj, absfil])
+            # Only a digest of the postings is kept, so a page is written
+            # again just when the scenes listed on it change.
+            pagedigest = hashlib.sha1(json.dumps(postings).encode("utf-8")).hexdigest()[:16]
+            if self.termpages.get(term) == pagedigest and self.output.exists(termpath):
+                continue
+            self.termpages[term] = pagedigest
+            if self._dryrun:
+                out = sys.stdout
+                out.write("\n# %s\n\n" % termpath)
+            else:
+                out = self.output.open(termpath)
+            inproj = None
+            for proj, absfil in postings:
+                if proj != inproj:
+                    out.write("\n* :doc:`/%s`\n\n" % (proj,))
+                    inproj = proj
+                out.write("   * :doc:`%s`\n"% (absfil,))
             if not self._dryrun:
                 out.close()
+        # The page of a term no scene uses any more is removed, unless
+        # some projects were left out of this run and may still use it.
+        configured = []
+        if self.ini.has_option("global", "projects"):
+            configured = self.ini.get("global", "projects").split()
+        everything = set(self.projects) >= set(configured)
+        for term in list(self.termpages.keys()):
+            if term in self.termmap or not everything:
+                continue
+            termpath = os.path.join(self.root, self.statdir, term + self.suffix)
+            if self._dryrun:
+                print("Would remove %s" % (termpath,))
+                continue
+            if os.path.exists(termpath):
+                self.verbose("Removing %s" % (termpath,))
+                self.output.remove(termpath)
+            del self.termpages[term]
+        self.save_term_index()
+        self.save_lexicon()
+        self.save_fingerprints()
 
     def main(self, argv):
-        self.stats = {}
-        self.termmap = {}
+        if len(argv) > 0 and argv[0] in commands:
+            command = importlib.import_module("." + commands[argv[0]], __name__)
+            return command.main(self, argv[1:])
+        self.reset()
         self.options = parser.parse_args(argv)
         self._verbose = self.options.verbose
         self._dryrun = self.options.dry_run
         self.ini = self.check_config(self.options)
+        projects = []
         if self.ini.has_section("global"):
             if self.ini.has_option("global", "projects"):
                 projects = self.ini.get("global", "projects").split()
         if self.options.projects is not None and len(self.options.projects) > 0:
-            projects = config.projects
+            projects = self.options.projects
         self.projects = projects
-        for project in projects:
-            self.config = self.switch_config(self.ini, project)
-            self.project = project
-
-            self.outline_path = self.config["outline"]
-            self.chapter_path = self.config["chapter-dir"]
-            self.chapter_prefix = self.config.get("chapter-prefix",  "chapter-")
-            self.chapterstub_path = self.config["chapter-stub-dir"]
-            self.chapterstub_prefix = self.config.get("chapter-stub-prefix",  "chapter-")
-            self.suffix = self.config.get("suffix", ".txt")
-            self.abbreviations = self.config.get("abbreviations","").split()
-            self.statdir = self.config.get("stat-dir",".stats")
-            self.remove_chapstubs(self.chapterstub_path,
-                                  self.chapterstub_prefix, self.suffix)
-            self.remove_chapstubs(self.chapter_path,
-                                  self.chapter_prefix, self.suffix)
-            if not os.path.exists(self.outline_path):
-                print("Error: need outline file name.")
+        self.filtered = {}
+        if self.options.export is not None:
+            return self.export(projects)
+        if self.options.depfile is not None:
+            return self.depfile(projects)
+        if self.options.archive is not None:
+            if archive_mode(self.options.archive) is None:
+                print("Error: the archive name must end in .zip, .tar,"
+                      " .tar.gz, .tgz, .tar.bz2 or .tar.xz.")
                 sys.exit(1)
-            self.parse_outline_file()
+            self.output = ArchiveOutput(self.options.archive)
+        self.output.written = 0
+        self.unmatched = set(self.options.chapter) | set(self.options.scene)
+        structure = self.options.structure_only
+        counting = self.options.stats_only
+        partial = len(self.unmatched) > 0
+        if self.options.git_changed and partial:
+            print("Error: --git-changed can not be used with --chapter"
+                  " or --scene.")
+            sys.exit(1)
+        if len(projects) > 0:
+            # The build is recorded in the stat dir of the first project.
+            self.setup_project(projects[0])
+            statepath = self.git_state_path()
+            if self.options.git_changed:
+                self.git_changes = gitchanges.changed_files(
+                        self.root, self.load_git_state(statepath))
+                if self.git_changes is None:
+                    self.verbose("No build recorded in git; checking every scene.")
+            # Only a run which brings every file up to date is recorded.
+            self.git_recording = (self.output.in_place and not self._dryrun
+                    and not partial and not structure and not counting
+                    and (self.options.git_changed or os.path.exists(statepath)))
+        if counting:
+            # Nothing is written from the filtered text, so only keep
+            # enough to know a shared scene was counted.
+            self.filter_cache_lines = 0
+        server = None
+        if self.options.openmetrics_port is not None:
+            try:
+                server = self.run_metrics.serve(self.options.openmetrics_port)
+            except OSError as e:
+                print("Error: unable to serve metrics on port %u: %s" %
+                      (self.options.openmetrics_port, e))
+                sys.exit(1)
+        try:
+            self.build_projects(projects, structure, counting)
+            self.output.close()
+            if self.git_recording:
+                self.save_git_state(statepath)
+            self.phase(None)
+            self.finish_metrics()
+        finally:
+            self.unlock_stats()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        for which in sorted(self.unmatched):
+            print("WARNING: no chapter or scene matches %s" % (which,))
+
+    def build_projects(self, projects, structure=False, counting=False):
+        for project in projects:
+            self.phase("outline")
+            self.load_project(project)
+            self.track_paths()
+            self.scene_count += sum([len(ch) - 1 for ch in self.outline])
+            if self.termindex is None and not structure:
+                self.load_term_index()
+                self.load_lexicon()
+            if self.fingerprints is None and self.fingerprinting and not structure:
+                # fingerprints.json is only kept for the revisions metric.
+                self.load_fingerprints()
+            selected = self.select_chapters()
+            if selected is None and not counting:
+                keep = None
+                if self.chapter_naming == "label":
+                    keep = self.chapnames
+                self.remove_chapstubs(self.chapterstub_path,
+                                      self.chapterstub_prefix, self.suffix, keep)
+                if not structure:
+                    self.remove_chapstubs(self.chapter_path,
+                                          self.chapter_prefix, self.suffix, keep)
             if not os.path.exists(self.config["chapter-dir"]):
                 print("Error: need chapter directory.")
                 sys.exit(1)
-            self.create_chapter_stubs()
-            self.create_chapters()
-            self.write_stats()
-        self.write_term_stats()
+            if not counting:
+                self.phase("stubs")
+                self.create_chapter_stubs(selected)
+                if self.book_toc_path is not None:
+                    self.create_book()
+            if structure:
+                self.phase("headers")
+                self.rewrite_headers(selected)
+                continue
+            self.phase("chapters")
+            if counting:
+                self.count_chapters(selected)
+            else:
+                self.create_chapters(selected)
+            self.phase("stats")
+            self.lock_stats()
+            self.write_stats(selected)
+            if selected is not None:
+                self.index_unselected(selected)
+        if counting:
+            # The term pages are left for the next full run, which finds
+            # them out of date from the term index.
+            self.save_term_index()
+            self.save_lexicon()
+            self.save_fingerprints()
+        elif not structure:
+            self.phase("terms")
+            self.write_term_stats()
+
+    def lock_stats(self):
+        # Runs for different chapters (as `make -j` starts them) share the
+        # project totals and the indexes in the stat dir, so they take
+        # turns from the stats to the end of the run.
+        if (self.stats_lock is not None or fcntl is None or self._dryrun
+                or not self.output.in_place):
+            return
+        path = os.path.join(self.root, self.statdir, "splitoutline.lock")
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.stats_lock = open(path, "a")
+        fcntl.flock(self.stats_lock.fileno(), fcntl.LOCK_EX)
+        if len(self.options.chapter) > 0 or len(self.options.scene) > 0:
+            self.reload_indexes()
+
+    def unlock_stats(self):
+        if self.stats_lock is not None:
+            fcntl.flock(self.stats_lock.fileno(), fcntl.LOCK_UN)
+            self.stats_lock.close()
+            self.stats_lock = None
+
+    def reload_indexes(self):
+        # Another run may have saved the indexes since they were loaded.
+        # Its entries are taken, except for the scenes this run has read.
+        seen = self.termindex_seen
+        termindex = self.termindex
+        lexicon = self.lexicon
+        fingerprints = self.fingerprints
+        lowercase = self.lowercase
+        added = self.vocabulary_added
+        if termindex is not None:
+            self.load_term_index()
+            for marker in seen:
+                if marker in termindex:
+                    self.termindex[marker] = termindex[marker]
+        if lexicon is not None:
+            self.load_lexicon()
+            if lowercase is not None:
+                # Words are only ever added, so this run's are added again.
+                self.lowercase.update(lowercase)
+                for lower, casing in added:
+                    self.capitals.add(lower, casing)
+                self.vocabulary_added = added
+            for marker in seen:
+                if marker in lexicon:
+                    known = self.lexicon.get(marker)
+                    if known is not None:
+                        self.count_cases(known.get("cases", {}), -1)
+                    self.lexicon[marker] = lexicon[marker]
+                    self.count_cases(lexicon[marker].get("cases", {}), 1)
+        if fingerprints is not None:
+            self.load_fingerprints()
+            for marker in seen:
+                if marker in fingerprints:
+                    self.fingerprints[marker] = fingerprints[marker]
+
+    def finish_metrics(self):
+        metrics = self.run_metrics
+        metrics.written = self.output.written
+        done = metrics.scenes["filtered"] + metrics.scenes["reused"]
+        metrics.scenes["skipped"] = max(0, self.scene_count - done)
+        if self.lexicon is not None:
+            if self.lowercase is not None:
+                metrics.vocabulary = len([lower for lower in self.capitals.entries
+                                          if lower not in self.lowercase])
+                lower = self.lowercase.cardinality()
+                if lower is not None:
+                    metrics.vocabulary += int(lower)
+            else:
+                metrics.vocabulary = len(self.casecounts)
+        metrics.end()
+        if self.options.openmetrics is not None:
+            metrics.write(self.options.openmetrics)
+
+    def export(self, projects):
+        # Nothing is written but the export, not even the outline cache.
+        self._dryrun = False
+        self._exporting = True
+        self.filtered = None
+        if self.options.export == "-":
+            out = sys.stdout
+        else:
+            out = codecs.open(self.options.export, "w", "utf-8")
+        for project in projects:
+            self.load_project(project)
+            self.export_book(out)
+        if out is not sys.stdout:
+            out.close()
+
+    def depfile(self, projects):
+        if self.options.depfile == "-":
+            out = sys.stdout
+        else:
+            out, newpath = new_file(self.options.depfile)
+        out.write("# Generated by splitoutline --depfile. Do not edit.\n\n")
+        out.write("SPLITOUTLINE ?= splitoutline\n\n")
+        outlines = []
+        for project in projects:
+            self.load_project(project)
+            outlines.extend(self.outline_files)
+            self.write_depfile(out)
+        if out is not sys.stdout:
+            out.write("%s: %s\n" % (make_escape(self.options.depfile),
+                    " ".join([make_escape(o) for o in outlines])))
+            out.close()
+            os.rename(newpath, self.options.depfile)
+
+    def write_depfile(self, out):
+        config = ""
+        if self.options.config is not None:
+            config = " -c " + make_escape(self.options.config)
+        chapters = []
+        phony = []
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            name = self.chapter_prefix + self.chapnames[chNum-1]
+            chappath = os.path.join(self.chapter_path, name + self.suffix)
+            stubpath = os.path.join(self.chapterstub_path,
+                                    self.chapterstub_prefix
+                                    + self.chapnames[chNum-1]
+                                    + self.suffix)
+            chapstats = os.path.join(self.chapter_path, self.statdir,
+                                     name + self.suffix)
+            scenes = []
+            for scene in ch[1:]:
+                scenes.append(self.find_path(scene, self.outline_path) + self.suffix)
+            targets = [make_escape(chappath), make_escape(stubpath)]
+            out.write("%s: %s\n" % (targets[0],
+                    " ".join([make_escape(f) for f in self.outline_files + scenes])))
+            out.write("\t$(SPLITOUTLINE)%s --chapter %u %s\n" % (config, chNum,
+                    make_escape(self.project)))
+            out.write("%s: %s\n" % (targets[1], targets[0]))
+            out.write("%s: %s\n" % (make_escape(chapstats), targets[0]))
+            alias = make_escape("%s-%s" % (self.project, name))
+            out.write("%s: %s\n" % (alias, " ".join(targets)))
+            phony.append(alias)
+            chapters.append(targets[0])
+        projstats = os.path.join(self.root, self.statdir, self.project + self.suffix)
+        out.write("%s: %s\n" % (make_escape(projstats), " ".join(chapters)))
+        out.write("%s: %s\n" % (make_escape(self.project), " ".join(phony)))
+        phony.append(make_escape(self.project))
+        out.write(".PHONY: %s\n\n" % (" ".join(phony),))
+
+    def select_chapters(self):
+        # None means everything, otherwise the set of chapter numbers.
+        if self.git_changes is not None:
+            return self.select_changed()
+        if len(self.options.chapter) == 0 and len(self.options.scene) == 0:
+            return None
+        selected = set()
+        if len(self.options.scene) > 0:
+            self.selected_scenes = set()
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            name = self.chapnames[chNum-1]
+            for which in self.options.chapter:
+                if which in (str(chNum), ch[0], name,
+                             self.chapter_prefix + name,
+                             self.chapter_prefix + name + self.suffix):
+                    selected.add(chNum)
+                    self.unmatched.discard(which)
+            for scene in ch[1:]:
+                marker = self.scene_marker(scene)
+                for which in self.options.scene:
+                    ref = which
+                    if ref.endswith(self.suffix):
+                        ref = ref[:-len(self.suffix)]
+                    if ref == scene or marker in (
+                            os.path.normpath(ref.lstrip("/")),
+                            os.path.relpath(os.path.abspath(ref),
+                                            os.path.abspath(self.root))):
+                        selected.add(chNum)
+                        self.selected_scenes.add(scene)
+                        self.unmatched.discard(which)
+        return selected
+
+    def chapter_files(self, chNum):
+        name = self.chapnames[chNum-1]
+        return (os.path.join(self.chapter_path,
+                             self.chapter_prefix + name + self.suffix),
+                os.path.join(self.chapterstub_path,
+                             self.chapterstub_prefix + name + self.suffix))
+
+    def track_paths(self):
+        # The files of the project a git build is recorded for.
+        if not self.git_recording:
+            return
+        paths = self.git_paths
+        for outline in self.outline_files:
+            paths.add(os.path.abspath(outline))
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            for path in self.chapter_files(chNum):
+                paths.add(os.path.abspath(path))
+            for scene in ch[1:]:
+                paths.add(os.path.abspath(self.find_path(scene, self.outline_path)
+                                          + self.suffix))
+        for epigraph in self.epigraphs:
+            paths.add(os.path.abspath(self.find_path(epigraph, self.outline_path)
+                                      + self.suffix))
+
+    def select_changed(self):
+        # Everything is regenerated when an outline changed. Otherwise the
+        # chapters holding a changed scene, or whose files changed.
+        changes = self.git_changes
+        for outline in self.outline_files:
+            if os.path.abspath(outline) in changes:
+                self.selected_scenes = None
+                return None
+        selected = set()
+        self.selected_scenes = set()
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            for path in self.chapter_files(chNum):
+                if os.path.abspath(path) in changes:
+                    selected.add(chNum)
+            for scene in ch[1:]:
+                path = self.find_path(scene, self.outline_path) + self.suffix
+                if os.path.abspath(path) in changes:
+                    selected.add(chNum)
+                    self.selected_scenes.add(scene)
+        for epigraph in self.epigraphs:
+            path = self.find_path(epigraph, self.outline_path) + self.suffix
+            if os.path.abspath(path) in changes:
+                self.selected_scenes = None
+                return None
+        self.verbose("%u scenes changed in %u chapters." %
+                     (len(self.selected_scenes), len(selected)))
+        return selected
+
+    def git_state_path(self):
+        return os.path.join(self.root, self.statdir, "git-build.json")
+
+    def load_git_state(self, path):
+        try:
+            with codecs.open(path, "r", "utf-8") as stateFile:
+                return json.load(stateFile)
+        except (IOError, ValueError):
+            return None
+
+    def save_git_state(self, path):
+        state = gitchanges.build_state(self.root,
+                                       lambda changed: changed in self.git_paths)
+        if state is None:
+            return
+        with self.output.open(path) as out:
+            json.dump(state, out, sort_keys=True)
 
-    def remove_chapstubs(self, path, prefix, suffix):
+    def index_unselected(self, selected):
+        # Scenes which were not filtered still show on the term pages.
+        if self.termindex is None:
+            return
+        chNum = 0
+        for ch in self.outline:
+            chNum += 1
+            if chNum in selected:
+                continue
+            for scene in ch[1:]:
+                marker = self.scene_marker(scene)
+                known = self.termindex.get(marker)
+                if known is not None:
+                    self.termindex_seen.add(marker)
+                    self.add_terms(marker, self.indexed_terms(known), {})
+                if self.lexicon is not None and marker in self.lexicon:
+                    self.termindex_seen.add(marker)
+
+    def scene_marker(self, scene):
+        return os.path.relpath(self.find_path(scene, self.outline_path), self.root)
+
+    def load_project(self, project):
+        self.setup_project(project)
+        if not os.path.exists(self.outline_path):
+            print("Error: need outline file name.")
+            sys.exit(1)
+        self.parse_outline_file()
+
+    def setup_project(self, project):
+        self.config = self.switch_config(self.ini, project)
+        self.project = project
+
+        self.outline_path = self.config["outline"]
+        self.chapter_path = self.config["chapter-dir"]
+        self.chapter_prefix = self.config.get("chapter-prefix",  "chapter-")
+        self.chapterstub_path = self.config["chapter-stub-dir"]
+        self.chapterstub_prefix = self.config.get("chapter-stub-prefix",  "chapter-")
+        self.suffix = self.config.get("suffix", ".txt")
+        self.abbreviations = self.config.get("abbreviations","").split()
+        self.statdir = self.config.get("stat-dir",".stats")
+        self.chapter_naming = self.config.get("chapter-names", "number")
+        self.book_toc_path = self.config.get("book-toc")
+        self.book_title = self.config.get("book-title", project)
+        if self.chapter_naming not in ("number", "label"):
+            print("Error: chapter-names must be 'number' or 'label'.")
+            sys.exit(1)
+        self.vocabulary = self.config.get("vocabulary", "exact")
+        if self.vocabulary not in ("exact", "sketch"):
+            print("Error: vocabulary must be 'exact' or 'sketch'.")
+            sys.exit(1)
+        try:
+            self.vocabulary_memory = float(self.config.get("vocabulary-memory", "256"))
+        except ValueError:
+            self.vocabulary_memory = 0
+        if self.vocabulary_memory <= 0:
+            print("Error: vocabulary-memory must be a size in KiB.")
+            sys.exit(1)
+        try:
+            self.metrics = load_metrics(self.config.get("metrics", default_metrics))
+        except KeyError as e:
+            print("Error: unknown metric %s." % (e,))
+            sys.exit(1)
+        self.fingerprinting = "revisions" in [metric.name for metric in self.metrics]
+
+    def generated_path(self, path):
+        return os.path.join(path, self.statdir, "generated.json")
+
+    def load_generated(self, path):
+        try:
+            with codecs.open(self.generated_path(path), "r", "utf-8") as genFile:
+                return json.load(genFile)
+        except (IOError, ValueError):
+            return {}
+
+    def remove_chapstubs(self, path, prefix, suffix, keep=None):
+        # With stable names only the chapters that have gone are removed,
+        # and only if this tool wrote them: either they are listed in the
+        # stat dir, or they have the numbered names of the default mode.
+        generated = {}
+        written = []
+        if keep is not None:
+            generated = self.load_generated(path)
+            written = generated.get(prefix + "*" + suffix, [])
         for f in os.listdir(path):
             full = os.path.join(path, f)
             if not os.path.isfile(full):
@@ -1131,7 +2479,10 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             if not f.endswith(suffix):
                 continue
             f = f[len(prefix):-len(suffix)]
-            if not f.isdigit():
+            if keep is not None:
+                if f in keep or (f not in written and not f.isdigit()):
+                    continue
+            elif not f.isdigit():
                 self.debug(2, "Unexpected chapter number: %s in %s" %
                       (f, full))
                 continue
@@ -1139,11 +2490,15 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
                 print("Would remove %s" % (full,))
             else:
                 self.verbose("Removing %s" % (full,))
-                os.unlink(full)
+                self.output.remove(full)
+        if (keep is not None and written != keep and not self._dryrun
+                and self.output.caches):
+            generated[prefix + "*" + suffix] = keep
+            with self.output.open(self.generated_path(path)) as out:
+                json.dump(generated, out, sort_keys=True, indent=1)
         return
 
     def check_config(self, options):
-        global config_file
         config_name = os.path.expanduser(os.path.join("~", "." + config_file))
         if not os.path.isfile(config_name):
             config_name = None
@@ -1155,7 +2510,7 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
             config_name = c
         if config_name is None:
             config_name = config_file
-        ini = configparser.SafeConfigParser()
+        ini = configparser.ConfigParser()
         ini.read(config_name)
         return ini
 
@@ -1176,15 +2531,15 @@ parser.add_argument("projects", nargs='*', metavar="PROJECT",
     def find_path(self, ref, curdoc):
         ret = None
         if os.path.isabs(ref):
-            ret = os.path.relpath(ref, os.path.sep)
+            # The same as relpath(ref, "/"), without its cost.
+            ret = os.path.normpath(ref).lstrip(os.path.sep)
             ret = os.path.join(self.root, ret)
         else:
             ret = os.path.dirname(curdoc)
             ret = os.path.join(ret, ref)
         return ret
 
-def main() {
+def main():
     locale.setlocale(locale.LC_ALL, '')
     sys.exit(SplitOutline().main(sys.argv[1:]))
-}
 
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Build many independent projects from one command.
+
+    splitoutline batch [-j JOBS] PATH ... [-- ARGS]
+
+Each PATH is a configuration file, a project directory holding a
+`splitoutline.ini`, or a directory whose subdirectories are projects.
+Every project is run with ARGS (which may start with a command, such as
+`check`) from the directory holding its configuration file, as if
+`splitoutline -c FILE ARGS` had been run there, each with a `SplitOutline`
+of its own.
+
+The paths in a configuration file are relative to the directory it is run
+from, and the builds are bound by the interpreter lock, so projects are
+not built on threads. With one job they are built one after the other in
+this process. Otherwise a pool of JOBS worker processes is started once
+(forked where the platform allows it, so they start with the modules
+loaded and the patterns compiled) and each worker builds one project
+after another, keeping its caches warm.
+
+What each project prints is shown as it finishes, each line starting with
+the project's name, followed by a summary of the status, time, scenes
+filtered and words of every project. The exit status is 1 if any project
+failed.
+"""
+
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import os.path
+import sys
+import threading
+import time
+import traceback
+
+from argparse import ArgumentParser
+
+from . import SplitOutline, commands, config_file
+from . import exporter
+
+batch_parser = ArgumentParser(prog="splitoutline batch",
+                  usage="splitoutline batch [-h] [-j JOBS] [--openmetrics FILE]"
+                        " [--openmetrics-port PORT] PATH ... [-- ARGS]",
+                  description="Build many projects in one process.")
+batch_parser.add_argument("-j", "--jobs", type=int, default=None,
+                  help="Build this many projects at once, in worker"
+                       " processes. [default: the number of processors]")
+batch_parser.add_argument("--openmetrics", metavar="FILE", default=None,
+                  help="Write the figures of every project to FILE in the"
+                       " OpenMetrics text format when the batch ends.")
+batch_parser.add_argument("--openmetrics-port", metavar="PORT", type=int,
+                  default=None,
+                  help="Serve the figures of the finished projects on"
+                       " http://127.0.0.1:PORT/metrics while the batch runs.")
+batch_parser.add_argument("paths", nargs='+', metavar="PATH",
+                  help="A configuration file, a project directory or a"
+                       " directory of projects.")
+
+
+def find_configs(paths):
+    """
+    Return the configuration files found from `paths`, or None if one of
+    them holds none.
+    """
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            inis = [path]
+        elif os.path.isfile(os.path.join(path, config_file)):
+            inis = [os.path.join(path, config_file)]
+        elif os.path.isdir(path):
+            inis = []
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                ini = os.path.join(path, entry.name, config_file)
+                if entry.is_dir() and os.path.isfile(ini):
+                    inis.append(ini)
+        else:
+            inis = []
+        if len(inis) == 0:
+            print("Error: no %s found in %s." % (config_file, path))
+            return None
+        for ini in inis:
+            ini = os.path.normpath(ini)
+            if ini not in found:
+                found.append(ini)
+    return found
+
+
+def project_args(ini, args):
+    """
+    Return the arguments which run `args` with the configuration file `ini`.
+    """
+    if len(args) > 0 and args[0] in commands:
+        return args[:1] + ["-c", ini] + args[1:]
+    return ["-c", ini] + args
+
+
+def run_project(ini, args):
+    """
+    Run `args` on the project configured by `ini`, from the directory
+    holding it. Returns the exit status, the seconds taken, what was
+    printed and the figures of the run.
+    """
+    cwd = os.getcwd()
+    stdout, stderr = sys.stdout, sys.stderr
+    captured = io.StringIO()
+    sys.stdout = sys.stderr = captured
+    so = SplitOutline()
+    start = time.perf_counter()
+    try:
+        os.chdir(os.path.dirname(os.path.abspath(ini)))
+        status = so.main(project_args(os.path.basename(ini), args))
+    except SystemExit as e:
+        status = e.code
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        elapsed = time.perf_counter() - start
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(cwd)
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        captured.write("%s\n" % (status,))
+        status = 1
+    return status, elapsed, captured.getvalue(), so.run_metrics.samples()
+
+
+def total(samples, name, labels=None):
+    found = 0
+    for sample_labels, value in samples.get(name, []):
+        if labels is None or sample_labels == labels:
+            found += value
+    return found
+
+
+class BatchMetrics(object):
+    """
+    The figures of the projects finished so far, each labelled with its
+    configuration file.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def finish(self, name, status, samples):
+        with self.lock:
+            self.results[name] = (status, samples)
+
+    def render(self):
+        with self.lock:
+            results = dict(self.results)
+        runs = []
+        for name in self.names:
+            if name in results:
+                runs.append(({"config": name}, results[name][1]))
+        failed = len([1 for status, samples in results.values() if status != 0])
+        states = (("done", len(results) - failed), ("failed", failed),
+                  ("pending", len(self.names) - len(results)))
+        runs.append(({}, {"splitoutline_batch_projects":
+                          [({"state": state}, count) for state, count in states]}))
+        return exporter.render(runs)
+
+
+def start_pool(jobs):
+    """
+    Return a pool of `jobs` worker processes, forked from this one where
+    the platform allows it.
+    """
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                  mp_context=context)
+
+
+def serve(metrics, port):
+    try:
+        return exporter.serve(metrics, port)
+    except OSError as e:
+        print("Error: unable to serve metrics on port %u: %s" % (port, e))
+        return None
+
+
+def run_batch(inis, args, jobs, finished, metrics, port=None):
+    """
+    Run every project, calling `finished(ini, result)` as each ends, and
+    return the results in the order of `inis`, or None if the figures
+    could not be served on `port`.
+    """
+    results = {}
+    server = None
+    try:
+        if jobs <= 1:
+            if port is not None:
+                server = serve(metrics, port)
+                if server is None:
+                    return None
+            for ini in inis:
+                results[ini] = run_project(ini, args)
+                finished(ini, results[ini])
+            return [results[ini] for ini in inis]
+        with start_pool(jobs) as pool:
+            # Every worker is started by the first submit, before the
+            # server thread, so none of them is forked from a threaded
+            # process.
+            futures = dict([(pool.submit(run_project, ini, args), ini)
+                            for ini in inis])
+            if port is not None:
+                server = serve(metrics, port)
+                if server is None:
+                    pool.shutdown(cancel_futures=True)
+                    return None
+            for future in concurrent.futures.as_completed(futures):
+                ini = futures[future]
+                try:
+                    results[ini] = future.result()
+                except Exception as e:
+                    # The worker itself died.
+                    results[ini] = (1, 0.0, "Error: %s\n" % (e,), {})
+                finished(ini, results[ini])
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return [results[ini] for ini in inis]
+
+
+def main(so, argv):
+    args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, args = argv[:split], argv[split + 1:]
+    options = batch_parser.parse_args(argv)
+    inis = find_configs(options.paths)
+    if inis is None:
+        return 1
+    jobs = options.jobs
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(inis)))
+    metrics = BatchMetrics(inis)
+    def finished(ini, result):
+        status, elapsed, printed, samples = result
+        metrics.finish(ini, status, samples)
+        for line in printed.splitlines():
+            print("%s: %s" % (ini, line))
+        sys.stdout.flush()
+    start = time.perf_counter()
+    results = run_batch(inis, args, jobs, finished, metrics,
+                        options.openmetrics_port)
+    if results is None:
+        return 1
+    elapsed = time.perf_counter() - start
+    width = max([len(ini) for ini in inis] + [len("project")])
+    print("%-*s %8s %9s %8s %10s" % (width, "project", "status", "seconds",
+                                      "scenes", "words"))
+    failed = 0
+    for ini, (status, seconds, printed, samples) in zip(inis, results):
+        if status != 0:
+            failed += 1
+        state = "ok"
+        if status != 0:
+            state = "exit %s" % (status,)
+        print("%-*s %8s %9.3f %8u %10u" % (width, ini, state, seconds,
+              total(samples, "splitoutline_scenes", {"state": "filtered"}),
+              total(samples, "splitoutline_words")))
+    print("%u projects, %u failed, %.3fs on %u %s." %
+          (len(inis), failed, elapsed, jobs,
+           "worker" if jobs == 1 else "workers"))
+    if options.openmetrics is not None:
+        exporter.write(metrics, options.openmetrics)
+    if failed > 0:
+        return 1
+    return 0
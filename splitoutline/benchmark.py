@@ -0,0 +1,834 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Benchmarks run against a generated project.
+
+    python3 -m splitoutline.benchmark --chapters 30 --scenes 4
+    python3 -m splitoutline.benchmark --only dat --dat-rows 20000
+    python3 -m splitoutline.benchmark --only memory --sizes 10,20,40,80
+    python3 -m splitoutline.benchmark --only threads --threads 8
+    python3 -m splitoutline.benchmark --only vocabulary --vocabulary 20000
+    python3 -m splitoutline.benchmark --only check --chapters 500
+    python3 -m splitoutline.benchmark --only git
+    python3 -m splitoutline.benchmark --only batch --threads 4
+
+The corpus is written to a temporary directory (or `--keep DIR`) with its
+own `splitoutline.ini`, so nothing in the current tree is touched.
+
+The memory benchmark runs the whole of `SplitOutline.main` under
+tracemalloc on a corpus of each size (in chapters) and reports, for each
+phase, the peak above what was held when the phase started, what the
+phase left allocated and the lines which allocated most of that. A phase
+whose peak grows faster than the corpus is flagged.
+
+The threads check builds a set of differently seeded projects, each with
+its own `SplitOutline` and `MemoryOutput`: first each in a process of its
+own, then one after the other in this process, then all at once on a pool
+of threads. Any build whose files differ from the ones built on their own
+is reported.
+
+The vocabulary benchmark builds a project with `--vocabulary` extra made
+up words (one in twenty of them names) once with the exact vocabulary and
+once with the sketch (a Bloom filter of the lower case words and a top-K
+of the capitalized ones) for each of `--budgets`, and compares the names
+each finds, the memory used and the size of `lexicon.json`. The sketch can
+only miss names, never find extra ones.
+
+The check benchmark times `splitoutline check` against a full build of
+the same project in memory. The check should report no problems.
+
+The git check keeps two copies of a project, one of them in a git
+repository. After each of a series of edits, made to both, the first is
+built in full and the second with `--git-changed`. Any file which
+differs between the two is reported.
+
+The batch benchmark builds `2 * --threads` projects with a process of
+their own each, the way a script looping over them would, then with
+`splitoutline batch` on one job and on `--threads` workers, each time from
+fresh copies. Any project whose files differ from the ones built on their
+own is reported.
+"""
+
+import codecs
+import concurrent.futures
+import json
+import math
+import os
+import os.path
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+
+from . import SplitOutline, parser as splitoutline_parser
+from .batch import run_batch
+from .check import check
+from .gitchanges import git
+from .csvhelpers import read_table, read_tail, rewrite_tail, write_table
+from .metrics import available
+from .output import MemoryOutput
+
+words = (
+    "the a and of to in was he she it that his her they had with for on "
+    "at as but not be from by all were said one could into there then "
+    "time back would only over night hand eyes door light road house "
+    "river morning voice window silence storm letter stone winter "
+    "remembered whispered turned looked walked waited listened answered"
+).split()
+names = ("Alice", "Bob", "Mara", "Tobias", "Yusuf", "Hellen")
+terms = ("Old Mill", "the Crossing", "Gray Tower")
+
+bench_parser = ArgumentParser(description="Benchmark splitoutline on a generated project.")
+bench_parser.add_argument("--chapters", type=int, default=20,
+                  help="Number of chapters to generate. [default: 20]")
+bench_parser.add_argument("--scenes", type=int, default=4,
+                  help="Scenes in each chapter. [default: 4]")
+bench_parser.add_argument("--paragraphs", type=int, default=40,
+                  help="Paragraphs in each scene. [default: 40]")
+bench_parser.add_argument("--repeat", type=int, default=3,
+                  help="Keep the best of this many runs. [default: 3]")
+bench_parser.add_argument("--seed", type=int, default=655,
+                  help="Seed for the generated text. [default: 655]")
+bench_parser.add_argument("--keep", metavar="DIR", default=None,
+                  help="Generate the project in DIR and leave it there.")
+bench_parser.add_argument("--only", choices=("metrics", "dat", "memory", "threads",
+                                            "vocabulary", "check", "git",
+                                            "batch"),
+                  default=None,
+                  help="Run only one of the benchmarks. The memory,"
+                       " threads, vocabulary, check, git and batch"
+                       " benchmarks only run when asked for.")
+bench_parser.add_argument("--dat-rows", type=int, default=5000,
+                  help="Rows in the generated stats history. [default: 5000]")
+bench_parser.add_argument("--sizes", default="5,10,20,40",
+                  help="Chapters in each corpus of the memory benchmark."
+                       " [default: 5,10,20,40]")
+bench_parser.add_argument("--top", type=int, default=3,
+                  help="Allocating lines to show for each phase. [default: 3]")
+bench_parser.add_argument("--vocabulary", type=int, default=5000,
+                  help="Extra words in the vocabulary benchmark."
+                       " [default: 5000]")
+bench_parser.add_argument("--budgets", default="8,32,128",
+                  help="Sketch sizes in KiB for the vocabulary benchmark."
+                       " [default: 8,32,128]")
+bench_parser.add_argument("--threads", type=int, default=4,
+                  help="Threads in the threads check and workers in the"
+                       " batch benchmark, which build twice as many"
+                       " projects. [default: 4]")
+
+
+def sentence(rnd, extra=()):
+    out = [rnd.choice(words) for i in range(rnd.randint(4, 16))]
+    if len(extra) > 0:
+        out[rnd.randrange(len(out))] = rnd.choice(extra)
+    if rnd.random() < 0.3:
+        out[rnd.randrange(len(out))] = rnd.choice(names)
+    if rnd.random() < 0.05:
+        out[rnd.randrange(len(out))] = ":term:`%s`" % rnd.choice(terms)
+    out[0] = out[0].capitalize()
+    return " ".join(out) + rnd.choice(".....!?")
+
+
+def paragraph(rnd, extra=()):
+    text = " ".join([sentence(rnd, extra) for i in range(rnd.randint(1, 6))])
+    if rnd.random() < 0.4:
+        text = '"%s" %s said. %s' % (sentence(rnd, extra), rnd.choice(names),
+                                     sentence(rnd, extra))
+    return text
+
+
+def made_up_words(count, seed):
+    """
+    `count` different made up words, every twentieth one a name.
+    """
+    rnd = random.Random(seed)
+    syllables = ("ka", "lo", "mir", "ten", "vas", "dru", "el", "ost", "pa",
+                 "ri", "sun", "tha", "ul", "ven", "zor", "ib", "nek", "qua")
+    made = []
+    seen = set(words)
+    while len(made) < count:
+        word = "".join([rnd.choice(syllables)
+                        for i in range(rnd.randint(2, 4))])
+        if word in seen:
+            continue
+        seen.add(word)
+        if len(made) % 20 == 19:
+            word = word.capitalize()
+        made.append(word)
+    return made
+
+
+def generate_corpus(root, chapters, scenes, paragraphs, seed=655,
+                    absolute=False, vocabulary=0):
+    """
+    Write a project with a `book1` outline of `chapters` chapters of
+    `scenes` scenes each, and return the path to its configuration file.
+    With `absolute` the paths in it do not depend on the current directory.
+    `vocabulary` made up words are used as well as the usual ones.
+    """
+    rnd = random.Random(seed)
+    extra = made_up_words(vocabulary, seed)
+    for d in ("book1/design", "book1/chapters", "book1/scenes", "scenes"):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    ini = os.path.join(root, "splitoutline.ini")
+    base = "."
+    if absolute:
+        base = os.path.abspath(root)
+    with codecs.open(ini, "w", "utf-8") as out:
+        out.write("[global]\nroot={0}\nsuffix=.txt\nprojects=book1\n\n"
+                  "[book1]\noutline={0}/book1/design/outline.txt\n"
+                  "chapter-dir={0}/book1/chapters\n"
+                  "chapter-stub-dir={0}/book1/scenes\n".format(base))
+    outline = codecs.open(os.path.join(root, "book1/design/outline.txt"),
+                          "w", "utf-8")
+    outline.write("Outline\n=======\n\n.. outline:start\n\n")
+    for ch in range(1, chapters + 1):
+        outline.write("- Chapter %u\n\n  %s\n\n" % (ch, sentence(rnd)))
+        if ch == 1 and seed % 2 == 1:
+            # Odd seeds open the book with an epigraph.
+            outline.write("  :Epigraph: `Opening </scenes/scene-001-1>`\n\n")
+        for sc in range(1, scenes + 1):
+            ref = "scene-%03u-%u" % (ch, sc)
+            title = "Scene %u.%u" % (ch, sc)
+            outline.write("  - `%s </scenes/%s>`\n\n    %s\n\n"
+                          % (title, ref, sentence(rnd)))
+            with codecs.open(os.path.join(root, "scenes", ref + ".txt"),
+                             "w", "utf-8") as out:
+                out.write("%s\n%s\n\n" % (title, "=" * len(title)))
+                for p in range(paragraphs):
+                    out.write(paragraph(rnd, extra) + "\n\n")
+    outline.write(".. outline:end\n")
+    outline.close()
+    return ini
+
+
+def load_project(ini, project="book1"):
+    so = SplitOutline()
+    so.options = splitoutline_parser.parse_args(["-c", ini])
+    so.ini = so.check_config(so.options)
+    so.projects = [project]
+    so.setup_project(project)
+    so.parse_outline_file()
+    return so
+
+
+def best_of(repeat, func):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_metrics(so, repeat):
+    """
+    Time `filter_lines` over every scene with no metrics, each metric on its
+    own, and every metric together.
+    """
+    def run():
+        so.stats = {}
+        so.termmap = {}
+        # Every scene is fingerprinted, as if each one had changed.
+        so.fingerprints = {}
+        so.fingerprints_known = True
+        for ch in so.outline:
+            for scene in ch[1:]:
+                for line in so.filter_lines(so.find_path(scene, so.outline_path)):
+                    pass
+
+    setups = [("(none)", [])]
+    for name in sorted(available):
+        setups.append((name, [available[name]()]))
+    setups.append(("(all)", [available[name]() for name in sorted(available)]))
+    results = []
+    for name, metrics in setups:
+        so.metrics = metrics
+        so.fingerprinting = "revisions" in [metric.name for metric in metrics]
+        results.append((name, best_of(repeat, run)))
+    return results
+
+
+def bench_dat(root, rows, repeat, seed=655):
+    """
+    Time writing and reading a `.dat` history of `rows` days, reading only
+    its last rows, and replacing the last row in place.
+    """
+    rnd = random.Random(seed)
+    path = os.path.join(root, "history.dat")
+    table = [["Date", "Words", "Characters", "Paragraphs", "Words Per Paragraph",
+              "Pages (250)", "Pages (350)", "Word Changes"]]
+    wc = 0
+    for day in range(rows):
+        change = rnd.randint(0, 2000)
+        wc += change
+        table.append(["%04u-%02u-%02u" % (2000 + day // 372, day // 31 % 12 + 1,
+                                          day % 31 + 1),
+                      wc, wc * 6, wc // 60, 60.0, wc / 250.0, wc / 350.0, change])
+    last = table[-1]
+    results = []
+    results.append(("write_table", best_of(repeat,
+                                          lambda: write_table(path, table))))
+    results.append(("read_table", best_of(repeat, lambda: read_table(path))))
+    results.append(("read_tail", best_of(repeat, lambda: read_tail(path, 2))))
+    offset = read_tail(path)[1][-1][0]
+    results.append(("rewrite_tail", best_of(repeat,
+                        lambda: rewrite_tail(path, offset, [last]))))
+    if read_table(path) != [[str(v) for v in row] for row in table]:
+        print("WARNING: %s did not read back as written" % path)
+    return results
+
+
+class PhaseMemory(SplitOutline):
+    """
+    Records the memory of each phase of `main` in `phases`, as a list of
+    (name, peak, retained, top lines).
+    """
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+
+    def __init__(self, top=3):
+        SplitOutline.__init__(self)
+        self.top = top
+        self.phases = []
+        self.started = None
+
+    def phase(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        if self.started is not None:
+            label, base, before = self.started
+            after = tracemalloc.take_snapshot().filter_traces(self.ignore)
+            top = after.compare_to(before, "lineno")[:self.top]
+            self.phases.append((label, peak - base, current - base, top))
+            self.started = None
+            del after, before
+        if name is not None:
+            before = tracemalloc.take_snapshot().filter_traces(self.ignore)
+            tracemalloc.reset_peak()
+            # `before` is held until the phase ends, so it is part of both
+            # the base and the figures taken then.
+            self.started = (name, tracemalloc.get_traced_memory()[0], before)
+
+
+def bench_memory(root, sizes, scenes, paragraphs, top, seed=655):
+    """
+    Run `main` on a corpus of each size, returning (size, phases) pairs
+    with the phases of every project summed by name.
+    """
+    results = []
+    cwd = os.getcwd()
+    for chapters in sizes:
+        corpus = os.path.join(root, "memory-%u" % (chapters,))
+        ini = generate_corpus(corpus, chapters, scenes, paragraphs, seed)
+        so = PhaseMemory(top)
+        os.chdir(corpus)
+        stdout, stderr = sys.stdout, sys.stderr
+        quiet = open(os.devnull, "w")
+        sys.stdout = sys.stderr = quiet
+        tracemalloc.start()
+        try:
+            so.main(["-c", ini])
+        finally:
+            tracemalloc.stop()
+            sys.stdout, sys.stderr = stdout, stderr
+            quiet.close()
+            os.chdir(cwd)
+        phases = []
+        byname = {}
+        for name, peak, retained, lines in so.phases:
+            if name not in byname:
+                byname[name] = [name, 0, 0, lines]
+                phases.append(byname[name])
+            byname[name][1] = max(byname[name][1], peak)
+            byname[name][2] += retained
+        results.append((chapters, phases))
+    return results
+
+
+def build_in_memory(ini):
+    so = SplitOutline(MemoryOutput())
+    so.main(["-c", ini])
+    return so.output.files
+
+
+def bench_threads(root, threads, chapters, scenes, paragraphs, repeat,
+                  seed=655):
+    """
+    Build `2 * threads` projects one at a time and then `repeat` times
+    concurrently. Returns the time taken one at a time, the best time on
+    the threads and the numbers of the builds which did not match the
+    ones built in a separate process.
+    """
+    inis = []
+    for i in range(2 * threads):
+        corpus = os.path.join(root, "threads-%u" % (i,))
+        inis.append(generate_corpus(corpus, chapters + i % 3, scenes,
+                                    paragraphs, seed + i, absolute=True))
+    stdout, stderr = sys.stdout, sys.stderr
+    quiet = open(os.devnull, "w")
+    sys.stdout = sys.stderr = quiet
+    try:
+        expected = []
+        for ini in inis:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as alone:
+                expected.append(alone.submit(build_in_memory, ini).result())
+        differ = set()
+        start = time.perf_counter()
+        for n in range(len(inis)):
+            if build_in_memory(inis[n]) != expected[n]:
+                differ.add(n)
+        sequential = time.perf_counter() - start
+        threaded = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            for i in range(repeat):
+                start = time.perf_counter()
+                results = list(pool.map(build_in_memory, inis))
+                elapsed = time.perf_counter() - start
+                if threaded is None or elapsed < threaded:
+                    threaded = elapsed
+                for n in range(len(inis)):
+                    if results[n] != expected[n]:
+                        differ.add(n)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        quiet.close()
+    return sequential, threaded, sorted(differ)
+
+
+def bench_check(ini, repeat):
+    """
+    Time checking the project, with the outline cache written, against
+    building it. Returns the best check time, the problems found and the
+    build time.
+    """
+    load_project(ini)
+    problems = []
+    def run():
+        so = SplitOutline()
+        so.options = splitoutline_parser.parse_args(["-c", ini])
+        so.ini = so.check_config(so.options)
+        so._dryrun = True
+        problems[:] = check(so, ["book1"])[0]
+    checked = best_of(repeat, run)
+    stdout, stderr = sys.stdout, sys.stderr
+    quiet = open(os.devnull, "w")
+    sys.stdout = sys.stderr = quiet
+    try:
+        built = best_of(1, lambda: build_in_memory(ini))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        quiet.close()
+    return checked, problems, built
+
+
+def read_tree(root):
+    """
+    Return a dict of path (relative to `root`) to content for every file
+    under `root`, leaving out the git repository. The path of `root` in the
+    files is replaced, so copies of a project in different places compare
+    the same.
+    """
+    files = {}
+    # Chapter stub labels are made from the path too.
+    base = os.path.abspath(root)
+    label = re.sub("[-._/]+", "-", base)
+    if label.startswith("-"):
+        label = label[1:]
+    for dirpath, dirnames, filenames in os.walk(root):
+        if ".git" in dirnames:
+            dirnames.remove(".git")
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root)] = f.read().replace(
+                        base.encode("utf-8"), b"$ROOT").replace(
+                        label.encode("utf-8"), b"$LABEL")
+    return files
+
+
+def edit_file(path, change):
+    with codecs.open(path, "r", "utf-8") as f:
+        text = f.read()
+    with codecs.open(path, "w", "utf-8") as f:
+        f.write(change(text))
+
+
+def bench_git(root, chapters, scenes, paragraphs, seed=655):
+    """
+    Build a project in full and with `--git-changed` after each of a series
+    of edits. Returns, for each edit, its name, the time of each build, the
+    number of chapters the git build chose (None for all of them) and the
+    files which differed. Returns None if git can not be run.
+    """
+    if git(root, "--version") is None:
+        return None
+    full = os.path.join(root, "git-full")
+    changed = os.path.join(root, "git-changed")
+    inis = [generate_corpus(full, chapters, scenes, paragraphs, seed, absolute=True),
+            generate_corpus(changed, chapters, scenes, paragraphs, seed, absolute=True)]
+    def commit(message):
+        git(changed, "add", "-A")
+        git(changed, "-c", "user.name=bench", "-c", "user.email=bench@localhost",
+            "commit", "-q", "-m", message)
+    git(changed, "init", "-q")
+    commit("generated")
+    first = "scenes/scene-%03u-1.txt" % (min(2, chapters),)
+    chapter = os.path.join("book1/chapters", "chapter-%s.txt" %
+            ("%%0%uu" % (len(str(chapters)),) % (1,)))
+    edits = [
+        ("first build", None),
+        ("edit a scene", lambda base: edit_file(os.path.join(base, first),
+                lambda text: text + "A new paragraph.\n")),
+        ("commit", lambda base: base == changed and commit("edited")),
+        ("revert the scene", lambda base: edit_file(os.path.join(base, first),
+                lambda text: text[:-len("A new paragraph.\n")])),
+        ("unused file", lambda base: edit_file(os.path.join(base, "notes.txt"),
+                lambda text: text + "notes\n")),
+        ("remove a chapter", lambda base: os.unlink(os.path.join(base, chapter))),
+        ("edit the outline", lambda base: edit_file(
+                os.path.join(base, "book1/design/outline.txt"),
+                lambda text: text.replace("- Chapter 1\n\n", "- Chapter 1\n\n  Revised.\n\n", 1))),
+    ]
+    for base in (full, changed):
+        codecs.open(os.path.join(base, "notes.txt"), "w", "utf-8").close()
+    commit("notes")
+    # Only the changed copy records its builds.
+    skip = set([os.path.join(".stats", "git-build.json")])
+    results = []
+    stdout, stderr = sys.stdout, sys.stderr
+    quiet = open(os.devnull, "w")
+    sys.stdout = sys.stderr = quiet
+    try:
+        for name, edit in edits:
+            if edit is not None:
+                edit(full)
+                edit(changed)
+            times = []
+            selections = []
+            for args in (["-c", inis[0]], ["-c", inis[1], "--git-changed"]):
+                so = SplitOutline()
+                select = so.select_chapters
+                def selecting():
+                    selected = select()
+                    selections.append(selected)
+                    return selected
+                so.select_chapters = selecting
+                start = time.perf_counter()
+                so.main(args)
+                times.append(time.perf_counter() - start)
+            chosen = selections[-1]
+            if chosen is not None:
+                chosen = len(chosen)
+            left, right = read_tree(full), read_tree(changed)
+            differ = []
+            for path in sorted(set(left) | set(right)):
+                if path in skip or path.startswith(os.path.join(".stats", "outlines")):
+                    continue
+                if left.get(path) != right.get(path):
+                    differ.append(path)
+            results.append((name, times[0], times[1], chosen, differ))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        quiet.close()
+    return results
+
+
+def bench_batch(root, jobs, chapters, scenes, paragraphs, seed=655):
+    """
+    Build `2 * jobs` projects with a process each, then in a batch on one
+    job and on `jobs` workers. Returns the name and time of each way and
+    the projects whose files differed from the ones built on their own.
+    """
+    source = os.path.join(root, "batch-source")
+    names = []
+    for i in range(2 * jobs):
+        names.append("project-%u" % (i,))
+        generate_corpus(os.path.join(source, names[-1]), chapters + i % 3,
+                        scenes, paragraphs, seed + i)
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([top] + [p for p in
+            env.get("PYTHONPATH", "").split(os.pathsep) if p != ""])
+    command = [sys.executable, "-c", "import sys, splitoutline;"
+               " sys.exit(splitoutline.SplitOutline().main(sys.argv[1:]))"]
+    def separate(base):
+        for name in names:
+            subprocess.run(command, cwd=os.path.join(base, name), env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    def batch(workers):
+        def run(base):
+            inis = [os.path.join(base, name, "splitoutline.ini") for name in names]
+            run_batch(inis, [], workers, lambda ini, result: None, None)
+        return run
+    ways = [("a process each", separate), ("batch, 1 job", batch(1)),
+            ("batch, %u workers" % (jobs,), batch(jobs))]
+    results = []
+    trees = []
+    for n, (label, run) in enumerate(ways):
+        base = os.path.join(root, "batch-%u" % (n,))
+        shutil.copytree(source, base)
+        start = time.perf_counter()
+        run(base)
+        results.append((label, time.perf_counter() - start))
+        trees.append([read_tree(os.path.join(base, name)) for name in names])
+    # The outline cache is named after the outline's path.
+    cache = os.path.join(".stats", "outlines")
+    differ = set()
+    for built in trees[1:]:
+        for name, left, right in zip(names, trees[0], built):
+            for path in set(left) | set(right):
+                if not path.startswith(cache) and left.get(path) != right.get(path):
+                    differ.add(name)
+    return results, sorted(differ)
+
+
+def lexicon_table(so):
+    # The same table is saved whichever way the vocabulary is kept.
+    data = json.loads(so.output.files[os.path.normpath(so.lexicon_path())])
+    return data["cases"]
+
+
+def found_names(so):
+    table = lexicon_table(so)
+    return set([table[lower]["canonical"] for lower in table
+                if table[lower]["name"]])
+
+
+def bench_vocabulary(root, chapters, scenes, paragraphs, vocabulary, budgets,
+                     seed=655):
+    """
+    Build the project with the exact vocabulary and then with the sketch
+    for each budget (in KiB). Returns the number of lower case words and
+    a (label, peak, lexicon size, names, missed, extra, error rate) tuple
+    for each build.
+    """
+    corpus = os.path.join(root, "vocabulary")
+    ini = generate_corpus(corpus, chapters, scenes, paragraphs, seed,
+                          absolute=True, vocabulary=vocabulary)
+    with codecs.open(ini, "r", "utf-8") as iniFile:
+        config = iniFile.read()
+    runs = [("exact", None)]
+    for budget in budgets:
+        runs.append(("sketch %gKiB" % (budget,), budget))
+    results = []
+    exact = None
+    lower = 0
+    stdout, stderr = sys.stdout, sys.stderr
+    quiet = open(os.devnull, "w")
+    try:
+        for label, budget in runs:
+            with codecs.open(ini, "w", "utf-8") as out:
+                if budget is None:
+                    out.write(config)
+                else:
+                    out.write(config.replace("[global]\n",
+                        "[global]\nvocabulary=sketch\nvocabulary-memory=%g\n"
+                        % (budget,), 1))
+            so = SplitOutline(MemoryOutput())
+            sys.stdout = sys.stderr = quiet
+            tracemalloc.start()
+            try:
+                so.main(["-c", ini])
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                sys.stdout, sys.stderr = stdout, stderr
+            found = found_names(so)
+            error = None
+            if exact is None:
+                exact = found
+                table = lexicon_table(so)
+                for word in table:
+                    if table[word]["canonical"] == word:
+                        lower += 1
+            else:
+                error = so.lowercase.error_rate()
+            size = len(so.output.files[os.path.normpath(so.lexicon_path())])
+            results.append((label, peak, size, len(found),
+                            len(exact - found), len(found - exact), error))
+    finally:
+        quiet.close()
+        with codecs.open(ini, "w", "utf-8") as out:
+            out.write(config)
+    return lower, results
+
+
+def growth(sizes, values):
+    """
+    The slope of `values` against `sizes` on a log-log scale: 1.0 for
+    linear growth, more for faster growth.
+    """
+    if len(sizes) < 2 or values[0] <= 0 or values[-1] <= 0:
+        return None
+    return (math.log(float(values[-1]) / values[0]) /
+            math.log(float(sizes[-1]) / sizes[0]))
+
+
+def print_memory(results, scenes, paragraphs):
+    sizes = [chapters for chapters, phases in results]
+    print("memory per phase (KiB), %u scenes of %u paragraphs a chapter:" %
+          (scenes, paragraphs))
+    print("  %-10s" % ("chapters",) +
+          "".join(["%18u" % (chapters,) for chapters in sizes]) + "  growth")
+    print("  %-10s" % ("",) +
+          "".join(["%18s" % ("peak / retained",) for chapters in sizes]))
+    names = [phase[0] for phase in results[-1][1]]
+    flagged = []
+    for name in names:
+        peaks = []
+        row = "  %-10s" % (name,)
+        for chapters, phases in results:
+            for phase in phases:
+                if phase[0] == name:
+                    peaks.append(phase[1])
+                    row += "%9.0f /%7.0f" % (phase[1] / 1024.0,
+                                             phase[2] / 1024.0)
+        slope = growth(sizes, peaks)
+        if slope is not None:
+            row += "  %5.2f" % (slope,)
+            if slope > 1.2:
+                row += " SUPERLINEAR"
+                flagged.append(name)
+        print(row)
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print("top allocating lines at %u chapters (retained KiB):" % (sizes[-1],))
+    for name, peak, retained, lines in results[-1][1]:
+        print("  %s:" % (name,))
+        for stat in lines:
+            frame = stat.traceback[0]
+            filename = frame.filename
+            if filename.startswith(top + os.sep):
+                filename = os.path.relpath(filename, top)
+            print("    %8.1f  %s:%u" % (stat.size_diff / 1024.0, filename,
+                                       frame.lineno))
+    return flagged
+
+
+def main(argv=None):
+    options = bench_parser.parse_args(argv)
+    root = options.keep
+    if root is None:
+        root = tempfile.mkdtemp(prefix="splitoutline-bench-")
+    cwd = os.getcwd()
+    try:
+        ini = generate_corpus(root, options.chapters, options.scenes,
+                              options.paragraphs, options.seed)
+        os.chdir(root)
+        if options.only in (None, "metrics"):
+            so = load_project(ini)
+            results = bench_metrics(so, options.repeat)
+            base = results[0][1]
+            print("filter_lines over %u scenes, best of %u:" %
+                  (options.chapters * options.scenes, options.repeat))
+            for name, elapsed in results:
+                print("  %-12s %8.4fs  %+6.1f%%" %
+                      (name, elapsed, 100.0 * (elapsed - base) / base))
+        if options.only == "memory":
+            sizes = [int(size) for size in options.sizes.split(",")]
+            results = bench_memory(root, sizes, options.scenes,
+                                   options.paragraphs, options.top,
+                                   options.seed)
+            flagged = print_memory(results, options.scenes, options.paragraphs)
+            if len(flagged) > 0:
+                print("WARNING: superlinear memory growth in %s" %
+                      (", ".join(flagged),))
+        if options.only == "threads":
+            sequential, threaded, differ = bench_threads(
+                root, options.threads, options.chapters, options.scenes,
+                options.paragraphs, options.repeat, options.seed)
+            print("%u builds, one at a time: %8.4fs" %
+                  (2 * options.threads, sequential))
+            print("%u builds on %u threads, best of %u: %8.4fs" %
+                  (2 * options.threads, options.threads, options.repeat,
+                   threaded))
+            for n in differ:
+                print("WARNING: build %u differed from the build on its own" % (n,))
+        if options.only == "vocabulary":
+            budgets = [float(budget) for budget in options.budgets.split(",")]
+            lower, results = bench_vocabulary(
+                root, options.chapters, options.scenes, options.paragraphs,
+                options.vocabulary, budgets, options.seed)
+            print("vocabulary of %u lower case words over %u scenes:" %
+                  (lower, options.chapters * options.scenes))
+            print("  %-16s %10s %12s %6s %7s %11s" % ("", "peak KiB",
+                  "lexicon KiB", "names", "missed", "est. error"))
+            for label, peak, size, found, missed, extra, error in results:
+                row = "  %-16s %10.0f %12.0f %6u" % (label, peak / 1024.0,
+                                                     size / 1024.0, found)
+                if error is not None:
+                    row += " %7u %11.2e" % (missed, error)
+                print(row)
+                if extra > 0:
+                    print("WARNING: %s found %u names the exact vocabulary"
+                          " did not" % (label, extra))
+        if options.only == "check":
+            checked, problems, built = bench_check(ini, options.repeat)
+            print("check of %u scenes, best of %u: %8.4fs" %
+                  (options.chapters * options.scenes, options.repeat, checked))
+            print("full build in memory:         %8.4fs" % (built,))
+            for problem in problems:
+                print("WARNING: %s" % (problem,))
+        if options.only == "git":
+            results = bench_git(root, options.chapters, options.scenes,
+                                options.paragraphs, options.seed)
+            if results is None:
+                print("WARNING: git could not be run")
+            else:
+                print("%-18s %9s %13s %9s" % ("", "full", "--git-changed",
+                                              "chapters"))
+                for name, full, changed, chosen, differ in results:
+                    if chosen is None:
+                        chosen = "all"
+                    print("%-18s %8.4fs %12.4fs %9s" % (name, full, changed, chosen))
+                    for path in differ:
+                        print("WARNING: %s differs after %s" % (path, name))
+        if options.only == "batch":
+            results, differ = bench_batch(root, options.threads,
+                                          options.chapters, options.scenes,
+                                          options.paragraphs, options.seed)
+            print("%u projects:" % (2 * options.threads,))
+            for label, elapsed in results:
+                print("  %-18s %8.4fs" % (label, elapsed))
+            for name in differ:
+                print("WARNING: %s differed from the build on its own" % (name,))
+        if options.only in (None, "dat"):
+            results = bench_dat(root, options.dat_rows, options.repeat,
+                                options.seed)
+            print(".dat history of %u rows, best of %u:" %
+                  (options.dat_rows, options.repeat))
+            for name, elapsed in results:
+                if name in ("read_tail", "rewrite_tail"):
+                    print("  %-12s %8.4fs" % (name, elapsed))
+                else:
+                    print("  %-12s %8.4fs  %10.0f rows/s" %
+                          (name, elapsed, options.dat_rows / elapsed))
+    finally:
+        os.chdir(cwd)
+        if options.keep is None:
+            shutil.rmtree(root)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
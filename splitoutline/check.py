@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Read-only check of the outlines and the scene tree, for pre-commit hooks.
+
+    splitoutline check [PROJECT ...]
+
+The outlines are parsed (through the outline cache, which is read but not
+written) and every scene reference is resolved, then each directory
+holding a scene is listed once. Nothing is filtered and nothing is
+written. The problems reported are:
+
+* scenes and epigraphs whose file does not exist
+* files in a scene directory which no outline refers to (chapter stubs
+  and outlines are left out), only when every project is checked
+* a scene given more than once in the same book
+* chapters dropped for having no scenes
+* outline lines which match both a chapter and a scene
+
+Scenes shared by more than one book are listed too, but are not counted
+as problems. The exit status is 1 if there were any problems.
+"""
+
+import os
+import os.path
+
+from argparse import ArgumentParser
+
+from .index import config_projects
+
+check_parser = ArgumentParser(prog="splitoutline check",
+                  description="Check the outlines and scene files without"
+                              " writing anything.")
+check_parser.add_argument("-c", "--config", metavar="FILE", default=None,
+                  help="Set the configuration file to FILE.")
+check_parser.add_argument("projects", nargs='*', metavar="PROJECT",
+                  help="Select alternate projects from the config.")
+
+
+def read_project(so, project):
+    """
+    Parse the outlines of `project` the way `load_project` does, but
+    without stopping when there are no chapters. Returns the outline
+    models and the chapters.
+    """
+    so.setup_project(project)
+    path = os.path.normpath(so.outline_path)
+    models = so.read_outlines(path)
+    data = []
+    so.outlineData = {}
+    so.outline_files = []
+    so.outline_warnings = []
+    so.stitch_outline(path, models, data, [])
+    so.outline = data
+    return models, data
+
+
+def list_dirs(dirs):
+    """
+    Return a dict of directory to the set of file names in it.
+    """
+    listing = {}
+    for d in dirs:
+        names = set()
+        try:
+            for entry in os.scandir(d):
+                if entry.is_file():
+                    names.add(entry.name)
+        except OSError:
+            pass
+        listing[d] = names
+    return listing
+
+
+def check(so, projects, orphans=True):
+    """
+    Return the problems found in `projects` and the scenes they share.
+    Files no outline refers to are only looked for with `orphans`.
+    """
+    problems = []
+    shared = []
+    referenced = {}
+    owners = {}
+    generated = []
+    outlines = set()
+    for project in projects:
+        models, data = read_project(so, project)
+        for path in so.outline_files:
+            if path in outlines:
+                continue
+            outlines.add(path)
+            for warning in models[path]["warnings"]:
+                problems.append("%s: %s" % (path,
+                        warning.replace("WARNING: ", "", 1).rstrip()))
+            for line in models[path]["dropped"]:
+                problems.append("%s: chapter has no scenes: %s" % (path, line))
+        if len(data) == 0:
+            problems.append("%s: no chapters found" % (project,))
+        if not os.path.isdir(so.chapter_path):
+            problems.append("%s: no chapter directory %s" %
+                            (project, so.chapter_path))
+        generated.append((os.path.normpath(so.chapter_path), so.chapter_prefix))
+        generated.append((os.path.normpath(so.chapterstub_path),
+                          so.chapterstub_prefix))
+        if so.book_toc_path is not None:
+            generated.append(os.path.split(os.path.normpath(so.book_toc_path)))
+        found = {}
+        chNum = 0
+        for ch in data:
+            chNum += 1
+            for scene in ch[1:]:
+                path = os.path.normpath(so.find_path(scene, so.outline_path) + so.suffix)
+                if path in found:
+                    problems.append("%s: %s is in chapter %u and chapter %u" %
+                                    (project, scene, found[path], chNum))
+                    continue
+                found[path] = chNum
+                referenced.setdefault(path, (project, scene))
+                owners.setdefault(path, []).append(project)
+        for epigraph in so.epigraphs:
+            path = os.path.normpath(so.find_path(epigraph, so.outline_path) + so.suffix)
+            referenced.setdefault(path, (project, epigraph))
+    wanted = {}
+    for path in referenced:
+        d, name = os.path.split(path)
+        wanted.setdefault(d, set()).add(name)
+    for path in outlines:
+        d, name = os.path.split(path)
+        if d in wanted:
+            wanted[d].add(name)
+    listing = list_dirs(wanted)
+    for d in sorted(wanted):
+        for name in sorted(wanted[d] - listing[d]):
+            path = os.path.join(d, name)
+            if path in referenced:
+                project, ref = referenced[path]
+                problems.append("%s: missing %s (%s)" % (project, ref, path))
+    for path in sorted(owners):
+        if len(owners[path]) > 1:
+            shared.append("%s: shared by %s" % (path, ", ".join(owners[path])))
+    if not orphans:
+        return problems, shared
+    for d in sorted(listing):
+        prefixes = tuple([prefix for gendir, prefix in generated if gendir == d])
+        for name in sorted(listing[d] - wanted[d]):
+            if not name.endswith(so.suffix):
+                continue
+            if len(prefixes) > 0 and name.startswith(prefixes):
+                continue
+            problems.append("%s: not in any outline" % (os.path.join(d, name),))
+    return problems, shared
+
+
+def main(so, argv):
+    options = check_parser.parse_args(argv)
+    projects = config_projects(so, options)
+    if len(projects) == 0:
+        print("Error: no projects to check.")
+        return 1
+    so.reset()
+    # Not even the outline cache is written.
+    so._dryrun = True
+    # Other books may use the files, unless every book is checked.
+    problems, shared = check(so, projects, len(options.projects) == 0)
+    for line in problems:
+        print(line)
+    for line in shared:
+        print(line)
+    if len(problems) > 0:
+        print("%u problems found." % (len(problems),))
+        return 1
+    return 0
@@ -1,63 +1,112 @@
 #!/usr/bin/env python3
 
-import csv, codecs, io
+"""
+Reading and writing the `.dat` stats histories.
 
-class UTF8Recoder:
-    """
-    Iterator that reads an encoded stream and reencodes the input to UTF-8
-    """
-    def __init__(self, f, encoding):
-        self.reader = codecs.getreader(encoding)(f)
+A history is a tab separated table: a header row followed by one row per
+day. The files are UTF-8 with the `excel-tab` dialect, so "\\r\\n" ends each
+row. None of the values ever hold a line break, which lets the last rows
+be read from the end of the file without reading the rest of it.
+"""
+
+import csv
+import io
+import os
 
-    def __iter__(self):
-        return self
+from .output import new_file
 
-    def __next__(self):
-        return self.reader.next().encode("utf-8")
+dialect = csv.excel_tab
 
-class UnicodeReader:
+
+def read_table(path):
     """
-    A CSV reader which will iterate over lines in the CSV file "f",
-    which is encoded in the given encoding.
+    Return every row of the history at `path`, header included.
     """
+    with open(path, "r", encoding="utf-8", newline="") as datfile:
+        return list(csv.reader(datfile, dialect=dialect))
 
-    def __init__(self, f, dialect=csv.excel_tab, encoding="utf-8", **kwds):
-        f = UTF8Recoder(f, encoding)
-        self.reader = csv.reader(f, dialect=dialect, **kwds)
 
-    def __next__(self):
-        row = next(self.reader)
-        return [str(s, "utf-8") for s in row]
+def write_table(path, rows):
+    """
+    Replace the history at `path` with `rows`, written in one go.
+    """
+    datfile, newpath = new_file(path)
+    with datfile:
+        write_rows(datfile, rows)
+    os.rename(newpath, path)
 
-    def __iter__(self):
-        return self
 
-class UnicodeWriter:
+def write_rows(out, rows):
     """
-    A CSV writer which will write rows to CSV file "f",
-    which is encoded in the given encoding.
+    Write `rows` to the text stream `out`, which must not translate line
+    ends.
     """
+    csv.writer(out, dialect=dialect).writerows(rows)
 
-    def __init__(self, f, dialect=csv.excel_tab, encoding="utf-8", **kwds):
-        # Redirect output to a queue
-        self.queue = io.StringIO()
-        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
-        self.stream = f
-        self.encoder = codecs.getincrementalencoder(encoding)()
 
-    def writerow(self, row):
-        r = []
-        for c in row:
-            if isinstance(c, str):
-                r.append(c.encode("utf-8"))
-            else:
-                r.append(str(c).encode("utf-8"))
-        self.writer.writerow(r)
-        data = self.queue.getvalue().decode("utf-8")
-        self.stream.write(self.encoder.encode(data))
-        self.queue.truncate(0)
+def read_tail(path, count=1, blocksize=4096):
+    """
+    Return the header and the last `count` rows after it, each row paired
+    with the byte offset at which it starts.
+
+    Only the first line and enough blocks from the end of the file to hold
+    `count` rows are read.
+    """
+    with open(path, "rb") as datfile:
+        header = datfile.readline()
+        start = datfile.tell()
+        pos = datfile.seek(0, os.SEEK_END)
+        data = b""
+        while pos > start and data.count(b"\n") <= count:
+            step = min(blocksize, pos - start)
+            pos -= step
+            datfile.seek(pos)
+            data = datfile.read(step) + data
+    lines = data.splitlines(True)
+    if pos > start:
+        # The first line is only the end of a row.
+        pos += len(lines[0])
+        lines = lines[1:]
+    tail = []
+    for line in lines:
+        if line.strip() != b"":
+            tail.append((pos, line.decode("utf-8")))
+        pos += len(line)
+    tail = tail[-count:]
+    rows = list(csv.reader([line for offset, line in tail], dialect=dialect))
+    header = list(csv.reader([header.decode("utf-8")], dialect=dialect))
+    if len(header) == 0:
+        header = [[]]
+    return header[0], [(tail[i][0], rows[i]) for i in range(len(tail))]
 
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
 
+def rewrite_tail(path, offset, rows):
+    """
+    Cut the history at `path` off at `offset` and append `rows` there. With
+    an `offset` of None the rows are added to the end.
+
+    The rows before `offset` are copied as they are, without being parsed,
+    and the result replaces the history through a `.new` file, so a failed
+    write leaves the old history in place.
+    """
+    buf = io.StringIO()
+    csv.writer(buf, dialect=dialect).writerows(rows)
+    data = buf.getvalue().encode("utf-8")
+    out, newpath = new_file(path, binary=True)
+    with open(path, "rb") as datfile, out:
+        if offset is None:
+            offset = datfile.seek(0, os.SEEK_END)
+            datfile.seek(0)
+        left = offset
+        last = b"\n"
+        while left > 0:
+            block = datfile.read(min(left, 65536))
+            if len(block) == 0:
+                break
+            out.write(block)
+            last = block[-1:]
+            left -= len(block)
+        if last not in (b"\n", b"\r"):
+            out.write(dialect.lineterminator.encode("utf-8"))
+        out.write(data)
+    os.rename(newpath, path)
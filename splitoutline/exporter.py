@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Figures about a run, in the OpenMetrics text format.
+
+`RunMetrics` is updated by `SplitOutline` as it goes. `--openmetrics FILE`
+writes them to FILE at the end of the run (through a `.new` file, as the
+Prometheus textfile collector expects), and `--openmetrics-port PORT`
+serves them from `http://127.0.0.1:PORT/metrics` while the run lasts.
+
+Every value describes the run, so they are all gauges:
+
+    splitoutline_phase_seconds{phase}  time in each phase of `main`
+    splitoutline_run_seconds           time since the run started
+    splitoutline_scenes{state}         scenes filtered, reused from another
+                                       project or not filtered at all
+    splitoutline_read_bytes            scene and outline text read
+    splitoutline_written_bytes         generated files written
+    splitoutline_outline_lines         lines in the outlines used
+    splitoutline_vocabulary_words      different words found (an estimate
+                                       with vocabulary=sketch)
+    splitoutline_peak_rss_bytes        largest resident size of the process
+    splitoutline_words{project}        the project word count
+    splitoutline_running               1 until the run ends
+    splitoutline_last_run_timestamp_seconds
+
+`splitoutline batch` puts the figures of every project in one exposition,
+each with a `config` label, along with `splitoutline_batch_projects`.
+"""
+
+import http.server
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .output import new_file
+
+content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+scene_states = ("filtered", "reused", "skipped")
+
+families = (
+    ("splitoutline_phase_seconds", "Seconds spent in each phase of the run."),
+    ("splitoutline_run_seconds", "Seconds since the run started."),
+    ("splitoutline_scenes", "Scenes filtered, reused or skipped."),
+    ("splitoutline_read_bytes", "Bytes of scene and outline text read."),
+    ("splitoutline_written_bytes", "Bytes of generated files written."),
+    ("splitoutline_outline_lines", "Lines in the outlines used."),
+    ("splitoutline_vocabulary_words", "Different words found."),
+    ("splitoutline_peak_rss_bytes", "Peak resident memory of the process."),
+    ("splitoutline_words", "Words in each project."),
+    ("splitoutline_running", "1 while the run is going on."),
+    ("splitoutline_last_run_timestamp_seconds", "When the run ended."),
+    ("splitoutline_batch_projects", "Projects in the batch, by state."),
+)
+
+
+def escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+
+def peak_rss():
+    if resource is None:
+        return None
+    # In KiB, except on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class RunMetrics(object):
+    """
+    The figures for one run. `labels` are added to every sample.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.ended = None
+        self.phases = {}
+        self.current = None
+        self.scenes = dict([(state, 0) for state in scene_states])
+        self.read = 0
+        self.written = 0
+        self.outline_lines = 0
+        self.vocabulary = None
+        self.words = {}
+
+    def phase(self, name):
+        """
+        End the current phase and start `name` (if not None).
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if self.current is not None:
+                last, start = self.current
+                self.phases[last] = self.phases.get(last, 0.0) + now - start
+                self.current = None
+            if name is not None:
+                self.current = (name, now)
+
+    def scene(self, state):
+        with self.lock:
+            self.scenes[state] += 1
+
+    def add(self, name, amount):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def set_words(self, project, words):
+        with self.lock:
+            self.words[project] = words
+
+    def end(self):
+        self.phase(None)
+        self.ended = time.time()
+
+    def samples(self):
+        """
+        Return a dict of family name to a list of (labels, value).
+        """
+        now = time.perf_counter()
+        with self.lock:
+            phases = dict(self.phases)
+            if self.current is not None:
+                name, start = self.current
+                phases[name] = phases.get(name, 0.0) + now - start
+            found = {
+                "splitoutline_phase_seconds":
+                    [({"phase": name}, phases[name]) for name in sorted(phases)],
+                "splitoutline_scenes":
+                    [({"state": state}, self.scenes[state]) for state in scene_states],
+                "splitoutline_read_bytes": [({}, self.read)],
+                "splitoutline_written_bytes": [({}, self.written)],
+                "splitoutline_outline_lines": [({}, self.outline_lines)],
+                "splitoutline_words":
+                    [({"project": p}, self.words[p]) for p in sorted(self.words)],
+                "splitoutline_running": [({}, 0 if self.ended else 1)],
+            }
+            ended = self.ended
+            if ended is None:
+                ended = time.time()
+            found["splitoutline_run_seconds"] = [({}, ended - self.started)]
+            if self.vocabulary is not None:
+                found["splitoutline_vocabulary_words"] = [({}, self.vocabulary)]
+            if self.ended is not None:
+                found["splitoutline_last_run_timestamp_seconds"] = [({}, self.ended)]
+        rss = peak_rss()
+        if rss is not None:
+            found["splitoutline_peak_rss_bytes"] = [({}, rss)]
+        return found
+
+    def render(self):
+        return render([(self.labels, self.samples())])
+
+    def write(self, path):
+        write(self, path)
+
+    def serve(self, port):
+        return serve(self, port)
+
+
+def render(runs):
+    """
+    Render `runs`, a list of (labels, samples), as one exposition.
+    """
+    out = []
+    for name, text in families:
+        lines = []
+        for common, found in runs:
+            for labels, value in found.get(name, []):
+                labels = dict(common, **labels)
+                if len(labels) > 0:
+                    name_labels = "%s{%s}" % (name, ",".join(
+                        ['%s="%s"' % (k, escape(labels[k])) for k in sorted(labels)]))
+                else:
+                    name_labels = name
+                if isinstance(value, float):
+                    lines.append("%s %.6f\n" % (name_labels, value))
+                else:
+                    lines.append("%s %s\n" % (name_labels, value))
+        if len(lines) == 0:
+            continue
+        out.append("# TYPE %s gauge\n" % (name,))
+        out.append("# HELP %s %s\n" % (name, text))
+        out.extend(lines)
+    out.append("# EOF\n")
+    return "".join(out)
+
+
+def write(source, path):
+    """
+    Replace the file at `path` with what `source.render()` returns.
+    """
+    out, newpath = new_file(path)
+    with out:
+        out.write(source.render())
+    os.rename(newpath, path)
+
+
+def serve(source, port):
+    """
+    Serve what `source.render()` returns on the local `port` from a
+    thread, until the returned server is shut down.
+    """
+    server = MetricsServer(("127.0.0.1", port), MetricsHandler)
+    server.source = source
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    source = None
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.source.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
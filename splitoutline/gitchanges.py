@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Ask git which files changed since the last build, for `--git-changed`.
+
+After a build the commit checked out is recorded, along with the size and
+modification time of every file which differed from it (the scene headers
+the build rewrote among them). The files changed since then are the ones
+git reports as differing from the recorded commit, in the index or the
+working tree, plus the untracked ones, plus the ones which differed at the
+last build, less those whose size and modification time are still the
+ones recorded. A file written just before the recording is only taken as
+unchanged if its content is still the same. Only these files are looked
+at; git finds them from its index without reading the rest of the tree.
+
+Every function returns None when git cannot answer (no git, not a
+repository, no commits or an unknown commit), and the caller falls back
+to looking at every scene.
+"""
+
+import os
+import os.path
+import subprocess
+import time
+
+state_version = 1
+
+# A modification time this close to the recording could still be followed
+# by an edit with the same time.
+settle = 2.0
+
+
+def git(cwd, *args):
+    """
+    Run git in `cwd` and return its output, or None if it failed.
+    """
+    try:
+        result = subprocess.run(("git",) + args, cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode("utf-8", "surrogateescape")
+
+
+def repository(root):
+    """
+    Return the top of the work tree holding `root` and the commit checked
+    out.
+    """
+    top = git(root, "rev-parse", "--show-toplevel")
+    head = git(root, "rev-parse", "--verify", "-q", "HEAD")
+    if top is None or head is None:
+        return None
+    return top.strip(), head.strip()
+
+
+def differing(root, top, commit):
+    """
+    Return the absolute paths of the files which differ from `commit` and
+    the untracked files.
+    """
+    changed = git(root, "diff", "--name-only", "--no-renames", "-z", commit, "--")
+    untracked = git(root, "ls-files", "--others", "--exclude-standard",
+                    "--full-name", "-z")
+    if changed is None or untracked is None:
+        return None
+    paths = set()
+    for name in (changed + untracked).split("\0"):
+        if name != "":
+            paths.add(os.path.normpath(os.path.join(top, name)))
+    return paths
+
+
+def file_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def hash_files(root, paths):
+    """
+    Return the git object names of the files at `paths`.
+    """
+    if len(paths) == 0:
+        return []
+    names = git(root, "hash-object", "--no-filters", "--", *paths)
+    if names is None:
+        return None
+    return names.split()
+
+
+def changed_files(root, state):
+    """
+    Return the absolute paths of the files changed since the build recorded
+    in `state`.
+    """
+    if state is None or state.get("version") != state_version:
+        return None
+    found = repository(root)
+    if found is None:
+        return None
+    top, head = found
+    paths = differing(root, top, state["commit"])
+    if paths is None:
+        return None
+    dirty = {}
+    for name, st in state.get("dirty", {}).items():
+        dirty[os.path.normpath(os.path.join(top, name))] = st
+    paths |= set(dirty)
+    changed = set()
+    unsettled = []
+    for path in paths:
+        if path not in dirty:
+            changed.add(path)
+            continue
+        st = dirty[path]
+        if st is None:
+            if file_stat(path) is not None:
+                changed.add(path)
+        elif file_stat(path) != st[:2]:
+            changed.add(path)
+        elif len(st) > 2:
+            unsettled.append(path)
+    names = hash_files(root, unsettled)
+    if names is None:
+        return None
+    for path, name in zip(unsettled, names):
+        if name != dirty[path][2]:
+            changed.add(path)
+    return changed
+
+
+def build_state(root, keep):
+    """
+    Return the state to record after a build, keeping the files differing
+    from the commit checked out for which `keep` is true.
+    """
+    found = repository(root)
+    if found is None:
+        return None
+    top, head = found
+    paths = differing(root, top, head)
+    if paths is None:
+        return None
+    now = time.time()
+    dirty = {}
+    unsettled = []
+    for path in sorted(paths):
+        if not keep(path):
+            continue
+        st = file_stat(path)
+        dirty[os.path.relpath(path, top)] = st
+        if st is not None and st[1] / 1e9 > now - settle:
+            unsettled.append(path)
+    # The stat of a file written just now can not tell it from a quick
+    # edit, so its content is recorded too.
+    names = hash_files(root, unsettled)
+    if names is None:
+        return None
+    for path, name in zip(unsettled, names):
+        dirty[os.path.relpath(path, top)].append(name)
+    return {"version": state_version, "commit": head, "dirty": dirty}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Positional full-text index over the scenes, used by `splitoutline search`.
+
+    splitoutline index [PROJECT ...]
+
+The index is built from the text `filter_lines` produces, so the words are
+the ones which end up in the chapters. It lives in `search/` in the stats
+directory. `index.json` holds, for every scene, the word position each
+paragraph starts at and the positions of each (lower case) word, as a
+space separated string which is only turned in to numbers for the words
+searched for. The filtered paragraphs are kept one per line in a file
+named after the scene digest, and are only read for snippets. Scenes are
+keyed by the digest of their body, and only the scenes which changed are
+filtered again.
+"""
+
+import codecs
+import json
+import os
+import os.path
+
+from argparse import ArgumentParser
+
+from .output import new_file
+
+index_version = 1
+
+index_parser = ArgumentParser(prog="splitoutline index",
+                  description="Bring the scene search index up to date.")
+index_parser.add_argument("-c", "--config", metavar="FILE", default=None,
+                  help="Set the configuration file to FILE.")
+index_parser.add_argument("projects", nargs='*', metavar="PROJECT",
+                  help="Select alternate projects from the config.")
+
+
+def index_path(so):
+    return os.path.join(so.root, so.statdir, "search")
+
+
+def load_index(path):
+    try:
+        with codecs.open(os.path.join(path, "index.json"), "r", "utf-8") as indexFile:
+            data = json.load(indexFile)
+    except (IOError, ValueError):
+        return None
+    if data.get("version") != index_version:
+        return None
+    return data.get("scenes", {})
+
+
+def save_index(path, scenes):
+    indexpath = os.path.join(path, "index.json")
+    out, newpath = new_file(indexpath)
+    with out:
+        json.dump({"version": index_version, "scenes": scenes}, out,
+                  sort_keys=True)
+    os.rename(newpath, indexpath)
+    keep = set([entry["digest"] + ".para" for entry in scenes.values()])
+    for f in os.listdir(path):
+        if f.endswith(".para") and f not in keep:
+            os.unlink(os.path.join(path, f))
+
+
+def read_paragraphs(path, entry):
+    with codecs.open(os.path.join(path, entry["digest"] + ".para"),
+                     "r", "utf-8") as textFile:
+        return textFile.read().split("\n")
+
+
+def positions(entry, word):
+    found = entry["words"].get(word)
+    if found is None:
+        return None
+    return [int(pos) for pos in found.split()]
+
+
+def scene_entry(so, path, scenePath, digest):
+    paragraphs = []
+    para = []
+    for line in so.filter_lines(scenePath):
+        if line.strip() == "":
+            if len(para) > 0:
+                paragraphs.append(" ".join(para))
+                para = []
+        else:
+            para.append(line.strip())
+    if len(para) > 0:
+        paragraphs.append(" ".join(para))
+    starts = []
+    words = {}
+    pos = 0
+    for text in paragraphs:
+        starts.append(pos)
+        tokens = so.word_re.split(text)
+        for i in range(1, len(tokens), 2):
+            word = tokens[i].lower()
+            if word not in words:
+                words[word] = []
+            words[word].append(str(pos))
+            pos += 1
+    with codecs.open(os.path.join(path, digest + ".para"), "w", "utf-8") as out:
+        out.write("\n".join(paragraphs))
+    for word in words:
+        words[word] = " ".join(words[word])
+    return {"digest": digest, "starts": starts, "words": words}
+
+
+def update_index(so, projects):
+    """
+    Index the scenes of `projects` which changed since the last run and drop
+    the ones no longer in any outline. Returns the number of scenes indexed
+    and the number in the index.
+    """
+    so.setup_project(projects[0])
+    path = index_path(so)
+    scenes = load_index(path)
+    if scenes is None:
+        scenes = {}
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    seen = set()
+    changed = 0
+    for project in projects:
+        so.load_project(project)
+        for ch in so.outline:
+            for scene in ch[1:]:
+                scenePath = so.find_path(scene, so.outline_path)
+                marker = os.path.relpath(scenePath, so.root)
+                if marker in seen:
+                    continue
+                seen.add(marker)
+                if not os.path.isfile(scenePath + so.suffix):
+                    continue
+                body, blockterms = so.scene_digest(scenePath + so.suffix)
+                known = scenes.get(marker)
+                if known is not None and known.get("digest") == body:
+                    continue
+                so.verbose("Indexing %s" % (marker,))
+                scenes[marker] = scene_entry(so, path, scenePath, body)
+                changed += 1
+    for marker in list(scenes.keys()):
+        if marker not in seen:
+            del scenes[marker]
+    save_index(path, scenes)
+    return changed, len(scenes)
+
+
+def config_projects(so, options):
+    ini = so.check_config(options)
+    projects = []
+    if ini.has_option("global", "projects"):
+        projects = ini.get("global", "projects").split()
+    if len(options.projects) > 0:
+        projects = options.projects
+    so.ini = ini
+    so.options = options
+    return projects
+
+
+def main(so, argv):
+    options = index_parser.parse_args(argv)
+    projects = config_projects(so, options)
+    if len(projects) == 0:
+        print("Error: no projects to index.")
+        return 1
+    so.reset()
+    changed, total = update_index(so, projects)
+    print("Indexed %u of %u scenes." % (changed, total))
+    return 0
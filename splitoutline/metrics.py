@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Paragraph metrics for the statistics files.
+
+Every paragraph that survives `filter_lines` is split in to tokens once by
+`build_stats`. The token list alternates between the text found between
+words and the words themselves (exactly what `word_re.split()` returns),
+so the words are at the odd indexes. Each enabled metric walks that same
+list, so an extra metric costs one more loop over tokens which already
+exist instead of another pass over the scene.
+"""
+
+available = {}
+
+default_metrics = "dialogue sentences"
+
+open_quotes = '"“'
+close_quotes = '"”'
+quotes = open_quotes + close_quotes
+
+
+def register(cls):
+    available[cls.name] = cls
+    return cls
+
+
+def load_metrics(names):
+    """
+    Instantiate the metrics named in the space separated `names`.
+
+    Raises KeyError for a name which has not been registered.
+    """
+    return [available[name]() for name in names.split()]
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+class Metric(object):
+    """
+    A statistic gathered from each paragraph of a scene.
+
+    `counters` are the raw totals stored in the stats of a scene. They are
+    summed in to the chapter and project stats by `combine()`. `columns` are
+    (stats key, .dat header, include label) triples which get appended to
+    the normal statistics; `columns_for()` may add more for particular
+    stats. Their values are worked out from the counters by `finish()`,
+    which may be called more than once.
+
+    A row is only added to a `.dat` history when the word count changed or
+    `revised()` is true. `same_day()` is given the row (as a dict keyed by
+    header) which today's stats are about to replace. `restore()` fills in
+    the counters from the last row of a chapter which was not read this
+    run, so it can be added to the project totals.
+    """
+    name = None
+    counters = ()
+    columns = ()
+
+    def paragraph(self, stats, para, tokens):
+        pass
+
+    def combine(self, total, part):
+        for key in self.counters:
+            total[key] = total.get(key, 0) + part.get(key, 0)
+
+    def finish(self, stats):
+        pass
+
+    def columns_for(self, stats):
+        return self.columns
+
+    def revised(self, stats):
+        return False
+
+    def same_day(self, stats, row):
+        pass
+
+    def restore(self, stats, row):
+        for key, header, label in self.columns:
+            if key in self.counters and row.get(header):
+                stats[key] = number(row[header])
+
+
+@register
+class DialogueMetric(Metric):
+    """
+    Words and characters spoken inside quotation marks, the share of the
+    text they make up, and the share of the dialogue each character speaks.
+
+    Quotes are closed at the end of every paragraph, as a quote carried on
+    to the next paragraph is opened again there. Single quotes are taken
+    for apostrophes, so only double quotes count.
+
+    The dialogue of a paragraph is put down to the first capitalized word
+    outside the quotes which stands right next to a speech verb ("said
+    Anna", "Anna asked"). Pronouns are passed over, so dialogue with no
+    named speaker only counts towards the totals.
+    """
+    name = "dialogue"
+    counters = ("__saidwc__", "__saidch__")
+    columns = (("__saidwc__", "Dialogue Words", "Dialogue WC"),
+               ("__saidpct__", "Dialogue Text Share", "Dialogue % of Text"))
+    verbs = frozenset(("said", "says", "say", "asked", "asks", "ask",
+                       "replied", "replies", "answered", "answers",
+                       "whispered", "whispers", "shouted", "shouts",
+                       "called", "calls", "cried", "cries", "muttered",
+                       "mutters", "murmured", "murmurs", "added", "adds",
+                       "yelled", "yells", "exclaimed", "exclaims", "snapped",
+                       "snaps", "told", "tells", "sighed", "sighs",
+                       "continued", "continues", "explained", "explains",
+                       "insisted", "insists", "warned", "warns", "agreed",
+                       "agrees", "admitted", "admits"))
+    pronouns = frozenset(("I", "He", "She", "It", "We", "You", "They",
+                          "One", "Someone", "Everyone", "Nobody"))
+
+    def paragraph(self, stats, para, tokens):
+        inside = False
+        words = chars = 0
+        # Each word outside the quotes, with its token index.
+        narration = []
+        for i in range(len(tokens)):
+            tok = tokens[i]
+            if i % 2 == 1:
+                if inside:
+                    chars += len(tok)
+                    if tok[0].isalnum():
+                        words += 1
+                else:
+                    narration.append(i)
+            elif '"' in tok or "“" in tok or "”" in tok:
+                for c in tok:
+                    if c in quotes:
+                        if c in open_quotes and c in close_quotes:
+                            inside = not inside
+                        else:
+                            inside = c in open_quotes
+                    elif inside:
+                        chars += 1
+            elif inside:
+                chars += len(tok)
+        if words != 0 or chars != 0:
+            stats["__saidwc__"] = stats.get("__saidwc__", 0) + words
+            stats["__saidch__"] = stats.get("__saidch__", 0) + chars
+        if words != 0:
+            speaker = self.speaker(tokens, narration)
+            if speaker is not None:
+                saidby = stats.setdefault("__saidby__", {})
+                saidby[speaker] = saidby.get(speaker, 0) + words
+
+    def speaker(self, tokens, narration):
+        outside = set(narration)
+        for i in narration:
+            if tokens[i].lower() not in self.verbs:
+                continue
+            # Only a neighbour with nothing but space in between.
+            for j, gap in ((i - 2, i - 1), (i + 2, i + 1)):
+                if j not in outside or tokens[gap].strip() != "":
+                    continue
+                word = tokens[j]
+                if word[0].isupper() and word not in self.pronouns:
+                    return word
+        return None
+
+    def combine(self, total, part):
+        Metric.combine(self, total, part)
+        if "__saidby__" in part:
+            saidby = total.setdefault("__saidby__", {})
+            for speaker, words in part["__saidby__"].items():
+                saidby[speaker] = saidby.get(speaker, 0) + words
+
+    def finish(self, stats):
+        stats.setdefault("__saidwc__", 0)
+        if stats.get("__char__", 0) > 0:
+            stats["__saidpct__"] = (100.0 * stats.get("__saidch__", 0)
+                                    / stats["__char__"])
+        else:
+            stats["__saidpct__"] = 0.0
+        for speaker, words in stats.get("__saidby__", {}).items():
+            stats["__saidby:%s__" % (speaker,)] = (100.0 * words
+                                                   / stats["__saidwc__"])
+
+    def restore(self, stats, row):
+        Metric.restore(self, stats, row)
+        saidwc = stats.get("__saidwc__", 0)
+        if row.get("Dialogue Text Share") and row.get("Characters"):
+            stats["__saidch__"] = int(round(number(row["Dialogue Text Share"])
+                                            * number(row["Characters"]) / 100.0))
+        for header, value in row.items():
+            if (header.startswith("Dialogue Share (") and header.endswith(")")
+                    and value):
+                saidby = stats.setdefault("__saidby__", {})
+                saidby[header[16:-1]] = int(round(number(value) * saidwc / 100.0))
+
+    def columns_for(self, stats):
+        # One column for each character speaking, by name.
+        columns = list(self.columns)
+        for speaker in sorted(stats.get("__saidby__", {})):
+            columns.append(("__saidby:%s__" % (speaker,),
+                            "Dialogue Share (%s)" % (speaker,),
+                            "Dialogue %% (%s)" % (speaker,)))
+        return columns
+
+
+@register
+class SentenceMetric(Metric):
+    """
+    Sentence count and the average number of words in a sentence.
+
+    A sentence ends at a '.', '!' or '?' following a word, or at the end of
+    the paragraph.
+    """
+    name = "sentences"
+    counters = ("__sent__",)
+    columns = (("__sent__", "Sentences", "Sentences"),
+               ("__wps__", "Words Per Sentence", "Avg Sentence WC"))
+
+    def paragraph(self, stats, para, tokens):
+        sentences = 0
+        pending = False
+        for i in range(len(tokens)):
+            tok = tokens[i]
+            if i % 2 == 1:
+                if tok[0].isalnum():
+                    pending = True
+            elif pending and ("." in tok or "!" in tok or "?" in tok):
+                sentences += 1
+                pending = False
+        if pending:
+            sentences += 1
+        if sentences != 0:
+            stats["__sent__"] = stats.get("__sent__", 0) + sentences
+
+    def finish(self, stats):
+        stats.setdefault("__sent__", 0)
+        if stats["__sent__"] > 0:
+            stats["__wps__"] = stats.get("__wc__", 0) / float(stats["__sent__"])
+        else:
+            stats["__wps__"] = 0.0
+
+
+@register
+class RevisionMetric(Metric):
+    """
+    Words and paragraphs added, removed and modified since the last run.
+
+    The counters are filled in by `SplitOutline` from the fingerprint kept
+    for each scene whose text changed, so nothing is done per paragraph.
+    Every run on the same day adds to that day's row.
+    """
+    name = "revisions"
+    counters = ("__wadd__", "__wdel__", "__padd__", "__pdel__", "__pmod__",
+                "__wmod__")
+    columns = (("__wadd__", "Words Added", "Words Added"),
+               ("__wdel__", "Words Removed", "Words Removed"),
+               ("__padd__", "Paragraphs Added", "Paras Added"),
+               ("__pdel__", "Paragraphs Removed", "Paras Removed"),
+               ("__pmod__", "Paragraphs Modified", "Paras Modified"),
+               ("__wmod__", "Words Modified", "Words Modified"))
+
+    def finish(self, stats):
+        for key in self.counters:
+            stats.setdefault(key, 0)
+
+    def revised(self, stats):
+        for key in self.counters:
+            if stats.get(key, 0) != 0:
+                return True
+        return False
+
+    def restore(self, stats, row):
+        # The last row only holds the revisions of an earlier run.
+        pass
+
+    def same_day(self, stats, row):
+        # The stats of a scene are written again for each project.
+        if stats.get("__revsameday__"):
+            return
+        stats["__revsameday__"] = True
+        for key, header, label in self.columns:
+            try:
+                stats[key] = stats.get(key, 0) + int(row.get(header) or 0)
+            except ValueError:
+                pass
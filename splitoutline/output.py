@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Where the generated files go.
+
+Everything `SplitOutline` writes (chapters, chapter stubs, scene headers,
+stats and term pages, and the indexes kept in the stats directory) is
+opened through its `output`:
+
+`FileOutput` writes in to the tree, each file through a `.new` file which
+is renamed over the old one when it is closed. The `.new` file has a name
+of its own (see `new_file`), so runs working on the same tree at once do
+not trip over each other.
+
+`MemoryOutput` keeps the files in the `files` dict instead, for tests and
+for use as a library.
+
+`ArchiveOutput` collects the files in memory and writes them to a zip or
+tar archive in one go when it is closed, leaving the tree alone.
+
+Source files (scenes, outlines and the `.dat` histories written before)
+are always read from the tree. Each output counts the bytes of the files
+it is given in `written`. The indexes and caches kept in the stats
+directory (terms.json, lexicon.json, fingerprints.json, generated.json and
+outlines/) only go to an output whose `caches` is true.
+"""
+
+import io
+import os
+import os.path
+import stat
+import tarfile
+import tempfile
+import time
+import zipfile
+
+# New files get the permissions `open` would have given them.
+umask = os.umask(0)
+os.umask(umask)
+
+
+def new_file(path, binary=False):
+    """
+    Open a new file next to `path`, to be renamed over it once written, and
+    return the file and its name. Text is UTF-8 and line ends are not
+    translated. The name is unique, so concurrent runs each get their own.
+    """
+    dirname = os.path.dirname(path)
+    fd, newpath = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                   suffix=".new", dir=dirname or ".")
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = 0o666 & ~umask
+    os.chmod(newpath, mode)
+    if binary:
+        return io.open(fd, "wb"), newpath
+    return io.open(fd, "w", encoding="utf-8", newline=""), newpath
+
+
+class FileOutput(object):
+    """
+    Write straight in to the tree.
+    """
+    # The `.dat` histories may be appended to in place.
+    in_place = True
+    caches = True
+    written = 0
+
+    def open(self, path):
+        dirname = os.path.dirname(path)
+        if dirname != "" and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        return ReplacingFile(path, self)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def remove(self, path):
+        os.unlink(path)
+
+    def close(self):
+        pass
+
+
+class ReplacingFile(object):
+    def __init__(self, path, output=None):
+        self.path = path
+        self.output = output
+        self.file, self.newpath = new_file(path)
+        self.write = self.file.write
+
+    def close(self):
+        self.file.close()
+        if self.output is not None:
+            self.output.written += os.path.getsize(self.newpath)
+        os.rename(self.newpath, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.file.close()
+            os.unlink(self.newpath)
+
+
+class MemoryOutput(object):
+    """
+    Keep the generated files in `files`, a dict of normalized path to
+    text. A file written more than once keeps the last text.
+    """
+    in_place = False
+    caches = True
+
+    def __init__(self):
+        self.files = {}
+        self.written = 0
+
+    def open(self, path):
+        return MemoryFile(self, os.path.normpath(path))
+
+    def exists(self, path):
+        return os.path.normpath(path) in self.files
+
+    def remove(self, path):
+        # Only what this run wrote is held; the tree is left alone.
+        self.files.pop(os.path.normpath(path), None)
+
+    def close(self):
+        pass
+
+
+class MemoryFile(io.StringIO):
+    def __init__(self, output, path):
+        io.StringIO.__init__(self)
+        self.output = output
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            text = self.getvalue()
+            self.output.files[self.path] = text
+            self.output.written += len(text.encode("utf-8"))
+        io.StringIO.close(self)
+
+
+archive_modes = (
+    (".zip", None),
+    (".tar", "w"),
+    (".tar.gz", "w:gz"),
+    (".tgz", "w:gz"),
+    (".tar.bz2", "w:bz2"),
+    (".tar.xz", "w:xz"),
+)
+
+
+def archive_mode(path):
+    """
+    Return (True, None) for a zip file name, (False, tar mode) for a tar
+    file name, and None for anything else.
+    """
+    for suffix, mode in archive_modes:
+        if path.endswith(suffix):
+            return mode is None, mode
+    return None
+
+
+class ArchiveOutput(MemoryOutput):
+    """
+    Write the generated files to the zip or tar archive `path` when closed.
+    Members are named relative to the current directory. The caches are
+    left out, as nothing but the archive is written.
+    """
+    caches = False
+
+    def __init__(self, path):
+        MemoryOutput.__init__(self)
+        self.path = path
+        self.zip, self.mode = archive_mode(path)
+
+    def close(self):
+        names = []
+        for path in self.files.keys():
+            names.append((os.path.relpath(path), path))
+        names.sort()
+        if self.zip:
+            with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+                for name, path in names:
+                    archive.writestr(name, self.files[path].encode("utf-8"))
+        else:
+            now = time.time()
+            with tarfile.open(self.path, self.mode) as archive:
+                for name, path in names:
+                    data = self.files[path].encode("utf-8")
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    info.mtime = now
+                    info.mode = 0o644
+                    archive.addfile(info, io.BytesIO(data))
+        self.files = {}
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Writing velocity report over the `.dat` stats histories.
+
+    splitoutline report [--window DAYS] [PROJECT ...]
+
+Every history in the tree is loaded in to one table of NumPy arrays: one
+`os.scandir` walk finds the files and each is read once. NumPy is only
+needed for this command, and comes with the `report` extra of setup.py.
+"""
+
+import os
+import os.path
+
+from argparse import ArgumentParser
+from datetime import date
+
+from .csvhelpers import read_table
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+report_parser = ArgumentParser(prog="splitoutline report",
+                  description="Report words per day and projected completion"
+                              " from the stats histories.")
+report_parser.add_argument("-c", "--config", metavar="FILE", default=None,
+                  help="Set the configuration file to FILE.")
+report_parser.add_argument("-w", "--window", type=int, default=7,
+                  help="Average the words per day over this many days."
+                       " [default: 7]")
+report_parser.add_argument("--today", default=None, metavar="YYYY-MM-DD",
+                  help="Report as of this date. [default: today]")
+report_parser.add_argument("projects", nargs='*', metavar="PROJECT",
+                  help="Select alternate projects from the config.")
+
+
+class History(object):
+    """
+    Every row of every history, as columns.
+
+    `markers` holds the stats names (`book1`, `book1/chapters/chapter-01`,
+    `scenes/arrival`); the `marker` column indexes in to it. The rows are
+    sorted by marker and then date.
+    """
+
+    def __init__(self, markers, marker, dates, words):
+        self.markers = markers
+        self.codes = dict([(markers[i], i) for i in range(len(markers))])
+        order = numpy.lexsort((dates, marker))
+        self.marker = marker[order]
+        self.date = dates[order]
+        self.words = words[order]
+        self.starts = numpy.searchsorted(self.marker,
+                                         numpy.arange(len(markers) + 1))
+
+    def series(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            return None, None
+        start, end = self.starts[code], self.starts[code + 1]
+        return self.date[start:end], self.words[start:end]
+
+    def daily(self, name, first, last):
+        """
+        Words at the end of each day from `first` to `last`, carrying the
+        last known count over the days without a row.
+        """
+        dates, words = self.series(name)
+        days = numpy.arange(first, last + numpy.timedelta64(1, "D"),
+                            dtype="datetime64[D]")
+        if dates is None or len(dates) == 0:
+            return days, numpy.zeros(len(days), dtype=numpy.int64)
+        idx = numpy.searchsorted(dates, days, side="right") - 1
+        counts = numpy.where(idx >= 0, words[numpy.maximum(idx, 0)], 0)
+        return days, counts
+
+
+def load_history(root, statdirs):
+    """
+    Walk `root` once, reading every `.dat` file inside a directory named in
+    `statdirs`.
+    """
+    markers = []
+    marker = []
+    dates = []
+    words = []
+    pending = [root]
+    while len(pending) > 0:
+        path = pending.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        instats = os.path.basename(path) in statdirs
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in statdirs or not entry.name.startswith("."):
+                    pending.append(entry.path)
+            elif instats and entry.name.endswith(".dat"):
+                name = os.path.relpath(
+                        os.path.join(os.path.dirname(path), entry.name[:-4]),
+                        root)
+                code = len(markers)
+                count = read_history(entry.path, code, marker, dates, words)
+                if count > 0:
+                    markers.append(name)
+    return History(markers, numpy.array(marker, dtype=numpy.int32),
+                   numpy.array(dates, dtype="datetime64[D]"),
+                   numpy.array(words, dtype=numpy.int64))
+
+
+def read_history(path, code, marker, dates, words):
+    count = 0
+    for row in read_table(path):
+        if len(row) < 2 or row[0] == "Date" or row[0] == "":
+            continue
+        marker.append(code)
+        dates.append(row[0])
+        words.append(int(row[1] or 0))
+        count += 1
+    return count
+
+
+def velocity(history, name, today, window):
+    start = today - numpy.timedelta64(window, "D")
+    days, counts = history.daily(name, start, today)
+    perday = numpy.diff(counts)
+    return counts[-1], perday[-1], perday.mean()
+
+
+def main(so, argv):
+    if numpy is None:
+        print("Error: the report needs NumPy.")
+        return 1
+    options = report_parser.parse_args(argv)
+    ini = so.check_config(options)
+    projects = []
+    if ini.has_option("global", "projects"):
+        projects = ini.get("global", "projects").split()
+    if len(options.projects) > 0:
+        projects = options.projects
+    so.ini = ini
+    so.options = options
+    # Like check, the report only reads; not even the outline cache is
+    # written.
+    so._dryrun = True
+    if options.today is None:
+        today = numpy.datetime64(date.today().isoformat(), "D")
+    else:
+        today = numpy.datetime64(options.today, "D")
+    window = max(options.window, 1)
+
+    statdirs = set()
+    for project in projects:
+        so.setup_project(project)
+        statdirs.add(so.statdir)
+    history = load_history(so.root, statdirs)
+
+    for project in projects:
+        so.load_project(project)
+        words, today_words, perday = velocity(history, project, today, window)
+        print("%s: %u words, %+d today, %.0f words/day over %u days"
+              % (project, words, today_words, perday, window))
+        target = so.config.get("target-words")
+        if target is not None:
+            togo = int(target) - words
+            if togo <= 0:
+                print("  target %s reached" % (target,))
+            elif perday > 0:
+                done = today + numpy.timedelta64(int(numpy.ceil(togo / perday)), "D")
+                print("  target %s: %u to go, projected %s" % (target, togo, done))
+            else:
+                print("  target %s: %u to go, no progress to project from"
+                      % (target, togo))
+        for chNum in range(1, len(so.outline) + 1):
+            chapter = os.path.relpath(os.path.join(so.chapter_path,
+                        so.chapter_prefix + so.chapnames[chNum-1]), so.root)
+            days, counts = history.daily(chapter,
+                    today - numpy.timedelta64(window, "D"), today)
+            print("  %-30s %8u %+7d" % (so.chapter_prefix + so.chapnames[chNum-1],
+                                         counts[-1], counts[-1] - counts[0]))
+    return 0
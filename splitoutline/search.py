@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Word and phrase search over the index written by `splitoutline index`.
+
+    splitoutline search WORD ["SOME PHRASE" ...]
+
+Every argument must be found in a scene for it to match; an argument with
+more than one word is a phrase, which has to be found within a paragraph.
+The scenes are listed in outline order with their chapter, followed by a
+snippet for each place a query was found.
+"""
+
+import bisect
+import os.path
+import time
+
+from argparse import ArgumentParser
+
+from .index import (config_projects, index_path, load_index, positions,
+                    read_paragraphs)
+
+search_parser = ArgumentParser(prog="splitoutline search",
+                  description="Find words and phrases in the indexed scenes.")
+search_parser.add_argument("-c", "--config", metavar="FILE", default=None,
+                  help="Set the configuration file to FILE.")
+search_parser.add_argument("-p", "--project", dest="projects", action="append",
+                  default=[], metavar="PROJECT",
+                  help="Only search this project. May be given more than once.")
+search_parser.add_argument("-n", "--limit", type=int, default=20,
+                  help="Show at most this many snippets. [default: 20]")
+search_parser.add_argument("query", nargs='+', metavar="WORDS",
+                  help="A word, or a phrase in quotes.")
+
+
+def parse_query(so, args):
+    phrases = []
+    for arg in args:
+        phrase = [word.lower() for word in so.word_re.findall(arg)]
+        if len(phrase) > 0:
+            phrases.append(phrase)
+    return phrases
+
+
+def find_phrase(entry, phrase):
+    """
+    Return the positions at which `phrase` starts in the indexed scene.
+    """
+    first = positions(entry, phrase[0])
+    if first is None:
+        return []
+    rest = []
+    for word in phrase[1:]:
+        found = positions(entry, word)
+        if found is None:
+            return []
+        rest.append(set(found))
+    starts = entry["starts"]
+    hits = []
+    for pos in first:
+        ok = True
+        for i in range(len(rest)):
+            if pos + i + 1 not in rest[i]:
+                ok = False
+                break
+        if ok and len(rest) > 0:
+            # A phrase does not run on in to the next paragraph.
+            if (bisect.bisect_right(starts, pos) !=
+                    bisect.bisect_right(starts, pos + len(rest))):
+                ok = False
+        if ok:
+            hits.append(pos)
+    return hits
+
+
+def snippet(so, entry, paragraphs, pos, length, context=8):
+    starts = entry["starts"]
+    para = bisect.bisect_right(starts, pos) - 1
+    tokens = so.word_re.split(paragraphs[para])
+    first = 2 * (pos - starts[para]) + 1
+    last = first + 2 * (length - 1)
+    begin = max(first - 2 * context, 0)
+    end = min(last + 2 * context + 1, len(tokens))
+    text = ("".join(tokens[begin:first]) + "[" +
+            "".join(tokens[first:last + 1]) + "]" +
+            "".join(tokens[last + 1:end]))
+    if begin > 0:
+        text = "..." + text
+    if end < len(tokens):
+        text = text + "..."
+    return text
+
+
+def search(so, path, scenes, projects, phrases, limit):
+    """
+    Print the scenes of `projects` which hold every phrase, in outline
+    order. Returns the number of scenes and snippets found.
+    """
+    found = 0
+    shown = 0
+    for project in projects:
+        so.load_project(project)
+        chNum = 0
+        for ch in so.outline:
+            chNum += 1
+            for scene in ch[1:]:
+                marker = so.scene_marker(scene)
+                entry = scenes.get(marker)
+                if entry is None:
+                    continue
+                hits = []
+                for phrase in phrases:
+                    positions = find_phrase(entry, phrase)
+                    if len(positions) == 0:
+                        hits = None
+                        break
+                    for pos in positions:
+                        hits.append((pos, len(phrase)))
+                if hits is None:
+                    continue
+                found += 1
+                print("%s: chapter %u (%s): %s" % (project, chNum, ch[0], scene))
+                if shown >= limit:
+                    continue
+                paragraphs = read_paragraphs(path, entry)
+                for pos, length in sorted(hits):
+                    if shown >= limit:
+                        break
+                    print("    " + snippet(so, entry, paragraphs, pos, length))
+                    shown += 1
+    return found, shown
+
+
+def main(so, argv):
+    options = search_parser.parse_args(argv)
+    start = time.perf_counter()
+    projects = config_projects(so, options)
+    if len(projects) == 0:
+        print("Error: no projects to search.")
+        return 1
+    so.setup_project(projects[0])
+    path = index_path(so)
+    scenes = load_index(path)
+    if scenes is None:
+        print("Error: no search index; run `splitoutline index` first.")
+        return 1
+    phrases = parse_query(so, options.query)
+    if len(phrases) == 0:
+        print("Error: nothing to search for.")
+        return 1
+    found, shown = search(so, path, scenes, projects, phrases, options.limit)
+    print("%u scenes matched (%.3fs)." % (found, time.perf_counter() - start))
+    return 0
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+#  Copyright 2014 Steven Black
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Fixed size records of the words seen, for the `sketch` vocabulary mode.
+
+A `BloomFilter` remembers the words seen in lower case. It is a
+partitioned Bloom filter: `depth` rows of `width` bits, with each word
+setting one bit in every row. A word is taken as seen when its bit is set
+in every row. A word which was added is always found; one which was not is
+wrongly found with a probability of about
+
+    (1 - exp(-n / width)) ** depth
+
+after n distinct words have been added, which `error_rate()` estimates
+from the bits actually set. Words can not be taken out again.
+
+A `TopK` keeps the capitalized forms used most, with the space-saving
+algorithm: at most `capacity` are counted, and a new one takes the place
+of one of the least counted, inheriting its count as a possible error. A
+form counted from its first use has no error.
+
+The memory each uses is fixed by its size, whatever the number of words.
+"""
+
+import base64
+import hashlib
+import math
+
+default_depth = 4
+
+
+class BloomFilter(object):
+
+    def __init__(self, width, depth=default_depth, bits=None):
+        self.width = width
+        self.depth = depth
+        if bits is None:
+            bits = bytearray((width * depth + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def sized(cls, budget, depth=default_depth):
+        """
+        A filter using `budget` bytes.
+        """
+        width = max(8, int(budget * 8) // depth)
+        return cls(width, depth)
+
+    def positions(self, word):
+        h = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        h1 = int.from_bytes(h[:4], "little")
+        h2 = int.from_bytes(h[4:], "little") | 1
+        return [row * self.width + (h1 + row * h2) % self.width
+                for row in range(self.depth)]
+
+    def add(self, word):
+        for pos in self.positions(word):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, word):
+        for pos in self.positions(word):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def update(self, other):
+        merged = (int.from_bytes(self.bits, "little") |
+                  int.from_bytes(other.bits, "little"))
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "little"))
+
+    def error_rate(self):
+        """
+        The chance a word which was never added is found.
+        """
+        total = sum([bin(b).count("1") for b in self.bits])
+        return math.pow(float(total) / (self.width * self.depth), self.depth)
+
+    def cardinality(self):
+        """
+        An estimate of the number of different words added, or None once
+        every bit is set.
+        """
+        total = sum([bin(b).count("1") for b in self.bits])
+        full = float(total) / (self.width * self.depth)
+        if full >= 1.0:
+            return None
+        return -self.width * math.log(1.0 - full)
+
+    def to_json(self):
+        return {"width": self.width, "depth": self.depth,
+                "bits": base64.b64encode(bytes(self.bits)).decode("ascii")}
+
+    @classmethod
+    def from_json(cls, data):
+        bits = bytearray(base64.b64decode(data["bits"]))
+        return cls(data["width"], data["depth"], bits)
+
+
+class TopK(object):
+    """
+    Count at most `capacity` keys, each with a value which is kept while
+    every use of the key gives the same one (and is None after that).
+
+    `entries` maps each key to [count, error, value]; the true count is
+    between count - error and count. `buckets` holds the keys by count, in
+    the order they got there, so the key dropped for a new one is always
+    the one which has been least counted for longest.
+    """
+    # The bytes taken to be used by each key, to size it from a budget.
+    entry_size = 64
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        self.buckets = {}
+        self.least = 0
+
+    @classmethod
+    def sized(cls, budget):
+        """
+        A top-K using about `budget` bytes.
+        """
+        return cls(max(1, int(budget) // cls.entry_size))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def place(self, key, count):
+        bucket = self.buckets.get(count)
+        if bucket is None:
+            bucket = {}
+            self.buckets[count] = bucket
+        bucket[key] = None
+
+    def unplace(self, key, count):
+        bucket = self.buckets[count]
+        del bucket[key]
+        if len(bucket) == 0:
+            del self.buckets[count]
+            if count == self.least:
+                # Counts only go up one at a time, so the next is close.
+                while self.least not in self.buckets and len(self.buckets) > 0:
+                    self.least += 1
+
+    def add(self, key, value=None):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.unplace(key, entry[0])
+            entry[0] += 1
+            self.place(key, entry[0])
+            if entry[2] != value:
+                entry[2] = None
+            return
+        if len(self.entries) < self.capacity:
+            entry = [1, 0, value]
+        else:
+            least = self.least
+            dropped = next(iter(self.buckets[least]))
+            del self.entries[dropped]
+            self.unplace(dropped, least)
+            entry = [least + 1, least, value]
+        self.entries[key] = entry
+        self.place(key, entry[0])
+        if self.least == 0 or entry[0] < self.least:
+            self.least = entry[0]
+
+    def exact(self, key):
+        """
+        The value of `key` if it has been counted from its first use and
+        always had the same value, or else None.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[1] != 0:
+            return None
+        return entry[2]
+
+    def to_json(self):
+        return {"capacity": self.capacity,
+                "entries": [[key] + self.entries[key]
+                            for count in sorted(self.buckets)
+                            for key in self.buckets[count]]}
+
+    @classmethod
+    def from_json(cls, data):
+        topk = cls(data["capacity"])
+        for key, count, error, value in data["entries"]:
+            topk.entries[key] = [count, error, value]
+            topk.place(key, count)
+        if len(topk.buckets) > 0:
+            topk.least = min(topk.buckets)
+        return topk
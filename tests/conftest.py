@@ -0,0 +1,161 @@
+"""
+Small projects, written out by hand, for the tests to build.
+
+`make_project(name)` writes one under the test's temporary directory and
+returns a `Project`. The configuration file uses absolute paths, so the
+project can be built from any directory.
+"""
+
+import io
+import os
+import os.path
+
+import pytest
+
+from splitoutline import SplitOutline
+
+outline = """\
+Outline
+=======
+
+.. outline:start
+
+- The Arrival
+
+  Where it starts.
+
+  - `Arrival </scenes/arrival>`
+
+    Anna gets off the train.
+
+  - `Meeting </scenes/meeting>`
+
+    Anna meets Bob at the :term:`Gray Tower`.
+
+- The Journey
+
+  - `Journey </scenes/journey>`
+
+    They leave the city.
+
+.. outline:end
+"""
+
+scenes = {
+    "arrival": """\
+Arrival
+=======
+
+The train came in late. Anna stepped down on to the platform and looked
+for the clock.
+
+"Nobody is here," said Anna. "Nobody at all."
+
+The porter shrugged and went back to his bench.
+""",
+    "meeting": """\
+Meeting
+=======
+
+Bob was waiting by the :term:`Gray Tower`, as he had said he would be.
+
+"You came," Bob said. "I wasn't sure you would."
+
+"Neither was I," said Anna.
+""",
+    "journey": """\
+Journey
+=======
+
+They left the city before dawn and walked until the road ran out.
+
+"How far is it?" asked Anna.
+
+"Far enough," Bob said.
+""",
+}
+
+
+class Project(object):
+
+    def __init__(self, root, options=""):
+        self.root = str(root)
+        self.ini = os.path.join(self.root, "splitoutline.ini")
+        self.write("splitoutline.ini",
+                   "[global]\nroot={0}\nsuffix=.txt\nprojects=book1\n{1}\n"
+                   "[book1]\noutline={0}/book1/design/outline.txt\n"
+                   "chapter-dir={0}/book1/chapters\n"
+                   "chapter-stub-dir={0}/book1/scenes\n".format(self.root, options))
+        os.makedirs(self.path("book1/chapters"))
+        os.makedirs(self.path("book1/scenes"))
+        self.write("book1/design/outline.txt", outline)
+        for name in scenes:
+            self.write("scenes/%s.txt" % (name,), scenes[name])
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def read(self, name):
+        with io.open(self.path(name), "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def write(self, name, text):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+    def edit(self, name, old, new):
+        text = self.read(name)
+        assert old in text
+        self.write(name, text.replace(old, new, 1))
+
+    def build(self, *args, output=None):
+        so = SplitOutline(output)
+        status = so.main(["-c", self.ini] + list(args))
+        assert status in (None, 0)
+        return so
+
+    def files(self):
+        """
+        Every file under the project, as a dict of path (relative to the
+        project) to bytes, leaving out the git repository.
+        """
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if ".git" in dirnames:
+                dirnames.remove(".git")
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    found[os.path.relpath(path, self.root)] = f.read()
+        return found
+
+    def tree(self):
+        """
+        The files a build makes, for comparing with another project's: the
+        configuration and the outline cache are left out, and the project's
+        path is taken out of the text.
+        """
+        root = self.root.encode("utf-8")
+        label = root.lstrip(b"/").replace(b"/", b"-").replace(b"_", b"-")
+        found = {}
+        for name, data in self.files().items():
+            if name == "splitoutline.ini" or name.startswith(
+                    os.path.join(".stats", "outlines")):
+                continue
+            found[name] = data.replace(root, b"ROOT").replace(label, b"ROOT")
+        return found
+
+
+@pytest.fixture
+def make_project(tmp_path):
+    def make(name="project", options=""):
+        return Project(tmp_path / name, options)
+    return make
+
+
+@pytest.fixture
+def project(make_project):
+    return make_project()
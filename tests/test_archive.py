@@ -0,0 +1,34 @@
+"""
+`--archive` puts the generated files in an archive and leaves the tree and
+its caches alone.
+"""
+
+import os
+import zipfile
+
+
+def test_archive(project, monkeypatch):
+    project.build()
+    project.edit("scenes/arrival.txt", "came in late", "came in very late")
+    # A history under the name the scene had before.
+    os.rename(project.path("scenes/journey.txt"),
+              project.path("scenes/journey-01.txt"))
+    os.rename(project.path("scenes/.stats/journey.dat"),
+              project.path("scenes/.stats/journey-1.dat"))
+    project.edit("book1/design/outline.txt", "/scenes/journey>",
+                 "/scenes/journey-01>")
+    before = project.files()
+    monkeypatch.chdir(project.root)
+    project.build("--archive", "snapshot.zip")
+    after = project.files()
+    del after["snapshot.zip"]
+    assert after == before
+    with zipfile.ZipFile(project.path("snapshot.zip")) as archive:
+        names = archive.namelist()
+        arrival = archive.read("scenes/.stats/arrival.dat").decode("utf-8")
+    assert "book1/chapters/chapter-1.txt" in names
+    assert "scenes/.stats/journey-01.dat" in names
+    assert "36" in arrival.split("\r\n")[1].split("\t")
+    for name in names:
+        assert not name.endswith(".json"), name
+        assert not name.startswith(".stats/outlines"), name
@@ -0,0 +1,71 @@
+"""
+`splitoutline batch` builds every project it finds, prints a summary of
+them and fails if any of them failed.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from splitoutline import SplitOutline
+
+
+@pytest.fixture
+def projects(make_project):
+    # The last one can not be built.
+    return [make_project("a"), make_project("b"),
+            make_project("c", "metrics=nonesuch")]
+
+
+def summary(out):
+    lines = out.splitlines()
+    start = [n for n, line in enumerate(lines) if line.startswith("project ")][0]
+    # The status may be two words, such as "exit 1".
+    rows = dict([(line.split()[0], line.split(None, 1)[1].rsplit(None, 3))
+                 for line in lines[start + 1:-1]])
+    return lines[:start], rows, lines[-1]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch_summary(projects, tmp_path, capsys, jobs):
+    alone = projects[0].build()
+    words = alone.stats["book1"]["__wc__"]
+    shutil.rmtree(projects[0].path("book1/chapters"))
+    os.makedirs(projects[0].path("book1/chapters"))
+    capsys.readouterr()
+    path = str(tmp_path / "batch.prom")
+    status = SplitOutline().main(["batch", "-j", jobs, "--openmetrics", path,
+                                  str(tmp_path)])
+    assert status == 1
+    printed, rows, last = summary(capsys.readouterr().out)
+    inis = [project.ini for project in projects]
+    assert sorted(rows) == sorted(inis)
+    for ini in inis[:2]:
+        state, seconds, scenes, count = rows[ini]
+        assert (state, scenes, count) == ("ok", "3", str(words))
+    assert rows[inis[2]][0] == "exit 1"
+    assert "%s: Error: unknown metric 'nonesuch'." % (inis[2],) in printed
+    assert last.startswith("3 projects, 1 failed, ")
+    assert last.endswith(" on %s %s." % (jobs, "worker" if jobs == "1" else "workers"))
+    for project in projects[:2]:
+        assert os.path.exists(project.path("book1/chapters/chapter-1.txt"))
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    assert 'splitoutline_batch_projects{state="done"} 2\n' in text
+    assert 'splitoutline_batch_projects{state="failed"} 1\n' in text
+    assert 'splitoutline_words{config="%s",project="book1"} %u\n' % (
+        inis[0], words) in text
+
+
+def test_batch_runs_a_command(projects, capsys):
+    capsys.readouterr()
+    status = SplitOutline().main(["batch", "-j", "1", projects[0].root,
+                                  projects[1].ini, "--", "check"])
+    assert status == 0
+    printed, rows, last = summary(capsys.readouterr().out)
+    assert printed == []
+    assert [row[0] for row in rows.values()] == ["ok", "ok"]
+    assert last.startswith("2 projects, 0 failed, ")
+    # Checking writes nothing.
+    assert not os.path.exists(projects[0].path("book1/chapters/chapter-1.txt"))
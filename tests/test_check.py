@@ -0,0 +1,43 @@
+"""
+`splitoutline check` reports the problems in the outlines and the scene
+tree, and writes nothing, not even the outline cache.
+"""
+
+import os
+
+from splitoutline import SplitOutline
+
+
+def check(project, capsys):
+    capsys.readouterr()
+    before = project.files()
+    status = SplitOutline().main(["check", "-c", project.ini])
+    assert project.files() == before
+    return status, capsys.readouterr().out.splitlines()
+
+
+def test_check_clean_project(project, capsys):
+    status, lines = check(project, capsys)
+    assert status == 0
+    assert lines == []
+    project.build()
+    assert check(project, capsys) == (0, [])
+
+
+def test_check_finds_problems(project, capsys):
+    project.edit("book1/design/outline.txt", "- The Journey\n",
+                 "- The Empty\n\n- The Journey\n\n"
+                 "  - `Arrival Again </scenes/arrival>`\n\n")
+    project.write("scenes/stray.txt", "Stray\n=====\n\nNobody wants it.\n")
+    journey = project.path("scenes/journey.txt")
+    os.unlink(journey)
+    status, lines = check(project, capsys)
+    assert status == 1
+    outline = project.path("book1/design/outline.txt")
+    assert lines == [
+        "%s: chapter has no scenes: - The Empty" % (outline,),
+        "book1: /scenes/arrival is in chapter 1 and chapter 2",
+        "book1: missing /scenes/journey (%s)" % (journey,),
+        "%s: not in any outline" % (project.path("scenes/stray.txt"),),
+        "4 problems found.",
+    ]
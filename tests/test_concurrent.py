@@ -0,0 +1,48 @@
+"""
+`--chapter` runs for different chapters, started at once as `make -j` does,
+leave the same tree as one full build.
+"""
+
+import os
+import subprocess
+import sys
+
+import splitoutline
+
+script = os.path.join(os.path.dirname(os.path.dirname(splitoutline.__file__)),
+                      "scripts", "splitoutline")
+
+
+def edit(project):
+    project.edit("scenes/arrival.txt", "looked\nfor the clock.",
+                 "looked\nfor the :term:`Gray Tower` clock.")
+    project.edit("scenes/journey.txt", "the road ran out.",
+                 "the road ran out at the :term:`Salt Marsh`.")
+
+
+def test_chapters_at_once(make_project):
+    full = make_project("full")
+    full.build()
+    edit(full)
+    full.build()
+    project = make_project()
+    project.build()
+    edit(project)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(splitoutline.__file__))] +
+        sys.path)
+    runs = []
+    for n in ("1", "2", "1", "2"):
+        runs.append(subprocess.Popen(
+            [sys.executable, script, "-c", project.ini, "--chapter", n],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+    for run in runs:
+        out, err = run.communicate()
+        assert run.returncode == 0, err.decode("utf-8")
+    got = project.tree()
+    want = full.tree()
+    assert not [name for name in got if name.endswith(".new")]
+    assert sorted(got) == sorted(want)
+    for name in want:
+        assert got[name] == want[name], name
@@ -0,0 +1,77 @@
+"""
+The `.dat` histories: reading the last rows from the end of the file and
+replacing them in place.
+"""
+
+import datetime
+
+import splitoutline
+from splitoutline.csvhelpers import read_table, read_tail, rewrite_tail, write_table
+
+
+def test_read_tail(tmp_path):
+    path = str(tmp_path / "a.dat")
+    rows = [["Date", "Words"]] + [["2026-01-%02u" % (n,), str(n * 100)]
+                                  for n in range(1, 31)]
+    write_table(path, rows)
+    header, tail = read_tail(path, 2, blocksize=16)
+    assert header == ["Date", "Words"]
+    assert [row for offset, row in tail] == rows[-2:]
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[tail[0][0]:].startswith(b"2026-01-29\t2900\r\n")
+    assert data[tail[1][0]:] == b"2026-01-30\t3000\r\n"
+
+
+def test_read_tail_short(tmp_path):
+    path = str(tmp_path / "a.dat")
+    write_table(path, [["Date", "Words"]])
+    assert read_tail(path, 2) == (["Date", "Words"], [])
+    write_table(path, [["Date", "Words"], ["2026-01-01", "5"]])
+    header, tail = read_tail(path, 2)
+    assert [row for offset, row in tail] == [["2026-01-01", "5"]]
+
+
+def test_rewrite_tail(tmp_path):
+    path = str(tmp_path / "a.dat")
+    write_table(path, [["Date", "Words"], ["2026-01-01", "5"],
+                       ["2026-01-02", "7"]])
+    header, tail = read_tail(path, 1)
+    rewrite_tail(path, tail[-1][0], [["2026-01-02", "9"]])
+    assert read_table(path) == [["Date", "Words"], ["2026-01-01", "5"],
+                                ["2026-01-02", "9"]]
+    rewrite_tail(path, None, [["2026-01-03", "11"]])
+    assert read_table(path)[-2:] == [["2026-01-02", "9"], ["2026-01-03", "11"]]
+    # A history whose last row has no line end still gets one.
+    with open(path, "ab") as f:
+        f.write(b"2026-01-04\t12")
+    rewrite_tail(path, None, [["2026-01-05", "13"]])
+    assert read_table(path)[-2:] == [["2026-01-04", "12"], ["2026-01-05", "13"]]
+
+
+class Tomorrow(datetime.date):
+    @classmethod
+    def today(cls):
+        return datetime.date.today() + datetime.timedelta(days=1)
+
+
+def test_histories_updated_in_place(project, monkeypatch):
+    project.build()
+
+    def whole(path):
+        raise AssertionError("read all of %s" % (path,))
+    monkeypatch.setattr(splitoutline, "read_table", whole)
+    # The same day: today's row is replaced.
+    project.edit("scenes/arrival.txt", "came in late", "came in very late")
+    project.build()
+    rows = read_table(project.path("scenes/.stats/arrival.dat"))
+    assert len(rows) == 2
+    assert rows[1][1] == "36"
+    # The next day: a row is added.
+    monkeypatch.setattr(splitoutline, "date", Tomorrow)
+    project.edit("scenes/arrival.txt", "very late", "very, very late")
+    project.build()
+    rows = read_table(project.path("scenes/.stats/arrival.dat"))
+    assert len(rows) == 3
+    assert [row[1] for row in rows[1:]] == ["36", "37"]
+    assert rows[2][7] == "1"
@@ -0,0 +1,26 @@
+"""
+`--export` streams the filtered book to one file and writes nothing else.
+"""
+
+
+def test_export_matches_chapters(project):
+    project.build()
+    chapters = "".join(project.read("book1/chapters/chapter-%u.txt" % (n,))
+                       for n in (1, 2))
+    before = project.files()
+    project.build("--export", project.path("book.txt"))
+    after = project.files()
+    exported = after.pop("book.txt").decode("utf-8")
+    assert after == before
+    assert exported.split() == chapters.split()
+    assert ":term:" not in exported
+    assert exported.index("Arrival\n") < exported.index("Journey\n")
+
+
+def test_export_to_stdout(project, capsys):
+    before = project.files()
+    project.build("--export", "-")
+    out = capsys.readouterr().out
+    assert project.files() == before
+    assert out.startswith("***********\nThe Arrival\n***********\n")
+    assert '"Far enough," Bob said.' in out
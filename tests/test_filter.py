@@ -0,0 +1,126 @@
+"""
+The streamed scene filter gives the same lines as the filter that read the
+whole scene in to a list.
+"""
+
+import io
+
+import pytest
+
+from conftest import scenes
+
+
+def listed(so, inPath, lines):
+    """
+    The list-based filter, less its stats. Before the start of the scene is
+    taken as blank, and a paragraph break is added after any output (as
+    `para_break` does).
+    """
+    para = None
+    lastcol = 0
+    eatTilLast = False
+    eatTilBlank = False
+    addContinuance = False
+    skip = 0
+    out = []
+    for i in range(len(lines)):
+        line = lines[i]
+        if skip > 0:
+            skip -= 1
+            continue
+        col = 0
+        line = line.replace("\t", "        ")
+        while len(line) > 0 and line[-1] in "\r\n":
+            line = line[:-1]
+        while len(line) > col and line[col].isspace():
+            col += 1
+        line = line.strip()
+        if so.section_re.match(line) is not None:
+            before2 = ""
+            if i >= 2:
+                before2 = lines[i-2]
+            if (0 < i < len(lines)-3 and lines[i-1].strip() == ""
+                    and len(line) >= len(lines[i+1].strip())
+                    and lines[i+2].strip() == line
+                    and lines[i+3].strip() == ""):
+                skip = 3
+                continue
+            elif (0 < i < len(lines)-1 and before2.strip() == ""
+                    and len(line) >= len(lines[i-1].strip())
+                    and lines[i+1].strip() == ""):
+                para = None
+                skip = 1
+                continue
+        isBlank = len(line) == 0
+        if eatTilLast and col > lastcol:
+            continue
+        elif eatTilLast and isBlank:
+            continue
+        else:
+            eatTilLast = False
+            eatTilBlank = False
+        if eatTilBlank and not isBlank and col > lastcol:
+            continue
+        else:
+            eatTilBlank = False
+        if para is None:
+            if isBlank:
+                if len(out) > 0 and out[-1] != "":
+                    out.append("")
+            elif line.startswith(".. ") and "::" in line:
+                eatTilLast = True
+                continue
+            elif line.startswith(".. ") or line == "..":
+                eatTilBlank = True
+                continue
+            else:
+                if line.startswith("| "):
+                    addContinuance = True
+                para = [line]
+        elif isBlank:
+            so.indent_and_extend(so.filter_paragraph(inPath, para), lastcol, out)
+            if len(out) > 0 and out[-1] != "":
+                out.append("")
+            para = None
+        elif addContinuance and col > lastcol:
+            col = lastcol
+            para[-1] = para[-1] + " " + line
+        elif col == lastcol:
+            if line.startswith("| "):
+                addContinuance = True
+            para.append(line)
+        else:
+            if line.startswith("| "):
+                addContinuance = True
+            so.indent_and_extend(so.filter_paragraph(inPath, para), lastcol, out)
+            para = None
+        lastcol = col
+    if para is not None:
+        so.indent_and_extend(so.filter_paragraph(inPath, para), lastcol, out)
+        if len(out) > 0 and out[-1] != "":
+            out.append("")
+    i = 0
+    while i < len(out) and out[i].strip() == "":
+        i += 1
+    return out[i:]
+
+
+odd = {
+    "short": "Title\n=====\n\nOne line.\n",
+    "title-only": "Title\n=====\n",
+    "sections": "Title\n=====\n\nFirst.\n\n-----\nPart\n-----\n\nSecond.\n\n"
+                "Part Two\n--------\n\n.. note::\n\n   Hidden.\n\nThird.\n",
+    "not-a-title": "A line\n==\n\nMore.\n",
+}
+
+
+@pytest.mark.parametrize("name", sorted(scenes) + sorted(odd))
+def test_streamed_filter_matches_list(project, name):
+    so = project.build("--stats-only")
+    text = scenes.get(name) or odd[name]
+    inPath = project.path("scenes/" + name)
+    streamed = list(so.filter_scene(inPath, io.StringIO(text), counting=False))
+    assert streamed == listed(so, inPath, text.splitlines(True))
+    if name in scenes:
+        # The title on the first line is not part of the chapter.
+        assert streamed[0].startswith(text.splitlines()[3][:10])
@@ -0,0 +1,82 @@
+"""
+A build with `--git-changed` after each of a series of edits must leave the
+same files as a full build, the project totals included.
+"""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from splitoutline import SplitOutline
+
+
+def git(project, *args):
+    subprocess.check_call(["git", "-c", "user.name=test",
+                           "-c", "user.email=test@localhost"] + list(args),
+                          cwd=project.root, stdout=subprocess.DEVNULL)
+
+
+def commit(project, message):
+    git(project, "add", "-A")
+    git(project, "commit", "-q", "-m", message)
+
+
+def chosen(monkeypatch):
+    selections = []
+    select = SplitOutline.select_chapters
+
+    def selecting(self):
+        selected = select(self)
+        selections.append(selected)
+        return selected
+    monkeypatch.setattr(SplitOutline, "select_chapters", selecting)
+    return selections
+
+
+def test_git_changed_matches_full_build(make_project, monkeypatch):
+    if shutil.which("git") is None:
+        pytest.skip("git can not be run")
+    full = make_project("full")
+    changed = make_project("changed")
+    for project in (full, changed):
+        project.write("notes.txt", "")
+    git(changed, "init", "-q")
+    commit(changed, "written")
+    edits = [
+        ("first build", None, None),
+        ("edit a scene", lambda project: project.edit(
+            "scenes/journey.txt", "ran out.\n", "ran out.\n\nA new paragraph.\n"),
+            [2]),
+        ("commit", lambda project: project is changed and commit(project, "edited"),
+            []),
+        ("revert the scene", lambda project: project.edit(
+            "scenes/journey.txt", "ran out.\n\nA new paragraph.\n", "ran out.\n"),
+            [2]),
+        ("unused file", lambda project: project.write("notes.txt", "notes\n"),
+            []),
+        ("remove a chapter", lambda project: os.unlink(
+            project.path("book1/chapters/chapter-1.txt")), [1]),
+        ("edit the outline", lambda project: project.edit(
+            "book1/design/outline.txt", "Where it starts.", "Where it begins."),
+            None),
+    ]
+    selections = chosen(monkeypatch)
+    for name, edit, expected in edits:
+        if edit is not None:
+            edit(full)
+            edit(changed)
+        full.build()
+        changed.build("--git-changed")
+        # Only what git reports changed is built again.
+        selected = selections[-1]
+        if selected is not None:
+            selected = sorted(selected)
+        assert selected == expected, name
+        got = changed.tree()
+        del got[os.path.join(".stats", "git-build.json")]
+        want = full.tree()
+        assert sorted(got) == sorted(want), name
+        for path in want:
+            assert got[path] == want[path], (name, path)
@@ -0,0 +1,49 @@
+"""
+Scene headers carry a digest of the block made from the outline, so an
+unchanged scene is left alone after reading only its top.
+"""
+
+import re
+
+
+def rewritten(capsys):
+    return sorted(re.findall(r"Changes to '.*/(scenes/\w+)'",
+                             capsys.readouterr().err))
+
+
+def test_digest_in_header(project):
+    project.build()
+    text = project.read("scenes/meeting.txt")
+    assert re.search(r"\.\. container:: from-outline\n\n"
+                     r"   \.\. outline-digest: [0-9a-f]{16}\n", text)
+
+
+def test_unchanged_scenes_are_skipped(project, capsys):
+    project.build()
+    assert rewritten(capsys) == ["scenes/arrival", "scenes/journey",
+                                 "scenes/meeting"]
+    before = project.files()
+    project.build()
+    assert rewritten(capsys) == []
+    assert project.files() == before
+    # The scene's own text is not part of the digest.
+    project.edit("scenes/arrival.txt", "came in late", "came in early")
+    project.build()
+    assert rewritten(capsys) == []
+    # Only the scene whose outline notes changed gets a new header.
+    project.edit("book1/design/outline.txt", "They leave the city.",
+                 "They leave the city at dawn.")
+    project.build()
+    assert rewritten(capsys) == ["scenes/journey"]
+    assert "They leave the city at dawn." in project.read("scenes/journey.txt")
+
+
+def test_stale_digest_is_rewritten(project, capsys):
+    project.build()
+    capsys.readouterr()
+    text = project.read("scenes/meeting.txt")
+    digest = re.search(r"outline-digest: (\w+)", text).group(1)
+    project.write("scenes/meeting.txt", text.replace(digest, "0" * 16))
+    project.build()
+    assert rewritten(capsys) == ["scenes/meeting"]
+    assert "outline-digest: %s\n" % (digest,) in project.read("scenes/meeting.txt")
@@ -0,0 +1,41 @@
+"""
+Chapter files named from labels: renamed chapters are cleaned up, and files
+this tool did not write are left alone.
+"""
+
+import json
+
+
+def test_label_names(make_project):
+    project = make_project(options="chapter-names=label")
+    project.edit("book1/design/outline.txt", "  Where it starts.\n",
+                 "  Where it starts.\n\n  :Label: start\n")
+    project.write("book1/chapters/chapter-notes.txt", "Mine.\n")
+    project.write("book1/scenes/chapter-notes.txt", "Mine too.\n")
+    project.build()
+    files = project.files()
+    assert "book1/chapters/chapter-start.txt" in files
+    assert "book1/chapters/chapter-the-journey.txt" in files
+    assert "book1/scenes/chapter-the-journey.txt" in files
+    generated = json.loads(project.read("book1/chapters/.stats/generated.json"))
+    assert generated == {"chapter-*.txt": ["start", "the-journey"]}
+
+    project.edit("book1/design/outline.txt", "- The Journey", "- The Road")
+    project.build()
+    files = project.files()
+    assert "book1/chapters/chapter-the-road.txt" in files
+    assert "book1/chapters/chapter-the-journey.txt" not in files
+    assert "book1/scenes/chapter-the-journey.txt" not in files
+    assert files["book1/chapters/chapter-notes.txt"] == b"Mine.\n"
+    assert files["book1/scenes/chapter-notes.txt"] == b"Mine too.\n"
+
+
+def test_numbered_chapters_go_when_labelled(project):
+    project.build()
+    assert "book1/chapters/chapter-1.txt" in project.files()
+    project.write("splitoutline.ini", project.read("splitoutline.ini").replace(
+        "projects=book1\n", "projects=book1\nchapter-names=label\n"))
+    project.build()
+    files = project.files()
+    assert "book1/chapters/chapter-1.txt" not in files
+    assert "book1/chapters/chapter-the-arrival.txt" in files
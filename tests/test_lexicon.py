@@ -0,0 +1,64 @@
+"""
+The casing of each scene is kept in lexicon.json, so names are found
+without tokenising the scenes which did not change.
+"""
+
+import json
+
+from splitoutline import SplitOutline
+
+
+def lexicon(project):
+    return json.loads(project.read(".stats/lexicon.json"))
+
+
+def names(project):
+    cases = lexicon(project)["cases"]
+    return sorted(cases[lower]["canonical"] for lower in cases
+                  if cases[lower]["name"])
+
+
+def tokenised(monkeypatch):
+    markers = []
+    store_cases = SplitOutline.store_cases
+
+    def record(self, marker, digest, cases):
+        markers.append(marker)
+        return store_cases(self, marker, digest, cases)
+    monkeypatch.setattr(SplitOutline, "store_cases", record)
+    return markers
+
+
+def test_names_from_lexicon(project, monkeypatch):
+    project.build()
+    assert "Anna" in names(project)
+    assert "Bob" in names(project)
+    scenes = lexicon(project)["scenes"]
+    assert scenes["scenes/arrival"]["cases"]["anna"] == "Anna"
+    assert scenes["scenes/arrival"]["cases"]["train"] == "train"
+
+    markers = tokenised(monkeypatch)
+    project.build()
+    assert markers == []
+
+    # One lower case use anywhere and it is not a name.
+    project.edit("scenes/journey.txt", "before dawn", "before the bob of dawn")
+    project.build()
+    assert markers == ["scenes/journey"]
+    assert "Bob" not in names(project)
+    assert lexicon(project)["cases"]["bob"]["canonical"] == "bob"
+    assert lexicon(project)["scenes"]["scenes/meeting"]["cases"]["bob"] == "Bob"
+
+    # Taking it out again puts the name back.
+    project.edit("scenes/journey.txt", "before the bob of dawn", "before dawn")
+    project.build()
+    assert markers == ["scenes/journey", "scenes/journey"]
+    assert "Bob" in names(project)
+
+
+def test_abbreviations(make_project):
+    project = make_project(options="abbreviations=Anna")
+    project.build()
+    cases = lexicon(project)["cases"]
+    assert cases["anna"]["abbreviation"]
+    assert not cases["anna"]["name"]
@@ -0,0 +1,95 @@
+"""
+The paragraph metrics, fed the tokens `build_stats` gives them.
+"""
+
+from splitoutline import SplitOutline
+from splitoutline.metrics import DialogueMetric, SentenceMetric
+
+
+def gather(metric, *paragraphs):
+    stats = {}
+    chars = 0
+    for text in paragraphs:
+        metric.paragraph(stats, [text], SplitOutline.word_re.split(text))
+        chars += len(text)
+    stats["__char__"] = chars
+    metric.finish(stats)
+    return stats
+
+
+def test_dialogue_words_and_characters():
+    stats = gather(DialogueMetric(), 'He waved. "Come in," she said.')
+    assert stats["__saidwc__"] == 2
+    # The comma inside the quotes is spoken; the quotes are not.
+    assert stats["__saidch__"] == len("Come in,")
+    assert stats["__saidpct__"] == 100.0 * len("Come in,") / len('He waved. "Come in," she said.')
+
+
+def test_curly_quotes_and_apostrophes():
+    stats = gather(DialogueMetric(),
+                   "“Don’t go,” said Anna. The dogs' bowls were empty, "
+                   "and it wasn't Bob's turn.")
+    # Apostrophes neither open nor close a quote.
+    assert stats["__saidwc__"] == 2
+    assert stats["__saidch__"] == len("Don’t go,")
+
+
+def test_quote_closes_at_end_of_paragraph():
+    stats = gather(DialogueMetric(),
+                   '"It went on and on',
+                   'and then the narration came back.')
+    assert stats["__saidwc__"] == 5
+
+
+def test_speakers():
+    stats = gather(DialogueMetric(),
+                   '"Nobody is here," said Anna. "Nobody at all."',
+                   '"You came," Bob said.',
+                   '"Where?" she asked.',
+                   'Anna looked at him. "Why?"')
+    # She is not named, and "Anna looked" has no speech verb.
+    assert stats["__saidby__"] == {"Anna": 6, "Bob": 2}
+    assert stats["__saidwc__"] == 10
+    assert stats["__saidby:Anna__"] == 60.0
+    assert stats["__saidby:Bob__"] == 20.0
+    columns = DialogueMetric().columns_for(stats)
+    assert [column[1] for column in columns[-2:]] == [
+        "Dialogue Share (Anna)", "Dialogue Share (Bob)"]
+
+
+def test_speakers_add_up_in_chapters():
+    metric = DialogueMetric()
+    total = {}
+    metric.combine(total, gather(metric, '"Yes," said Anna.'))
+    metric.combine(total, gather(metric, '"No, no," said Anna.',
+                                 '"Maybe," Bob said.'))
+    assert total["__saidby__"] == {"Anna": 3, "Bob": 1}
+    assert total["__saidwc__"] == 4
+
+
+def test_sentences():
+    stats = gather(SentenceMetric(), "One two. Three four five! Six",
+                   "... Seven?")
+    stats["__wc__"] = 7
+    SentenceMetric().finish(stats)
+    assert stats["__sent__"] == 4
+    assert stats["__wps__"] == 7 / 4.0
+
+
+def test_speaker_columns_in_history(project):
+    project.build()
+    header = project.read("scenes/.stats/meeting.dat").split("\r\n")[0].split("\t")
+    assert "Dialogue Share (Anna)" in header
+    assert "Dialogue Share (Bob)" in header
+    include = project.read("scenes/.stats/meeting.txt")
+    assert ":Dialogue % (Bob): " in include
+    # A new speaker gains a column, and the older row keeps its values.
+    project.edit("scenes/meeting.txt", '"Neither was I," said Anna.',
+                 '"Neither was I," said Anna.\n\n"Nor I," Carl said.')
+    project.build()
+    rows = [row.split("\t") for row in
+            project.read("scenes/.stats/meeting.dat").split("\r\n") if row]
+    assert rows[0][:len(header)] == header
+    assert rows[0][-1] == "Dialogue Share (Carl)"
+    assert len(rows) == 2
+    assert all(len(row) == len(rows[0]) for row in rows)
@@ -0,0 +1,49 @@
+"""
+`--openmetrics FILE` writes the figures of the run in the OpenMetrics text
+format when it ends.
+"""
+
+import os
+
+
+def read_metrics(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    assert text.endswith("# EOF\n")
+    samples = {}
+    family = None
+    for line in text.splitlines()[:-1]:
+        if line.startswith("# TYPE "):
+            family, kind = line[7:].split(" ")
+            assert kind == "gauge"
+        elif line.startswith("# HELP "):
+            assert line.split(" ")[2] == family
+        else:
+            name, value = line.rsplit(" ", 1)
+            assert name.split("{")[0] == family
+            samples[name] = float(value)
+    return samples
+
+
+def test_openmetrics_file(project, tmp_path):
+    path = str(tmp_path / "splitoutline.prom")
+    project.build("--openmetrics", path)
+    assert [name for name in os.listdir(str(tmp_path))
+            if name.endswith(".new")] == []
+    samples = read_metrics(path)
+    assert samples['splitoutline_scenes{state="filtered"}'] == 3
+    assert samples['splitoutline_scenes{state="reused"}'] == 0
+    assert samples['splitoutline_scenes{state="skipped"}'] == 0
+    words = project.read(".stats/book1.dat").split("\r\n")[1].split("\t")[1]
+    assert samples['splitoutline_words{project="book1"}'] == int(words)
+    assert samples["splitoutline_vocabulary_words"] > 0
+    assert samples["splitoutline_read_bytes"] > 0
+    assert samples["splitoutline_written_bytes"] > 0
+    assert samples['splitoutline_phase_seconds{phase="chapters"}'] >= 0
+    assert samples["splitoutline_running"] == 0
+
+    # Only the scenes of the chapter asked for are read.
+    project.build("--chapter", "1", "--openmetrics", path)
+    samples = read_metrics(path)
+    assert samples['splitoutline_scenes{state="filtered"}'] == 2
+    assert samples['splitoutline_scenes{state="skipped"}'] == 1
@@ -0,0 +1,138 @@
+"""
+Reading the outline: the parsed model is cached in the stat dir, and an
+outline may include others.
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from splitoutline import SplitOutline
+
+
+def parses(monkeypatch):
+    parsed = []
+    parse_outline = SplitOutline.parse_outline
+
+    def record(self, lines):
+        parsed.append(len(lines))
+        return parse_outline(self, lines)
+    monkeypatch.setattr(SplitOutline, "parse_outline", record)
+    return parsed
+
+
+def age(path, seconds=60):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_outline_cache(project, monkeypatch):
+    outline = project.path("book1/design/outline.txt")
+    age(outline)
+    parsed = parses(monkeypatch)
+    project.build()
+    assert len(parsed) == 1
+    cached = os.listdir(project.path(".stats/outlines"))
+    assert len(cached) == 1
+    model = json.loads(project.read(".stats/outlines/" + cached[0]))
+    assert model["path"] == os.path.abspath(outline)
+    assert model["model"]["outline"][0] == ["The Arrival", "/scenes/arrival",
+                                            "/scenes/meeting"]
+    project.build("--structure-only")
+    assert len(parsed) == 1
+
+    # The time is old, but the size gives the edit away.
+    st = os.stat(outline)
+    project.edit("book1/design/outline.txt", "The Journey", "The Long Journey")
+    os.utime(outline, ns=(st.st_atime_ns, st.st_mtime_ns))
+    project.build("--structure-only")
+    assert len(parsed) == 2
+    assert "The Long Journey" in project.read("book1/scenes/chapter-2.txt")
+
+
+def test_recent_outline_is_hashed(project, monkeypatch):
+    parsed = parses(monkeypatch)
+    project.build()
+    # Just written, so the text is hashed; it has not changed.
+    project.build("--structure-only")
+    assert len(parsed) == 1
+
+
+def test_dry_run_writes_no_cache(project):
+    project.build("--dry-run")
+    assert not os.path.exists(project.path(".stats/outlines"))
+
+
+main = """\
+Outline
+=======
+
+.. outline:start
+
+.. outline:include acts/act1.txt
+
+-
+
+  - `Meeting </scenes/meeting>`
+
+.. outline:include acts/act2.txt
+
+.. outline:end
+"""
+
+act1 = """\
+- The Arrival
+
+  - `Arrival <../../../scenes/arrival>`
+
+    Anna gets off the train.
+"""
+
+act2 = """\
+-
+
+  - `Journey <../../../scenes/journey>`
+
+    They leave the city.
+"""
+
+
+def split_up(project):
+    project.write("book1/design/outline.txt", main)
+    project.write("book1/design/acts/act1.txt", act1)
+    project.write("book1/design/acts/act2.txt", act2)
+
+
+def test_included_outlines(project, monkeypatch):
+    split_up(project)
+    parsed = parses(monkeypatch)
+    so = project.build()
+    assert so.outline == [["The Arrival", "/scenes/arrival"],
+                          ["Chapter 2", "/scenes/meeting"],
+                          ["Chapter 3", "/scenes/journey"]]
+    assert sorted(parsed) == sorted([len(main.splitlines()),
+                                     len(act1.splitlines()),
+                                     len(act2.splitlines())])
+    assert "Chapter 3" in project.read("book1/chapters/chapter-3.txt")
+    assert "They leave the city." in project.read("scenes/journey.txt")
+    assert len(os.listdir(project.path(".stats/outlines"))) == 3
+
+    # Only the act which changed is parsed again.
+    del parsed[:]
+    project.edit("book1/design/acts/act2.txt", "They leave the city.",
+                 "They leave the city at last.")
+    project.build()
+    assert parsed == [len(act2.splitlines())]
+    assert "at last." in project.read("scenes/journey.txt")
+
+
+def test_include_cycle(project, capsys):
+    split_up(project)
+    project.write("book1/design/acts/act2.txt",
+                  act2 + "\n.. outline:include ../outline.txt\n")
+    with pytest.raises(SystemExit) as e:
+        SplitOutline().main(["-c", project.ini])
+    assert e.value.code == 1
+    assert "includes itself" in capsys.readouterr().out
@@ -0,0 +1,30 @@
+"""
+`--chapter` and `--scene` runs bring the project totals up to date from the
+stats the other chapters were last given.
+"""
+
+
+def test_project_totals(make_project):
+    full = make_project("full")
+    project = make_project()
+    for built in (full, project):
+        built.build()
+        built.edit("scenes/journey.txt", '"Far enough," Bob said.',
+                   '"Far enough," Bob said. "Two days, if the rain holds."'
+                   '\n\n"Then we walk," said Carl.')
+    full.build()
+    project.build("--scene", "/scenes/journey")
+    want = full.tree()
+    got = project.tree()
+    assert got[".stats/book1.dat"] == want[".stats/book1.dat"]
+    assert got[".stats/book1.txt"] == want[".stats/book1.txt"]
+    assert b"Dialogue Share (Carl)" in got[".stats/book1.dat"]
+
+
+def test_totals_need_every_chapter(project):
+    project.build()
+    before = project.read(".stats/book1.dat")
+    project.edit("scenes/journey.txt", "before dawn", "after dawn and")
+    project.write("book1/chapters/.stats/chapter-1.dat", "")
+    project.build("--chapter", "2")
+    assert project.read(".stats/book1.dat") == before
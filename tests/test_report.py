@@ -0,0 +1,30 @@
+"""
+`splitoutline report` reads the histories and writes nothing.
+"""
+
+import shutil
+
+import pytest
+
+from splitoutline import SplitOutline, report
+
+
+def test_report_needs_numpy(project, monkeypatch, capsys):
+    monkeypatch.setattr(report, "numpy", None)
+    assert SplitOutline().main(["report", "-c", project.ini]) == 1
+    assert "NumPy" in capsys.readouterr().out
+
+
+def test_report_writes_nothing(project, capsys):
+    pytest.importorskip("numpy")
+    project.build()
+    # Without its cache the outline is parsed again, but the cache is
+    # not written back.
+    shutil.rmtree(project.path(".stats/outlines"))
+    capsys.readouterr()
+    before = project.files()
+    SplitOutline().main(["report", "-c", project.ini])
+    assert project.files() == before
+    out = capsys.readouterr().out
+    assert out.startswith("book1: %u words" % (
+        int(project.read(".stats/book1.dat").split("\r\n")[1].split("\t")[1]),))
@@ -0,0 +1,42 @@
+"""
+The revisions metric is only gathered when it is listed, and a word put in
+place of another counts as modified.
+"""
+
+import os
+
+revisions = "metrics=dialogue sentences revisions"
+
+
+def history(project, scene):
+    return project.read("scenes/.stats/%s.dat" % (scene,)).splitlines()
+
+
+def test_revisions_are_opt_in(project):
+    so = project.build()
+    assert "revisions" not in [metric.name for metric in so.metrics]
+    assert "Words Added" not in history(project, "arrival")[0]
+    assert not os.path.exists(project.path(".stats/fingerprints.json"))
+
+
+def test_replaced_word_is_modified(make_project):
+    project = make_project(options=revisions)
+    project.build()
+    assert os.path.exists(project.path(".stats/fingerprints.json"))
+    # One word put in place of another, and a paragraph added.
+    project.edit("scenes/arrival.txt", "The porter shrugged and went back",
+                 "The porter nodded and went back")
+    project.edit("scenes/arrival.txt", "to his bench.\n",
+                 "to his bench.\n\nThe lamps went out.\n")
+    so = project.build()
+    stats = so.stats["scenes/arrival"]
+    assert stats["__wmod__"] == 1
+    assert stats["__wadd__"] == 4
+    assert stats["__wdel__"] == 0
+    assert stats["__pmod__"] == 1
+    assert stats["__padd__"] == 1
+    assert stats["__pdel__"] == 0
+    assert "Words Modified" in history(project, "arrival")[0]
+    # Scenes which did not change were not revised.
+    stats = so.stats["scenes/journey"]
+    assert stats["__wadd__"] == stats["__wmod__"] == stats["__padd__"] == 0
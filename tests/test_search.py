@@ -0,0 +1,52 @@
+"""
+`splitoutline index` and `splitoutline search`.
+"""
+
+import os
+
+from splitoutline import SplitOutline
+
+
+def run(project, capsys, *args):
+    capsys.readouterr()
+    SplitOutline().main([args[0], "-c", project.ini] + list(args[1:]))
+    return capsys.readouterr().out.splitlines()
+
+
+def test_search(project, capsys):
+    assert run(project, capsys, "index") == ["Indexed 3 of 3 scenes."]
+    out = run(project, capsys, "search", "anna", "said anna")
+    assert out[0] == "book1: chapter 1 (The Arrival): /scenes/arrival"
+    assert '    "Nobody is here," [said Anna]. "Nobody at all."' in out
+    assert "book1: chapter 1 (The Arrival): /scenes/meeting" in out
+    assert out[-1].startswith("2 scenes matched")
+    # Every word must be in the scene.
+    out = run(project, capsys, "search", "anna", "porter")
+    assert out[0] == "book1: chapter 1 (The Arrival): /scenes/arrival"
+    assert out[-1].startswith("1 scenes matched")
+
+
+def test_phrase_stays_in_a_paragraph(project, capsys):
+    run(project, capsys, "index")
+    # "the clock." ends one paragraph and "Nobody" starts the next.
+    out = run(project, capsys, "search", "clock nobody")
+    assert out[-1].startswith("0 scenes matched")
+    out = run(project, capsys, "search", "the clock")
+    assert out[-1].startswith("1 scenes matched")
+
+
+def test_index_only_changed_scenes(project, capsys):
+    run(project, capsys, "index")
+    search = project.path(".stats/search")
+    before = set(os.listdir(search))
+    assert run(project, capsys, "index") == ["Indexed 0 of 3 scenes."]
+    project.edit("scenes/journey.txt", "walked until", "marched until")
+    assert run(project, capsys, "index") == ["Indexed 1 of 3 scenes."]
+    after = set(os.listdir(search))
+    # The old text of the scene is dropped with it.
+    assert len(after - before) == 1
+    assert len(before - after) == 1
+    out = run(project, capsys, "search", "marched")
+    assert out[0] == "book1: chapter 2 (The Journey): /scenes/journey"
+    out = run(project, capsys, "search", "walked")
+    assert out[-1].startswith("0 scenes matched")
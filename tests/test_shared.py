@@ -0,0 +1,57 @@
+"""
+A scene listed by two books is filtered and counted once per run.
+"""
+
+import os
+
+second = """\
+Sequel
+======
+
+.. outline:start
+
+- Again
+
+  - `Meeting </scenes/meeting>`
+
+    They meet once more.
+
+  - `Journey </scenes/journey>`
+
+    And set off.
+
+.. outline:end
+"""
+
+
+def add_sequel(project):
+    ini = project.read("splitoutline.ini")
+    project.write("splitoutline.ini", ini.replace(
+        "projects=book1", "projects=book1 book2") +
+        "[book2]\noutline={0}/book2/design/outline.txt\n"
+        "chapter-dir={0}/book2/chapters\n"
+        "chapter-stub-dir={0}/book2/scenes\n".format(project.root))
+    os.makedirs(project.path("book2/chapters"))
+    os.makedirs(project.path("book2/scenes"))
+    project.write("book2/design/outline.txt", second)
+
+
+def test_shared_scenes_are_filtered_once(make_project):
+    alone = make_project("alone")
+    alone.build()
+    project = make_project()
+    add_sequel(project)
+    so = project.build()
+    assert so.run_metrics.scenes["filtered"] == 3
+    assert so.run_metrics.scenes["reused"] == 2
+    # Both books get the same text, and the scene is counted only once.
+    book1 = project.read("book1/chapters/chapter-1.txt")
+    book2 = project.read("book2/chapters/chapter-1.txt")
+    assert '"Neither was I," said Anna.' in book1
+    meeting = book1.split("Meeting\n=======\n", 1)[1]
+    assert meeting in book2
+    for name in ("meeting", "journey"):
+        shared = project.read("scenes/.stats/%s.dat" % (name,))
+        single = alone.read("scenes/.stats/%s.dat" % (name,))
+        assert shared.split("\r\n")[1].split("\t")[1:] == \
+            single.split("\r\n")[1].split("\t")[1:]
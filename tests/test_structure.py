@@ -0,0 +1,28 @@
+"""
+The book's table of contents is written from `book-toc`, with or without
+`--structure-only`.
+"""
+
+from splitoutline.output import MemoryOutput
+
+
+def build(project, *args):
+    return project.build(*args, output=MemoryOutput()).output.files
+
+
+def test_structure_only_writes_book_toc(project):
+    project.write("splitoutline.ini", project.read("splitoutline.ini") +
+                  "book-toc=%s\nbook-title=A Test\n" %
+                  (project.path("book1/index.txt"),))
+    toc = project.path("book1/index.txt")
+    structure = build(project, "--structure-only")
+    full = build(project)
+    assert toc in structure
+    assert structure[toc] == full[toc]
+    text = structure[toc]
+    assert isinstance(text, str)
+    lines = text.splitlines()
+    assert lines[:3] == ["******", "A Test", "******"]
+    assert lines[-2:] == ["   chapters/chapter-%u" % (n,) for n in (1, 2)]
+    assert not any(path.startswith(project.path("book1/chapters"))
+                   for path in structure)
@@ -0,0 +1,57 @@
+"""
+The term index in the stat dir: term pages list the scenes using a term, and
+only scenes whose text changed are searched again.
+"""
+
+import json
+
+from splitoutline import SplitOutline
+
+
+def searched(monkeypatch):
+    markers = set()
+    gather_terms = SplitOutline.gather_terms
+
+    def record(self, marker, line, terms):
+        if marker is not None:
+            markers.add(marker)
+        return gather_terms(self, marker, line, terms)
+    monkeypatch.setattr(SplitOutline, "gather_terms", record)
+    return markers
+
+
+def test_term_pages(project):
+    project.build()
+    index = json.loads(project.read(".stats/terms.json"))
+    assert sorted(index["scenes"]) == ["scenes/arrival", "scenes/journey",
+                                       "scenes/meeting"]
+    assert index["scenes"]["scenes/meeting"]["terms"] == {"gray-tower": 1}
+    # The outline's mention is kept apart from the scene's own.
+    assert index["scenes"]["scenes/meeting"]["outline"] == {"gray-tower": 1}
+    assert project.read(".stats/gray-tower.txt") == (
+        "\n* :doc:`/book1`\n\n   * :doc:`/scenes/meeting`\n")
+
+
+def test_only_changed_scenes_are_searched(project, monkeypatch):
+    project.build()
+    markers = searched(monkeypatch)
+    project.build()
+    assert markers == set()
+    project.edit("scenes/journey.txt", "walked until",
+                 "walked past the :term:`Gray Tower` until")
+    project.build()
+    assert markers == set(["scenes/journey"])
+    assert project.read(".stats/gray-tower.txt") == (
+        "\n* :doc:`/book1`\n\n   * :doc:`/scenes/meeting`\n"
+        "   * :doc:`/scenes/journey`\n")
+
+
+def test_unused_term_page_is_removed(project):
+    project.build()
+    project.edit("scenes/meeting.txt", "the :term:`Gray Tower`, as",
+                 "the tower, as")
+    project.edit("book1/design/outline.txt", ":term:`Gray Tower`", "tower")
+    project.build()
+    assert ".stats/gray-tower.txt" not in project.files()
+    index = json.loads(project.read(".stats/terms.json"))
+    assert index["pages"] == {}
@@ -0,0 +1,45 @@
+"""
+Builds of different projects on threads at the same time must give the
+same files as the same builds made one after the other.
+"""
+
+import concurrent.futures
+
+import pytest
+
+from splitoutline.output import MemoryOutput
+
+
+@pytest.fixture
+def projects(make_project):
+    made = []
+    for i in range(6):
+        project = make_project("project-%u" % (i,))
+        # Each project gets text of its own, with a different speaker.
+        name = ("Carl", "Dora", "Emil", "Fay", "Gus", "Hal")[i]
+        for scene in ("arrival", "journey")[:1 + i % 2]:
+            project.edit("scenes/%s.txt" % (scene,), "\n\n", "\n\n%s\n\n" % (
+                " ".join('"%s," said %s.' % (" ".join(["word"] * n), name)
+                         for n in range(1, 2 + i)),))
+        made.append(project)
+    return made
+
+
+def build_in_memory(project):
+    return project.build(output=MemoryOutput()).output.files
+
+
+def test_threaded_builds_match_serial_builds(projects):
+    expected = [build_in_memory(project) for project in projects]
+    for files in expected:
+        assert len(files) > 0
+    # Every project twice, so the same project is built by two threads.
+    jobs = projects + projects
+    for attempt in range(3):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(build_in_memory, jobs))
+        for n, files in enumerate(results):
+            want = expected[n % len(projects)]
+            assert sorted(files) == sorted(want)
+            for path in want:
+                assert files[path] == want[path], path
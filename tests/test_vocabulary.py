@@ -0,0 +1,132 @@
+"""
+vocabulary=sketch against vocabulary=exact: the sketch stays within
+vocabulary-memory and can miss a name, about as often as the documented
+bound says, but never finds one the exact vocabulary does not.
+"""
+
+import json
+import math
+import random
+
+from splitoutline import SplitOutline
+from splitoutline.sketch import BloomFilter, TopK, default_depth
+
+
+def documented_bound(words, budget):
+    width = budget * 8 / default_depth
+    return (1 - math.exp(-words / width)) ** default_depth
+
+
+def made_up(count, seed):
+    rand = random.Random(seed)
+    return ["".join(rand.choice("abcdefghijklmnopqrstuvwxyz")
+                    for n in range(8)) for i in range(count)]
+
+
+def names(project):
+    cases = json.loads(project.read(".stats/lexicon.json"))["cases"]
+    return set(cases[lower]["canonical"] for lower in cases
+               if cases[lower]["name"])
+
+
+def tokenised(monkeypatch):
+    markers = []
+    store_cases = SplitOutline.store_cases
+
+    def record(self, marker, digest, cases):
+        markers.append(marker)
+        return store_cases(self, marker, digest, cases)
+    monkeypatch.setattr(SplitOutline, "store_cases", record)
+    return markers
+
+
+def test_bloom_filter_error_rate():
+    words = made_up(1500, 1)
+    others = set(made_up(20000, 2)) - set(words)
+    bloom = BloomFilter.sized(1024)
+    for word in words:
+        bloom.add(word)
+    assert all(word in bloom for word in words)
+    bound = documented_bound(len(words), 1024)
+    assert bound / 2 <= bloom.error_rate() <= bound * 2
+    found = len([word for word in others if word in bloom])
+    expected = len(others) * bound
+    assert abs(found - expected) <= 4 * math.sqrt(expected) + 1
+    assert 0.9 * len(words) <= bloom.cardinality() <= 1.1 * len(words)
+    again = BloomFilter.from_json(json.loads(json.dumps(bloom.to_json())))
+    assert again.bits == bloom.bits
+
+
+def test_top_k():
+    topk = TopK(3)
+    for word in ("anna", "anna", "bob", "carl"):
+        topk.add(word, word.title())
+    assert topk.exact("anna") == "Anna"
+    assert topk.exact("bob") == "Bob"
+    # A second casing is not exact.
+    topk.add("bob", "BOB")
+    assert "bob" in topk and topk.exact("bob") is None
+    # The least counted for longest makes way, and its count is an error.
+    topk.add("dora", "Dora")
+    assert "carl" not in topk
+    assert topk.entries["dora"] == [2, 1, "Dora"]
+    assert topk.exact("dora") is None
+    assert topk.exact("anna") == "Anna"
+    assert len(topk) == 3
+    again = TopK.from_json(json.loads(json.dumps(topk.to_json())))
+    assert again.entries == topk.entries
+    again.add("emil", "Emil")
+    assert "anna" not in again and "dora" in again
+
+
+def test_within_budget(make_project):
+    project = make_project(options="vocabulary=sketch\nvocabulary-memory=1")
+    project.edit("scenes/journey.txt", "before dawn", "before dawn, past " +
+                 " ".join(word.title() for word in made_up(40, 3)))
+    so = project.build()
+    assert len(so.lowercase.bits) + so.capitals.capacity * TopK.entry_size <= 1024
+    assert len(so.capitals) <= so.capitals.capacity
+
+
+def test_sketch_against_exact(make_project):
+    extra = " ".join(made_up(300, 4) + [word.title() for word in made_up(60, 5)])
+    exact = make_project("exact")
+    small = make_project("small", "vocabulary=sketch\nvocabulary-memory=1")
+    sketch = make_project("sketch", "vocabulary=sketch")
+    for project in (exact, small, sketch):
+        project.edit("scenes/journey.txt", "before dawn", "before dawn " + extra)
+        project.build()
+    assert "Anna" in names(exact)
+    assert names(sketch) == names(exact)
+    # Too small to count every name, but never finds one which is not.
+    assert names(small) < names(exact)
+
+
+def test_sketch_is_incremental(make_project, monkeypatch):
+    project = make_project(options="vocabulary=sketch")
+    project.build()
+    assert set(["Anna", "Bob"]) <= names(project)
+    markers = tokenised(monkeypatch)
+    project.build()
+    assert markers == []
+
+    project.edit("scenes/journey.txt", "before dawn", "before the bob of dawn")
+    project.build()
+    assert markers == ["scenes/journey"]
+    assert "Bob" not in names(project)
+    assert "bob" not in json.loads(project.read(".stats/lexicon.json"))[
+        "scenes"]["scenes/meeting"]["cases"]
+
+    # Once the filter has grown by a quarter, every scene is read again.
+    del markers[:]
+    project.edit("scenes/journey.txt", "before the bob of dawn",
+                 "before dawn " + " ".join(made_up(100, 6)))
+    project.build()
+    assert markers == ["scenes/journey"]
+    project.build()
+    assert sorted(markers) == ["scenes/arrival", "scenes/journey",
+                               "scenes/journey", "scenes/meeting"]
+    assert "Bob" in names(project)
+    del markers[:]
+    project.build()
+    assert markers == []